@@ -32,12 +32,13 @@
 
 from __future__ import print_function, division
 import os
-import itertools
 import mdtraj as md
 import numpy as np
 from mdtraj.pdb import element
 
 from mixtape.cmdline import Command, argument, argument_group
+from mixtape.featurizer import contact_pairs, variable_pairs
+from mixtape.utils import save_indices
 
 __all__ = ['AtomIndices']
 PROTEIN_RESIDUES = set([
@@ -50,7 +51,7 @@ PROTEIN_RESIDUES = set([
 #-----------------------------------------------------------------------------
 
 class AtomIndices(Command):
-    description="Create index file for atoms or distance pairs."
+    description="Create index file (.npy) for atoms or distance pairs."
     pdb = argument('-p', '--pdb', required=True, help='Path to PDB file')
     out = argument('-o', '--out', required=True, help='Path to output file')
 
@@ -60,6 +61,11 @@ class AtomIndices(Command):
         help='''Create a 2-dimensional index file with (N choose 2) rows and 2
         columns, where each row specifies a pair of indices. All (N choose 2)
         pairs of the selected atoms will be written.''')
+    group1.add_argument('-c', '--contact-pairs', action='store_true',
+        help='''Create an index file of the pairs of selected atoms that come
+        within --cutoff of each other in any frame of the PDB (or of
+        --sample), for the contact featurizer. This is usually far smaller
+        than the (N choose 2) pairs of --distance-pairs.''')
     group1.add_argument('-a', '--atoms', action='store_true',
         help='''Create a 1-dimensional index file containing the indices of the
         selected atoms.''')
@@ -78,6 +84,15 @@ class AtomIndices(Command):
     group2.add_argument('--all', action='store_true', help='''Selection
         includes every atom.''')
 
+    section3 = argument_group(description='Contact Pairs')
+    section3.add_argument('--cutoff', type=float, default=0.8, help='''Distance
+        cutoff, in nm, for --contact-pairs. default=0.8''')
+    section3.add_argument('--sample', type=str, help='''Trajectory (with the
+        PDB as its topology) whose frames are used to select the contact
+        pairs, instead of the PDB.''')
+    section3.add_argument('--n-pairs', type=int, help='''Keep only the N
+        contact pairs whose distance varies the most over the frames.''')
+
     def __init__(self, args):
         self.args = args
         if os.path.exists(args.out):
@@ -104,10 +119,29 @@ class AtomIndices(Command):
         print('Selected (%d) atoms from (%d) unique residues.' % (len(atom_indices),
             len(np.unique([self.pdb.topology.atom(i).residue.index for i in atom_indices]))))
 
+        if self.args.contact_pairs:
+            self.write_contact_pairs(atom_indices)
+            return
+        atom_indices = np.asarray(atom_indices, dtype=np.int32)
         if self.args.distance_pairs:
-            out = np.array(list(itertools.combinations(atom_indices, 2)))
+            # in the order of itertools.combinations
+            i, j = np.triu_indices(len(atom_indices), k=1)
+            out = np.column_stack((atom_indices[i], atom_indices[j]))
         elif self.args.atoms:
-            out = np.array(atom_indices)
+            out = atom_indices
         else:
             raise RuntimeError
-        np.savetxt(self.args.out, out, '%d')
+        save_indices(self.args.out, out)
+
+    def write_contact_pairs(self, atom_indices):
+        if self.args.sample is not None:
+            traj = md.load(os.path.expanduser(self.args.sample), top=self.pdb)
+        else:
+            traj = self.pdb
+        pairs = contact_pairs(traj.xyz, atom_indices, self.args.cutoff)
+        print('Selected (%d) pairs within %g nm in (%d) frames.' % (
+            len(pairs), self.args.cutoff, len(traj)))
+        if self.args.n_pairs is not None:
+            pairs = variable_pairs(traj.xyz, pairs, self.args.n_pairs)
+            print('Kept the (%d) pairs with the most variable distance.' % len(pairs))
+        save_indices(self.args.out, pairs)
@@ -39,6 +39,7 @@ from mdtraj.geometry.dihedral import (_atom_sequence, PHI_ATOMS, PSI_ATOMS,
     OMEGA_ATOMS, CHI1_ATOMS, CHI2_ATOMS, CHI3_ATOMS, CHI4_ATOMS)
 
 from mixtape.cmdline import Command, argument, argument_group
+from mixtape.utils import save_indices
 
 __all__ = ['DihedralIndices']
 
@@ -47,7 +48,7 @@ __all__ = ['DihedralIndices']
 #-----------------------------------------------------------------------------
 
 class DihedralIndices(Command):
-    description="Create index file for dihedral angles."
+    description="Create index file (.npy) for dihedral angles."
     pdb = argument('-p', '--pdb', required=True, help='Path to PDB file')
     out = argument('-o', '--out', required=True, help='Path to output file')
     
@@ -107,4 +108,4 @@ class DihedralIndices(Command):
         indices = np.vstack(x for x in indices if x.size)[id_sort]
         print('Selected (%d) dihedrals from (%d) unique residues.' % (len(indices),
             len(np.unique(rids))))
-        np.savetxt(self.args.out, indices, '%d')
+        save_indices(self.args.out, indices)
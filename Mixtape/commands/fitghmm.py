@@ -133,7 +133,7 @@ class FitGHMM(Command, MDTrajInputMixin):
         kwargs = dict(n_states=n_states, n_features=self.n_features, n_em_iter=args.n_em_iter,
             n_lqa_iter = args.n_lqa_iter, fusion_prior=args.fusion_prior,
             thresh=args.thresh, reversible_type=args.reversible_type,
-                    platform=args.platform)
+                    platform=args.platform, n_jobs=args.n_jobs)
         print(kwargs)
         model = GaussianFusionHMM(**kwargs)
 
@@ -176,11 +176,11 @@ class FitGHMM(Command, MDTrajInputMixin):
     def load_data(self):
         load_time_start = time.time()
         data = []
-        for tfn in self.filenames:
-            kwargs = {} if tfn.endswith('h5') else {'top': self.top}
-            for t in md.iterload(tfn, chunk=self.args.split, **kwargs):
-                features = self.featurizer.featurize(t)
-                data.append(features)
+        for _, features in mixtape.featurizer.featurize_files(
+                self.filenames, self.featurizer, self.top,
+                chunk=self.args.split, n_jobs=self.args.n_jobs,
+                cache=self.featurization_cache()):
+            data.extend(features)
 
         print('Loading data into memory + vectorization: %f s' % (time.time() - load_time_start))
         print('Fitting with %s timeseries from %d trajectories with %d total observations' % (
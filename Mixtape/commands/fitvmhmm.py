@@ -42,6 +42,9 @@ import mdtraj as md
 from mixtape.vmhmm import VonMisesHMM
 from mixtape.cmdline import Command, argument_group, MultipleIntAction
 from mixtape.commands.mixins import MDTrajInputMixin
+from mixtape.utils import load_indices
+from mixtape.featurizer import DihedralFeaturizer
+import mixtape.featurizer
 
 __all__ = ['FitVMHMM']
 
@@ -67,11 +70,15 @@ class FitVMHMM(Command, MDTrajInputMixin):
     '''
 
     group_munge = argument_group('Munging Options')
-    group_munge.add_argument('-d', '--dihedral-indices', required=True, type=str,
+    group_vector = group_munge.add_mutually_exclusive_group(required=True)
+    group_vector.add_argument('-d', '--dihedral-indices', type=str,
         help='''Vectorize the MD trajectories by extracting timeseries of the
-        dihedral (torsion) angles between sets of 4 atoms. Supply a text file
-        where each row contains the space-separate indices of four atoms which
-        form a dihedral angle to monitor. These indices are 0-based.''')
+        dihedral (torsion) angles between sets of 4 atoms. Supply an index file
+        (.npy, or text) where each row contains the indices of four atoms
+        which form a dihedral angle to monitor. These indices are 0-based.''')
+    group_vector.add_argument('--featurizer', type=str, help='''Path to a
+        saved dihedral featurizer object, whose features are the angles
+        (see the featurizer command).''')
 
     group_hmm = argument_group('HMM Options')
     group_hmm.add_argument('-k', '--n-states', action=MultipleIntAction, default=[2],
@@ -107,11 +114,19 @@ class FitVMHMM(Command, MDTrajInputMixin):
         self.args = args
         self.top = md.load(args.top) if args.top is not None else None
 
-        self.indices = np.loadtxt(args.dihedral_indices, dtype=int, ndmin=2)
-        if self.indices.shape[1] != 4:
-            self.error('dihedral-indices must have shape (N, 4). %s had shape %s' % (args.dihedral_indices, self.indices.shape))
+        if args.featurizer is not None:
+            self.featurizer = mixtape.featurizer.load(args.featurizer)
+            if not (isinstance(self.featurizer, DihedralFeaturizer)
+                    and not self.featurizer.sincos):
+                self.error('featurizer must be a dihedral featurizer of the '
+                           'angles, without the sin/cos embedding')
+        else:
+            indices = load_indices(args.dihedral_indices)
+            if indices.shape[1] != 4:
+                self.error('dihedral-indices must have shape (N, 4). %s had shape %s' % (args.dihedral_indices, indices.shape))
+            self.featurizer = DihedralFeaturizer(indices)
         self.filenames = glob.glob(args.dir + '/*.' + args.ext)
-        self.n_features = self.indices.shape[0]
+        self.n_features = self.featurizer.n_features
         
     def start(self):
         args = self.args
@@ -128,7 +143,8 @@ class FitVMHMM(Command, MDTrajInputMixin):
     def fit(self, data, n_states, lag_time, outfile):
         model = VonMisesHMM(n_states=n_states,
             reversible_type=self.args.reversible_type,
-            n_iter=self.args.n_em_iter, thresh=self.args.thresh)
+            n_iter=self.args.n_em_iter, thresh=self.args.thresh,
+            n_jobs=self.args.n_jobs)
         start = time.time()
         model.fit(data)
         end = time.time()
@@ -153,14 +169,10 @@ class FitVMHMM(Command, MDTrajInputMixin):
         outfile.write('\n')
 
     def load_data(self):
-        load_time_start = time.time()
         data = []
-        for tfn in self.filenames:
-            kwargs = {} if tfn.endswith('h5') else {'top': self.top}
-            for t in md.iterload(tfn, chunk=self.args.split, **kwargs):
-                item = np.asarray(md.compute_dihedrals(t, self.indices), np.double)
-                data.append(item)
+        for _, features in mixtape.featurizer.featurize_files(
+                self.filenames, self.featurizer, self.top, chunk=self.args.split,
+                n_jobs=self.args.n_jobs,
+                cache=self.featurization_cache()):
+            data.extend(features)
         return data
-
-
-                    
@@ -1,5 +1,7 @@
+import os
 import mdtraj as md
 from mixtape.cmdline import argument_group
+from mixtape.featurizer import FeaturizationCache
 
 class MDTrajInputMixin(object):
     """Mixin for a command to accept trajectory input files"""
@@ -10,6 +12,25 @@ class MDTrajInputMixin(object):
         loading trajectories''', required=True)
     group_mdtraj.add_argument('--ext', help='File extension of the trajectories',
         required=True, choices=[e[1:] for e in md._FormatRegistry.loaders.keys()])
+    group_mdtraj.add_argument('--n-jobs', type=int, default=1, help='''Number
+        of processes with which to load and featurize the trajectories, and
+        to run the restarts of the k-means hot start of the models that are
+        fit. If -1, all CPUs are used. default=1''')
+    group_mdtraj.add_argument('--cache-dir', type=str,
+        default=os.environ.get('MIXTAPE_CACHE_DIR'), help='''Directory in
+        which to cache the features of the trajectories, to be reused by
+        later commands with the same featurizer. default=$MIXTAPE_CACHE_DIR,
+        or no caching if it isn't set''')
+    group_mdtraj.add_argument('--cache-size', type=float, default=10, help='''
+        Maximum size of the cache, in GB. The least recently used entries
+        are evicted beyond it. default=10''')
+
+    def featurization_cache(self):
+        """The FeaturizationCache selected by --cache-dir, or None."""
+        if self.args.cache_dir is None:
+            return None
+        return FeaturizationCache(self.args.cache_dir,
+                                  int(self.args.cache_size * 1e9))
 
 
 class GaussianFeaturizationMixin(object):
@@ -17,10 +38,23 @@ class GaussianFeaturizationMixin(object):
     group_vector = group_munge.add_mutually_exclusive_group(required=True)
     group_vector.add_argument('-d', '--distance-pairs', type=str, help='''Vectorize
         the MD trajectories by extracting timeseries of the distance
-        between pairs of atoms in each frame. Supply a text file where
-        each row contains the space-separate indices of two atoms which
-        form a pair to monitor''')
+        between pairs of atoms in each frame. Supply an index file (.npy,
+        or text) where each row contains the indices of two atoms which form
+        a pair to monitor''')
+    group_vector.add_argument('--contact-pairs', type=str, help='''Vectorize
+        the MD trajectories by extracting timeseries of the distance between
+        a sparse set of atom pairs. Supply the index file written by
+        atomindices --contact-pairs.''')
     group_vector.add_argument('-a', '--atom-indices', type=str, help='''Superpose
         each MD conformation on the coordinates in the topology file, and then use
         the distance from each atom in the reference conformation to the
         corresponding atom in each MD conformation.''')
+    group_vector.add_argument('--dihedral-indices', type=str, help='''Vectorize
+        the MD trajectories by extracting timeseries of the dihedral (torsion)
+        angles between sets of 4 atoms. Supply an index file where each row
+        contains the indices of the four atoms forming a
+        dihedral, e.g. from the dihedralindices command.''')
+    group_munge.add_argument('--dihedral-embedding', choices=['angles', 'sincos'],
+        default='angles', help='''With --dihedral-indices, use the angles
+        themselves as the features (for a von Mises HMM), or their sines and
+        cosines (for a Gaussian HMM). default="angles"''')
@@ -69,26 +69,46 @@ class PullMeansGHMM(SampleGHMM):
 
     def start(self):
         featurizer = mixtape.featurizer.load(self.args.featurizer)
+        means = np.array(self.model['means'])
+        variances = np.array(self.model['vars'])
+        n_states = self.model['n_states']
+        n_per_state = self.args.n_per_state
 
-        features, ii, ff = mixtape.featurizer.featurize_all(self.filenames, featurizer, self.topology)
-        logprob = log_multivariate_normal_density(features, np.array(self.model['means']),
-            np.array(self.model['vars']), covariance_type='diag')
+        # For each state, the (at most) n_per_state frames assigned to it
+        # with the highest log probability so far, as the features are
+        # streamed through in chunks
+        best_logprob = [np.empty(0) for k in range(n_states)]
+        best_file_ids = [np.empty(0, dtype=np.int32) for k in range(n_states)]
+        best_frames = [np.empty(0, dtype=np.int32) for k in range(n_states)]
 
-        assignments = np.argmax(logprob, axis=1)
-        probs = np.max(logprob, axis=1)
+        for file_id, start, X in mixtape.featurizer.featurize_chunks(
+                self.filenames, featurizer, self.topology,
+                n_jobs=self.args.n_jobs, cache=self.featurization_cache()):
+            logprob = log_multivariate_normal_density(X, means, variances,
+                covariance_type='diag')
+            assignments = np.argmax(logprob, axis=1)
+            probs = np.max(logprob, axis=1)
 
-        data = {'filename': [], 'index': [], 'state': []}
-        for k in range(self.model['n_states']):
-            # pick the structures that have the highest log 
-            # probability in the state
-            p = probs[assignments==k]
-            sorted_filenms = ff[assignments==k][p.argsort()]
-            sorted_indices = ii[assignments==k][p.argsort()]
+            for k in range(n_states):
+                frames = np.flatnonzero(assignments == k).astype(np.int32)
+                p = np.concatenate((best_logprob[k], probs[frames]))
+                file_ids = np.concatenate((best_file_ids[k],
+                    np.repeat(np.int32(file_id), len(frames))))
+                frames = np.concatenate((best_frames[k], start + frames))
+                if len(p) > n_per_state:
+                    keep = np.argpartition(p, -n_per_state)[-n_per_state:]
+                    p, file_ids, frames = p[keep], file_ids[keep], frames[keep]
+                best_logprob[k], best_file_ids[k], best_frames[k] = p, file_ids, frames
 
-            if len(p) > 0:
-                data['index'].extend(sorted_indices[-self.args.n_per_state:])
-                data['filename'].extend(sorted_filenms[-self.args.n_per_state:])
-                data['state'].extend([k]*self.args.n_per_state)
+        data = {'filename': [], 'index': [], 'state': []}
+        for k in range(n_states):
+            # the structures that have the highest log probability in the
+            # state, in increasing order
+            order = np.argsort(best_logprob[k])
+            if len(order) > 0:
+                data['index'].extend(best_frames[k][order])
+                data['filename'].extend(self.filenames[i] for i in best_file_ids[k][order])
+                data['state'].extend([k]*len(order))
             else:
                 print('WARNING: NO STRUCTURES ASSIGNED TO STATE=%d' % k)
 
@@ -124,15 +124,17 @@ class SampleGHMM(Command, MDTrajInputMixin):
 
 
     def start(self):
-        print('loading all data...')
-        xx, ii, ff = mixtape.featurizer.featurize_all(self.filenames, self.featurizer, self.topology)
-        print('done loading')
+        # the features are streamed from disk, in chunks, on each pass of
+        # the optimizer in discrete_approx_mvn
+        stream = mixtape.featurizer.FeatureStream(
+            self.filenames, self.featurizer, self.topology,
+            n_jobs=self.args.n_jobs, cache=self.featurization_cache())
 
         data = {'filename': [], 'index': [], 'state': []}
         for k in range(self.model['n_states']):
             print('computing weights for k=%d...' % k)
             try:
-                weights = discrete_approx_mvn(xx, self.model['means'][k],
+                weights = discrete_approx_mvn(stream, self.model['means'][k],
                     self.model['vars'][k], self.match_vars)
             except NotSatisfiableError:
                 self.error('Satisfiability failure. Could not match the means & '
@@ -140,11 +142,12 @@ class SampleGHMM(Command, MDTrajInputMixin):
                            'constraint on the variances with --no-match-vars?')
 
             cumsum = np.cumsum(weights)
-            for i in range(self.args.n_per_state):
-                index = np.sum(cumsum < np.random.rand())
-                data['filename'].append(ff[index])
-                data['index'].append(ii[index])
-                data['state'].append(k)
+            indices = np.searchsorted(cumsum, np.random.rand(self.args.n_per_state))
+            file_ids, frames = stream.index.locate(np.minimum(indices, len(cumsum) - 1))
+            data['filename'].extend(self.filenames[i] for i in file_ids)
+            data['index'].extend(frames)
+            data['state'].extend([k] * len(frames))
+        stream.close()
 
         df = pd.DataFrame(data)
         print('Saving the indices of the sampled states in CSV format to %s' % self.out)
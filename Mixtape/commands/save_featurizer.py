@@ -36,8 +36,10 @@ import numpy as np
 import mdtraj as md
 
 from mixtape.cmdline import Command, argument_group
+from mixtape.utils import load_indices
 from mixtape.commands.mixins import GaussianFeaturizationMixin
-from mixtape.featurizer import SuperposeFeaturizer, AtomPairsFeaturizer
+from mixtape.featurizer import (SuperposeFeaturizer, AtomPairsFeaturizer,
+    ContactFeaturizer, DihedralFeaturizer)
 
 __all__ = ['SaveFeaturizer']
 
@@ -64,12 +66,23 @@ class SaveFeaturizer(Command, GaussianFeaturizationMixin):
             self.top = None
 
         if args.distance_pairs is not None:
-            self.indices = np.loadtxt(args.distance_pairs, dtype=int, ndmin=2)
+            self.indices = load_indices(args.distance_pairs)
             if self.indices.shape[1] != 2:
                 self.error('distance-pairs must have shape (N, 2). %s had shape %s' % (args.distance_pairs, self.indices.shape))
             featurizer = AtomPairsFeaturizer(self.indices, self.top)                
+        elif args.contact_pairs is not None:
+            self.indices = load_indices(args.contact_pairs)
+            if self.indices.shape[1] != 2:
+                self.error('contact-pairs must have shape (N, 2). %s had shape %s' % (args.contact_pairs, self.indices.shape))
+            featurizer = ContactFeaturizer(self.indices, self.top)
+        elif args.dihedral_indices is not None:
+            self.indices = load_indices(args.dihedral_indices)
+            if self.indices.shape[1] != 4:
+                self.error('dihedral-indices must have shape (N, 4). %s had shape %s' % (args.dihedral_indices, self.indices.shape))
+            featurizer = DihedralFeaturizer(self.indices,
+                sincos=args.dihedral_embedding == 'sincos')
         else:
-            self.indices = np.loadtxt(args.atom_indices, dtype=int, ndmin=2)
+            self.indices = load_indices(args.atom_indices)
             if self.indices.shape[1] != 1:
                 self.error('atom-indices must have shape (N, 1). %s had shape %s' % (args.atom_indices, self.indices.shape))
             self.indices = self.indices.reshape(-1)
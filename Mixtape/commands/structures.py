@@ -54,6 +54,8 @@ class Structures(Command):
         One trajectory file in the specified format will be saved with
         the name <prefix>-<state-index>.<extension>. default="state"''',
         default='state')
+    chunk = argument('--chunk', type=int, default=1000, help='''Number of
+        frames of each trajectory to load at a time. default=1000''')
 
     def outfn(self, state):
         return '%s-%d.%s' % (self.prefix, state, self.ext)
@@ -62,6 +64,7 @@ class Structures(Command):
         self.filename = args.filename
         self.ext = args.ext
         self.prefix = args.prefix
+        self.chunk = args.chunk
         self.top = md.load(args.top).topology
 
     def start(self):
@@ -80,14 +83,34 @@ class Structures(Command):
             if os.path.exists(fn):
                 self.error('IOError: file exists: %s' % fn)
 
+        # each file is streamed through once, and the selected frames of
+        # each state are sliced out of it, in order
         frames = defaultdict(lambda: [])
         for fn, group in df.groupby('filename'):
-            for _, row in group.sort('index').iterrows():
-                frames[row['state']].append(
-                    md.load_frame(fn, row['index'], top=self.top))
+            group = group.sort('index')
+            states = group['state'].values
+            traj = self.load_frames(fn, group['index'].values.astype(int))
+            for state in np.unique(states):
+                frames[state].append(traj[np.where(states == state)[0]])
 
         for state, samples in frames.items():
             traj = samples[0].join(samples[1:])
             print('saving %s...' % self.outfn(state))
             traj.save(self.outfn(state), force_overwrite=False)
         print('done')
+
+    def load_frames(self, fn, indices):
+        """Load the frames `indices` (sorted) of a trajectory, a chunk at a
+        time, so that only the selected frames are kept in memory."""
+        selected = []
+        start = 0
+        for chunk in md.iterload(fn, chunk=self.chunk, top=self.top):
+            lo, hi = np.searchsorted(indices, [start, start + len(chunk)])
+            if hi > lo:
+                selected.append(chunk[indices[lo:hi] - start])
+            start += len(chunk)
+            if hi == len(indices):
+                break
+        if sum(len(t) for t in selected) != len(indices):
+            self.error('IndexError: %s has only %d frames' % (fn, start))
+        return selected[0].join(selected[1:])
@@ -30,7 +30,6 @@
 # Imports
 #-----------------------------------------------------------------------------
 import numpy as np
-import scipy.misc
 import scipy.linalg
 import scipy.optimize
 from mdtraj.utils import ensure_type
@@ -45,7 +44,7 @@ class NotSatisfiableError(Exception):
     pass
 
 
-def discrete_approx_mvn(X, means, covars, match_variances=True):
+def discrete_approx_mvn(X, means, covars, match_variances=True, chunk_size=100000):
     """Find a discrete approximation to a multivariate normal distribution.
 
     The method employs find the discrete distribution with support only at the
@@ -55,8 +54,10 @@ def discrete_approx_mvn(X, means, covars, match_variances=True):
 
     Parameters
     ----------
-    X : np.ndarray, shape=(n_points, n_features)
-        The allowable points
+    X : np.ndarray, shape=(n_points, n_features), or iterable of np.ndarray
+        The allowable points. Instead of an array, X can be a re-iterable
+        stream of chunks of points, such as a mixtape.featurizer.FeatureStream,
+        which is traversed once per iteration of the optimizer.
     means : np.ndarray, shape=(n_features)
         The mean vector of the MVN
     covars : np.ndarray, shape=(n_features, n_features) or shape=(n_features,)
@@ -67,6 +68,9 @@ def discrete_approx_mvn(X, means, covars, match_variances=True):
         When True, both the means and the variances of the discrete distribution
         are constrained. Under some circumstances, this is not satisfiable (e.g.
         if there aren't enough samples
+    chunk_size : int, optional
+        When X is an array, it is processed in chunks of this many points,
+        to limit the size of the temporary arrays.
 
     Returns
     -------
@@ -110,61 +114,89 @@ def discrete_approx_mvn(X, means, covars, match_variances=True):
     of continuous distributions by maximum entropy." Economics Letters 118.3
     (2013): 445-450.
     """
-    X = ensure_type(np.asarray(X), dtype=np.float32, ndim=2, name='X', warn_on_cast=False)
     means = ensure_type(np.asarray(means), np.float64, ndim=1, name='means', warn_on_cast=False)
     covars = np.asarray(covars)
 
-    # Get the un-normalized probability of each point X_i in the MVN
-    # `prob` are the q(X_i) in the mathematics
     # `moments` are the \bar{T} that we want to match.
     if covars.ndim == 1:
         # diagonal covariance case
         if not len(covars) == len(means):
             raise ValueError('Shape Error: covars and means musth have the same length')
-        prob = np.exp(-0.5 * np.sum(1./np.sqrt(covars) * (X - means)**2, axis=1))
         moments = np.concatenate((means, covars)) if match_variances else means
-
+        cv_chol = None
     elif covars.ndim == 2:
         if not (covars.shape[0] == len(means) and covars.shape[1] == len(means)):
             raise ValueError('Shape Error: covars must be square, with size = len(means)')
-
         # full 2d covariance matrix
         cv_chol = scipy.linalg.cholesky(covars, lower=True)
-        cv_sol = scipy.linalg.solve_triangular(cv_chol, (X - means).T, lower=True).T
-        prob = np.exp(-0.5 * (np.sum(cv_sol ** 2, axis=1)))
         moments = np.concatenate((means, np.diag(covars))) if match_variances else means
     else:
         raise ValueError('covars must be 1D or 2D')
 
-    # this is T(x_i) for each X_i
-    moment_contributions = np.hstack((X, (X-means)**2)) if match_variances else X
+    def chunks():
+        # For each chunk of points, the un-normalized log probability of
+        # each point X_i in the MVN (the log q(X_i) in the mathematics), and
+        # T(X_i), its contribution to the moments
+        for x in _iter_chunks(X, chunk_size):
+            x = ensure_type(np.asarray(x), dtype=np.float32, ndim=2, name='X', warn_on_cast=False)
+            if cv_chol is None:
+                log_prob = -0.5 * np.sum(1./np.sqrt(covars) * (x - means)**2, axis=1)
+            else:
+                cv_sol = scipy.linalg.solve_triangular(cv_chol, (x - means).T, lower=True).T
+                log_prob = -0.5 * (np.sum(cv_sol ** 2, axis=1))
+            moment_contributions = np.hstack((x, (x-means)**2)) if match_variances else x
+            yield log_prob, moment_contributions
 
     def objective_and_grad(l):
-        dot = np.dot(moment_contributions, l)
-        lse = scipy.misc.logsumexp(dot, b=prob)
+        # log(sum_i q(X_i) exp(T(X_i).l)), and the sum weighted by T(X_i),
+        # accumulated over the chunks relative to a running maximum
+        log_max = -np.inf
+        total = 0.0
+        weighted = np.zeros_like(moments)
+        for log_prob, moment_contributions in chunks():
+            if len(log_prob) == 0:
+                continue
+            log_terms = log_prob + np.dot(moment_contributions, l)
+            chunk_max = log_terms.max()
+            if chunk_max > log_max:
+                scale = np.exp(log_max - chunk_max)
+                total *= scale
+                weighted *= scale
+                log_max = chunk_max
+            terms = np.exp(log_terms - log_max)
+            total += np.sum(terms)
+            weighted += np.dot(terms, moment_contributions)
+
+        lse = np.log(total) + log_max
         # value of the objective function
         obj_value = lse - np.dot(l, moments)
-
         # gradient of objective function
-        dot_max = dot.max(axis=0)
-        log_numerator = np.log(np.sum(moment_contributions * (prob * np.exp(dot -
-                            dot_max)).reshape(-1,1), axis=0)) + dot_max
-        grad_value = np.exp(log_numerator - lse) - moments
-
+        grad_value = weighted / total - moments
         return obj_value, grad_value
 
     result = scipy.optimize.minimize(objective_and_grad, jac=True, x0=np.ones_like(moments), method='BFGS')
     if not result['success']:
         raise NotSatisfiableError()
 
-    dot = np.dot(moment_contributions, result['x'])
-    log_denominator = scipy.misc.logsumexp(dot, b=prob)
-    weights = prob * np.exp(dot - log_denominator)
+    log_weights = np.concatenate([log_prob + np.dot(moment_contributions, result['x'])
+                                  for log_prob, moment_contributions in chunks()])
+    weights = np.exp(log_weights - log_weights.max())
     if not np.all(np.isfinite(weights)):
         raise NotSatisfiableError()
     weights = weights / np.sum(weights)
     return weights
 
+
+def _iter_chunks(X, chunk_size):
+    """Iterate over the rows of X in chunks, if it's an array, or else
+    over the chunks of a stream of arrays."""
+    if isinstance(X, np.ndarray):
+        for start in range(0, max(len(X), 1), chunk_size):
+            yield X[start:start+chunk_size]
+    else:
+        for x in X:
+            yield x
+
 if __name__ == '__main__':
     np.random.seed(10)
     import matplotlib.pyplot as pp
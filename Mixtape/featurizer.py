@@ -1,28 +1,607 @@
+import os
+import glob
+import collections
+import json
+import shutil
+import hashlib
+import itertools
+import tempfile
+import multiprocessing
 import cPickle
 import numpy as np
 import mdtraj as md
 
-def featurize_all(filenames, featurizer, topology):
-    """Iterate over filenames, load trajectories, and featurize."""
-    X = []
-    i = []
-    f = []
-    for file in filenames:
-        kwargs = {}  if file.endswith('.h5') else {'top': topology}
-        t = md.load(file, **kwargs)
-        x = featurizer.featurize(t)
+# the featurizer and topology of a pool worker, set once by _init_worker
+# rather than pickled with every task
+_worker = {}
+
+
+def _fingerprint(obj, h):
+    """Update the hash `h` with the value of obj, for the parameters of a
+    featurizer: arrays, trajectories, and containers and objects of them."""
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind in 'iu':
+            # index arrays hash alike whether they were loaded as int32
+            # (.npy index files) or int64 (text index files)
+            obj = obj.astype(np.int64)
+        h.update(repr((obj.dtype.str, obj.shape)).encode())
+        h.update(np.ascontiguousarray(obj).view(np.uint8).data)
+    elif isinstance(obj, np.generic):
+        # numpy scalars hash like the equal Python numbers
+        _fingerprint(obj.item(), h)
+    elif isinstance(obj, md.Trajectory):
+        _fingerprint(obj.xyz, h)
+        _fingerprint([str(a) for a in obj.topology.atoms], h)
+    elif isinstance(obj, dict):
+        for key in sorted(obj):
+            _fingerprint(key, h)
+            _fingerprint(obj[key], h)
+    elif isinstance(obj, (list, tuple)):
+        h.update(repr((type(obj).__name__, len(obj))).encode())
+        for item in obj:
+            _fingerprint(item, h)
+    elif hasattr(obj, '__dict__'):
+        # private attributes (e.g. lazily loaded references) don't affect
+        # the features
+        h.update(repr((type(obj).__module__, type(obj).__name__)).encode())
+        _fingerprint(dict((k, v) for k, v in vars(obj).items()
+                          if not k.startswith('_')), h)
+    else:
+        h.update(repr(obj).encode())
+
+
+class FeaturizationCache(object):
+    """On-disk cache of the features of trajectory files.
+
+    An entry is keyed by the identity of the trajectory file (its absolute
+    path, size and modification time), a fingerprint of the parameters of
+    the featurizer, and the chunk size it was loaded with. The features are
+    stored in float32, as .npy files in `cache_dir`. When the cache grows
+    past `max_size` bytes, the least recently used entries are evicted. The
+    size of the cache is tracked from the entries added since the directory
+    was last scanned, so it's only scanned when the size crosses max_size.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory of the cache. Created if it doesn't exist.
+    max_size : int, optional
+        Maximum total size of the cache, in bytes. If None, unbounded.
+    """
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_size = max_size
+        # total size of the entries, as of the last scan of the directory
+        # plus the entries put since, or None before the first scan
+        self._size = None
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def fingerprint(self, featurizer):
+        """A digest of the public parameters of a featurizer, to be passed
+        to key(). It is the same for equal featurizers, wherever they were
+        built or loaded from."""
+        h = hashlib.sha1()
+        _fingerprint(featurizer, h)
+        return h.hexdigest()
+
+    def key(self, filename, fingerprint, chunk):
+        """The cache key of the features of a file, with the featurizer
+        whose fingerprint() is `fingerprint`."""
+        st = os.stat(filename)
+        h = hashlib.sha1()
+        _fingerprint((os.path.abspath(filename), st.st_size, st.st_mtime,
+                      chunk, fingerprint), h)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npy')
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key, chunk):
+        """The features of each chunk of a file, or None if the entry is
+        not in the cache."""
+        path = self._path(key)
+        try:
+            X = np.load(path)
+            # mark the entry as recently used
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        if chunk and len(X) > chunk:
+            return np.split(X, np.arange(chunk, len(X), chunk))
+        return [X]
+
+    def put(self, key, features):
+        """Store the features of each chunk of a file."""
+        X = np.concatenate(features).astype(np.float32)
+        # write to a temporary file and rename it into place, so that
+        # readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, X)
+        os.rename(tmp, self._path(key))
+        if self.max_size is None:
+            return
+        if self._size is not None:
+            self._size += os.path.getsize(self._path(key))
+        if self._size is None or self._size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries, until the cache is no
+        larger than max_size."""
+        if self.max_size is None:
+            return
+        entries = []
+        for path in glob.glob(os.path.join(self.cache_dir, '*.npy')):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(e[1] for e in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+        self._size = total
+
+
+def _init_worker(featurizer, topology, shared_dir, cache):
+    _worker['featurizer'] = featurizer
+    _worker['topology'] = topology
+    _worker['shared_dir'] = shared_dir
+    _worker['cache'] = cache
+
+
+def _featurize_file(filename, featurizer, topology, chunk):
+    """Load and featurize one trajectory file, in chunks of `chunk` frames
+    if chunk is nonzero. Returns a list of the feature arrays."""
+    kwargs = {} if filename.endswith('.h5') else {'top': topology}
+    featurize = featurizer.featurize
+
+    # only load the atoms that the featurizer reads
+    atoms = featurizer.required_atoms()
+    if atoms is not None:
+        atoms = np.unique(atoms)
+        positions = np.empty(atoms[-1] + 1, dtype=int)
+        positions.fill(-1)
+        positions[atoms] = np.arange(len(atoms))
+        kwargs['atom_indices'] = atoms
+        featurize = lambda t: featurizer.featurize_atoms(t, positions)
+
+    if chunk:
+        return [featurize(t)
+                for t in md.iterload(filename, chunk=chunk, **kwargs)]
+    return [featurize(md.load(filename, **kwargs))]
+
+
+def _featurize_and_cache(filename, featurizer, topology, chunk, cache, key):
+    X = _featurize_file(filename, featurizer, topology, chunk)
+    if cache is not None and len(X) > 0:
+        cache.put(key, X)
+        X = [x.astype(np.float32) for x in X]
+    return X
+
+
+def _featurize_file_worker(args):
+    # The features go back to the parent through a file in shared memory
+    # (/dev/shm), rather than being pickled through the pool's pipe.
+    filename, chunk, key = args
+    X = _featurize_and_cache(filename, _worker['featurizer'],
+                             _worker['topology'], chunk, _worker['cache'], key)
+    lengths = [len(x) for x in X]
+    if len(X) == 0:
+        return None, lengths
+    fd, path = tempfile.mkstemp(suffix='.npy', dir=_worker['shared_dir'])
+    os.close(fd)
+    np.save(path, np.concatenate(X))
+    return path, lengths
+
+
+def featurize_files(filenames, featurizer, topology, chunk=0, n_jobs=1,
+                    cache=None):
+    """Load and featurize trajectory files, in parallel.
+
+    The files are distributed over a pool of `n_jobs` processes, and the
+    results are yielded in the order of `filenames`, as soon as they, and
+    the ones before them, are ready.
+
+    Parameters
+    ----------
+    filenames : list of str
+    featurizer : Featurizer
+    topology : md.Trajectory or md.Topology
+        Topology for the files that don't contain one.
+    chunk : int, optional
+        If nonzero, load the files with md.iterload in chunks of this many
+        frames, and featurize each chunk separately.
+    n_jobs : int, optional
+        Number of processes. If -1, all CPUs are used. With n_jobs=1, the
+        files are featurized in this process.
+    cache : FeaturizationCache, optional
+        If supplied, the features of files in the cache are loaded from it,
+        and those of the other files are added to it. The features are then
+        all float32.
+
+    Yields
+    ------
+    filename : str
+    features : list of np.ndarray
+        The features of each chunk of the file (just one, if chunk=0).
+    """
+    keys = [None] * len(filenames)
+    if cache is not None:
+        fingerprint = cache.fingerprint(featurizer)
+        keys = [cache.key(filename, fingerprint, chunk)
+                for filename in filenames]
+    hits = [key is not None and key in cache for key in keys]
+
+    def load_hit(filename, key):
+        X = cache.get(key, chunk)
+        if X is None:
+            # evicted in the meantime
+            X = _featurize_and_cache(filename, featurizer, topology, chunk,
+                                     cache, key)
+        return X
+
+    if n_jobs == 1:
+        for filename, key, hit in zip(filenames, keys, hits):
+            if hit:
+                yield filename, load_hit(filename, key)
+            else:
+                yield filename, _featurize_and_cache(
+                    filename, featurizer, topology, chunk, cache, key)
+        return
+
+    shm = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    shared_dir = tempfile.mkdtemp(prefix='mixtape-', dir=shm)
+    n_processes = n_jobs if n_jobs > 0 else multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(n_processes, initializer=_init_worker,
+                                initargs=(featurizer, topology, shared_dir,
+                                          cache))
+    misses = iter([(filename, chunk, key) for filename, key, hit
+                   in zip(filenames, keys, hits) if not hit])
+    # At most two files per process are submitted ahead of the consumer, so
+    # the features of finished files can't pile up in shared_dir when they
+    # are consumed more slowly than they are computed.
+    max_pending = 2 * n_processes
+    pending = collections.deque()
+    try:
+        for filename, key, hit in zip(filenames, keys, hits):
+            if hit:
+                yield filename, load_hit(filename, key)
+                continue
+            for task in itertools.islice(misses, max_pending - len(pending)):
+                pending.append(pool.apply_async(_featurize_file_worker,
+                                                (task,)))
+            path, lengths = pending.popleft().get()
+            if path is None:
+                yield filename, []
+                continue
+            X = np.load(path)
+            os.unlink(path)
+            yield filename, np.split(X, np.cumsum(lengths)[:-1])
+        # each worker only counts its own entries towards max_size
+        if cache is not None:
+            cache.evict()
+    finally:
+        pool.terminate()
+        shutil.rmtree(shared_dir, ignore_errors=True)
+
+
+class FrameIndex(object):
+    """Provenance of the frames of a featurized dataset.
+
+    Rather than storing the file and frame of every row, the index only
+    stores the table of files and the number of frames in each, and
+    computes the file id and frame of rows on demand.
+
+    Parameters
+    ----------
+    filenames : list of str
+        The table of files.
+    lengths : array_like of int, shape=(n_files,)
+        Number of frames from each file, which are stored consecutively, in
+        the order of `filenames`.
+    """
+    def __init__(self, filenames, lengths):
+        self.filenames = list(filenames)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        if len(self.lengths) != len(self.filenames):
+            raise ValueError('filenames and lengths must have the same length')
+        self.offsets = np.concatenate(([0], np.cumsum(self.lengths)))
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def locate(self, indices):
+        """The file and frame of rows of the dataset.
+
+        Parameters
+        ----------
+        indices : array_like of int
+            Indices of rows, counting from 0 across all of the files.
+
+        Returns
+        -------
+        file_ids : np.ndarray, dtype=int32
+            Index of the rows' files in `filenames`.
+        frames : np.ndarray, dtype=int32
+            Index of the rows' frames in their files.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if np.any((indices < 0) | (indices >= len(self))):
+            raise IndexError('frame index out of range')
+        file_ids = np.searchsorted(self.offsets, indices, side='right') - 1
+        frames = indices - self.offsets[file_ids]
+        return file_ids.astype(np.int32), frames.astype(np.int32)
+
+    def file_ids(self):
+        """The file id of every row, as an int32 array."""
+        return np.repeat(np.arange(len(self.filenames), dtype=np.int32),
+                         self.lengths)
 
+    def frames(self):
+        """The frame of every row in its file, as an int32 array."""
+        return (np.arange(len(self), dtype=np.int64)
+                - np.repeat(self.offsets[:-1], self.lengths)).astype(np.int32)
+
+
+def featurize_all(filenames, featurizer, topology, n_jobs=1, cache=None):
+    """Iterate over filenames, load trajectories, and featurize.
+
+    The files are featurized in parallel with `n_jobs` processes, and
+    through `cache` if supplied (see featurize_files).
+
+    Returns
+    -------
+    X : np.ndarray, shape=(n_frames, n_features)
+        The features of all of the frames.
+    index : FrameIndex
+        The file and frame of each row of X.
+    """
+    X = []
+    lengths = []
+    for file, (x,) in featurize_files(filenames, featurizer, topology,
+                                      n_jobs=n_jobs, cache=cache):
         X.append(x)
-        i.append(np.arange(len(x)))
-        f.extend([file]*len(x))
+        lengths.append(len(x))
+
+    return np.concatenate(X), FrameIndex(filenames, lengths)
+
+
+def featurize_chunks(filenames, featurizer, topology, chunk=10000, n_jobs=1,
+                     cache=None):
+    """Stream the features of trajectory files in chunks.
+
+    The files are loaded with md.iterload, so a chunk never spans two files
+    and only the last chunk of each file can be shorter than `chunk`. The
+    other arguments are as for featurize_files.
+
+    Yields
+    ------
+    file_id : int
+        Index of the chunk's file in `filenames`.
+    start : int
+        Index of the first frame of the chunk in its file.
+    X : np.ndarray, shape=(n_frames_chunk, n_features)
+    """
+    for file_id, (_, features) in enumerate(featurize_files(
+            filenames, featurizer, topology, chunk=chunk, n_jobs=n_jobs,
+            cache=cache)):
+        start = 0
+        for X in features:
+            yield file_id, start, X
+            start += len(X)
+
+
+class FeatureStream(object):
+    """Re-iterable stream of the features of trajectory files, in chunks.
+
+    Iterating over the stream yields float32 arrays of features, in the
+    order of `filenames`. The first pass featurizes the files (see
+    featurize_chunks) and spills the features to a temporary file, from
+    which later passes are read back in chunks, so the features are never
+    all held in memory. Consumers that need several passes over the data,
+    like discrete_approx_mvn, can take a stream in place of an array.
+
+    Parameters
+    ----------
+    filenames : list of str
+    featurizer : Featurizer
+    topology : md.Trajectory or md.Topology
+    chunk : int, optional
+        Maximum number of frames per chunk.
+    n_jobs : int, optional
+        Number of processes used to featurize the files.
+    cache : FeaturizationCache, optional
+
+    Attributes
+    ----------
+    index : FrameIndex
+        The file and frame of each row of the stream. Available after the
+        first pass.
+    """
+    def __init__(self, filenames, featurizer, topology, chunk=10000,
+                 n_jobs=1, cache=None):
+        self.filenames = list(filenames)
+        self.featurizer = featurizer
+        self.topology = topology
+        self.chunk = chunk
+        self.n_jobs = n_jobs
+        self.cache = cache
+        self.index = None
+        self.n_features = None
+        self._spill = None
+
+    def __iter__(self):
+        if self._spill is not None:
+            return self._iter_spill()
+        return self._iter_featurize()
+
+    def _iter_featurize(self):
+        lengths = np.zeros(len(self.filenames), dtype=int)
+        fd, path = tempfile.mkstemp(prefix='mixtape-', suffix='.dat')
+        complete = False
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for file_id, _, X in featurize_chunks(
+                        self.filenames, self.featurizer, self.topology,
+                        self.chunk, self.n_jobs, self.cache):
+                    X = np.asarray(X, dtype=np.float32)
+                    lengths[file_id] += len(X)
+                    X.tofile(f)
+                    self.n_features = X.shape[1]
+                    yield X
+            complete = True
+        finally:
+            if complete:
+                self.index = FrameIndex(self.filenames, lengths)
+                self._spill = path
+            else:
+                os.unlink(path)
+
+    def _iter_spill(self):
+        if self.n_frames == 0:
+            return
+        X = np.memmap(self._spill, dtype=np.float32, mode='r',
+                      shape=(self.n_frames, self.n_features))
+        for start in range(0, self.n_frames, self.chunk):
+            yield np.array(X[start:start+self.chunk])
+
+    @property
+    def n_frames(self):
+        """Total number of frames. Available after the first pass."""
+        if self.index is None:
+            raise ValueError('The stream has not been read yet')
+        return len(self.index)
+
+    def close(self):
+        """Delete the spilled features."""
+        if self._spill is not None:
+            os.unlink(self._spill)
+            self._spill = None
+            self.index = None
 
-    return np.concatenate(X), np.concatenate(i), np.array(f)
+    def __del__(self):
+        self.close()
 
 
 def load(filename):
-    """Load a featurizer from a cPickle file."""
-    featurizer = cPickle.load(open(filename))
-    return featurizer
+    """Load a featurizer saved with Featurizer.save.
+
+    Both the .npz format and featurizers pickled with cPickle (by earlier
+    versions, or for classes that don't support the .npz format) can be
+    loaded.
+    """
+    with open(filename, 'rb') as f:
+        magic = f.read(len(_ZIP_MAGIC))
+    if magic != _ZIP_MAGIC:
+        return cPickle.load(open(filename, 'rb'))
+
+    with np.load(filename) as npz:
+        metadata = json.loads(str(npz['metadata']))
+        if metadata.get('format') != 'mixtape.featurizer':
+            raise ValueError('%s is not a saved featurizer' % filename)
+        if metadata['version'] > _FORMAT_VERSION:
+            raise ValueError('%s was saved in version %d of the featurizer '
+                             'format, which is newer than this version of '
+                             'mixtape (%d)' % (filename, metadata['version'],
+                                               _FORMAT_VERSION))
+        return _decode(metadata['featurizer'], npz, filename)
+
+
+# The .npz featurizer format. The arrays of a featurizer are stored under
+# "<prefix>.<name>", and its class and other parameters in the "metadata"
+# JSON document, with its prefix.
+_FORMAT_VERSION = 1
+_ZIP_MAGIC = b'PK\x03\x04'
+
+
+def _saveable(featurizer):
+    """Whether the featurizer, and those it contains, can be saved in the
+    .npz format, that is, whether their classes are in _SAVEABLE."""
+    # an unregistered subclass would be loaded as its parent class
+    if _SAVEABLE.get(type(featurizer).__name__) is not type(featurizer):
+        return False
+    if isinstance(featurizer, FeatureUnion):
+        return all(_saveable(f) for f in featurizer.featurizers)
+    return True
+
+
+def _encode(featurizer, prefix, arrays):
+    return {'class': type(featurizer).__name__, 'prefix': prefix,
+            'params': featurizer._get_state(prefix, arrays)}
+
+
+def _decode(metadata, npz, filename):
+    cls = _SAVEABLE[metadata['class']]
+    return cls._from_state(metadata['params'], metadata['prefix'], npz,
+                           filename)
+
+
+def _save_reference(traj, atoms, prefix, arrays):
+    """Store the coordinates of the first frame and the topology of some of
+    the atoms of a reference trajectory."""
+    atoms = np.asarray(atoms)
+    arrays[prefix + '.reference_xyz'] = traj.xyz[0, atoms]
+    table, bonds = traj.topology.to_dataframe()
+    table = table.iloc[atoms]
+    for column in table.columns:
+        values = np.asarray(table[column])
+        if values.dtype == object:
+            values = values.astype(str)
+        arrays[prefix + '.reference_' + column] = values
+
+    # the bonds between the atoms, renumbered
+    positions = -np.ones(traj.n_atoms, dtype=int)
+    positions[atoms] = np.arange(len(atoms))
+    bonds = np.asarray(bonds, dtype=int)
+    if len(bonds) == 0:
+        bonds = np.empty((0, 2), dtype=int)
+    bonds = positions[bonds[:, :2]]
+    arrays[prefix + '.reference_bonds'] = bonds[np.all(bonds >= 0, axis=1)]
+
+
+def _load_reference(filename, prefix):
+    """Rebuild a reference trajectory stored by _save_reference. It only
+    contains the stored atoms, numbered from 0 in the order of the atom
+    indices they were stored with."""
+    import pandas as pd
+    key = prefix + '.reference_'
+    with np.load(filename) as npz:
+        columns = [k[len(key):] for k in npz.files if k.startswith(key)
+                   and k not in (key + 'xyz', key + 'bonds')]
+        table = pd.DataFrame(dict((c, npz[key + c]) for c in columns))
+        topology = md.Topology.from_dataframe(table, npz[key + 'bonds'])
+        return md.Trajectory(npz[key + 'xyz'][np.newaxis], topology)
+
+
+class _LazyReference(object):
+    """The reference trajectory of a featurizer. For a featurizer loaded
+    from the .npz format, it is only rebuilt when it's accessed, and only
+    contains the atoms the featurizer uses (see _load_reference), so it
+    can't be indexed by the featurizer's atom indices."""
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        traj = obj.__dict__.get('_reference_traj')
+        source = obj.__dict__.get('_reference_source')
+        if traj is None and source is not None:
+            traj = obj.__dict__['_reference_traj'] = _load_reference(*source)
+        return traj
+
+    def __set__(self, obj, value):
+        obj.__dict__['_reference_traj'] = value
+        obj.__dict__['_reference_source'] = None
 
 
 class Featurizer(object):
@@ -33,41 +612,476 @@ class Featurizer(object):
     def featurize(self, traj):
         pass
 
+    def required_atoms(self):
+        """Indices of the atoms that the featurizer reads, or None if it
+        needs all of them."""
+        return None
+
+    def featurize_atoms(self, traj, positions):
+        """Featurize a trajectory that only contains some of the atoms.
+
+        Parameters
+        ----------
+        traj : md.Trajectory
+            A trajectory of (at least) the atoms in required_atoms().
+        positions : np.ndarray of int
+            ``positions[i]`` is the index in `traj` of atom `i` of the full
+            system, or -1 if it isn't in `traj`.
+        """
+        return self.featurize(traj)
+
     def save(self, filename):
-        cPickle.dump(self, open(filename, 'w'))
+        """Save the featurizer to a file, to be loaded with load().
+
+        The featurizers in this module are saved in a compact .npz format,
+        which only stores their index arrays and the reference coordinates
+        of the atoms they use. Other featurizers are pickled.
+        """
+        if not _saveable(self):
+            cPickle.dump(self, open(filename, 'wb'))
+            return
+        arrays = {}
+        metadata = {'format': 'mixtape.featurizer',
+                    'version': _FORMAT_VERSION,
+                    'featurizer': _encode(self, 'f', arrays)}
+        arrays['metadata'] = np.array(json.dumps(metadata))
+        # np.savez would add an .npz extension to a filename
+        with open(filename, 'wb') as f:
+            np.savez(f, **arrays)
+
+    def _get_state(self, prefix, arrays):
+        """The parameters of the featurizer for the .npz format. Arrays are
+        added to `arrays`, under keys starting with `prefix`, and the other
+        parameters are returned as a JSON-serializable dict."""
+        raise NotImplementedError()
+
+    @classmethod
+    def _from_state(cls, params, prefix, npz, filename):
+        """Rebuild a featurizer from the output of _get_state."""
+        raise NotImplementedError()
+
+    def __setstate__(self, state):
+        # featurizers pickled before the reference trajectories were lazy
+        if 'reference_traj' in state:
+            state['_reference_traj'] = state.pop('reference_traj')
+        self.__dict__.update(state)
 
 
 class SuperposeFeaturizer(Featurizer):
-    """Featurizer based on euclidian atom distances to reference structure."""
+    """Featurizer based on euclidian atom distances to reference structure.
+
+    After loading a featurizer saved with save(), ``reference_traj`` only
+    contains the atoms in ``atom_indices``, in that order and numbered
+    from 0.
+    """
+    reference_traj = _LazyReference()
+
     def __init__(self, atom_indices, reference_traj):
-        self.atom_indices = atom_indices
+        self.atom_indices = np.asarray(atom_indices)
         self.reference_traj = reference_traj
         self.n_features = len(self.atom_indices)
-        
+        self.reference_xyz = reference_traj.xyz[0, atom_indices]
+
+    def __setstate__(self, state):
+        super(SuperposeFeaturizer, self).__setstate__(state)
+        if 'reference_xyz' not in state:
+            self.reference_xyz = self.reference_traj.xyz[0, self.atom_indices]
+
+    def _get_state(self, prefix, arrays):
+        arrays[prefix + '.atom_indices'] = np.asarray(self.atom_indices)
+        # the reference coordinates of the atoms are stored with the
+        # reference topology, as <prefix>.reference_xyz
+        _save_reference(self.reference_traj, self.atom_indices, prefix, arrays)
+        return {}
+
+    @classmethod
+    def _from_state(cls, params, prefix, npz, filename):
+        self = cls.__new__(cls)
+        self.atom_indices = npz[prefix + '.atom_indices']
+        self.n_features = len(self.atom_indices)
+        self.reference_xyz = npz[prefix + '.reference_xyz']
+        # the reference trajectory (of the selected atoms only) is rebuilt
+        # from the file on demand
+        self._reference_traj = None
+        self._reference_source = (filename, prefix)
+        return self
+
     def featurize(self, traj):
+        # Only the selected atoms are aligned, on a copy of their
+        # coordinates, so the trajectory itself isn't modified.
+        return self.featurize_atoms(traj, np.arange(traj.n_atoms))
+
+    def required_atoms(self):
+        return np.asarray(self.atom_indices)
+
+    def featurize_atoms(self, traj, positions):
+        X = traj.xyz[:, positions[self.atom_indices]]
+        return _superposed_deviations(X, self.reference_xyz)
+
+
+def _superposed_deviations(X, Y):
+    """Distance of each atom of each frame of X to the same atom of Y,
+    after optimally superposing each frame onto Y (Kabsch).
+
+    Parameters
+    ----------
+    X : np.ndarray, shape=(n_frames, n_atoms, 3)
+    Y : np.ndarray, shape=(n_atoms, 3)
+
+    Returns
+    -------
+    deviations : np.ndarray, shape=(n_frames, n_atoms), dtype=float32
+    """
+    X = np.asarray(X, dtype=np.float32)
+    X = X - X.mean(axis=1)[:, np.newaxis, :]
+    Y = np.asarray(Y, dtype=np.float32)
+    Y = Y - Y.mean(axis=0)
+
+    # the rotation R minimizing |X R - Y|, from the SVD of the 3x3
+    # correlation matrix of each frame, with the sign of the last singular
+    # vector flipped if needed to exclude reflections
+    H = np.einsum('nai,aj->nij', X, Y, dtype=np.float64)
+    U, _, Vt = np.linalg.svd(H)
+    d = np.sign(np.linalg.det(U) * np.linalg.det(Vt))
+    U[:, :, 2] *= d[:, np.newaxis]
+    R = np.einsum('nij,njk->nik', U, Vt).astype(np.float32)
+
+    diff = np.einsum('nai,nij->naj', X, R)
+    diff -= Y
+    return np.sqrt(np.sum(diff**2, axis=2))
 
-        traj.superpose(self.reference_traj, atom_indices=self.atom_indices)
-        diff2 = (traj.xyz[:, self.atom_indices] - self.reference_traj.xyz[0, self.atom_indices])**2
-        x = np.sqrt(np.sum(diff2, axis=2))
-        
-        return x
 
 class AtomPairsFeaturizer(Featurizer):
-    """Featurizer based on atom pair distances."""
+    """Featurizer based on atom pair distances.
+
+    After loading a featurizer saved with save(), ``reference_traj`` only
+    contains the atoms in ``pair_indices``, in sorted order and numbered
+    from 0.
+    """
+    reference_traj = _LazyReference()
+
     def __init__(self, pair_indices, reference_traj, periodic=False):
-        self.pair_indices = pair_indices
+        self.pair_indices = np.asarray(pair_indices)
         self.reference_traj = reference_traj
         self.n_features = len(self.pair_indices)
         self.periodic = periodic
-        
+
+    def _get_state(self, prefix, arrays):
+        arrays[prefix + '.pair_indices'] = np.asarray(self.pair_indices)
+        if self.reference_traj is not None:
+            _save_reference(self.reference_traj, self.required_atoms(),
+                            prefix, arrays)
+        return {'periodic': bool(self.periodic),
+                'reference': self.reference_traj is not None}
+
+    @classmethod
+    def _from_state(cls, params, prefix, npz, filename):
+        self = cls.__new__(cls)
+        self.pair_indices = npz[prefix + '.pair_indices']
+        self.n_features = len(self.pair_indices)
+        self.periodic = params['periodic']
+        self._reference_traj = None
+        self._reference_source = (filename, prefix) if params['reference'] else None
+        return self
+
     def featurize(self, traj):
         d = md.geometry.compute_distances(traj, self.pair_indices, periodic=self.periodic)
         return d
 
+    def required_atoms(self):
+        return np.unique(self.pair_indices)
+
+    def featurize_atoms(self, traj, positions):
+        pairs = positions[np.asarray(self.pair_indices)]
+        return md.geometry.compute_distances(traj, pairs, periodic=self.periodic)
+
+
+class ContactFeaturizer(AtomPairsFeaturizer):
+    """Featurizer based on the distances between a sparse set of atom pairs,
+    e.g. those that come into contact.
+
+    The pairs are usually chosen with contact_pairs, and optionally
+    narrowed down with variable_pairs, rather than taking all of the pairs
+    of the selected atoms. The distances are computed in float32, a block
+    of pairs at a time.
+
+    Parameters
+    ----------
+    pair_indices : np.ndarray, shape=(n_pairs, 2)
+    reference_traj : md.Trajectory, optional
+    periodic : bool
+        If True, use the minimum image convention (computed by mdtraj).
+    """
+    def __init__(self, pair_indices, reference_traj=None, periodic=False):
+        pair_indices = np.asarray(pair_indices, dtype=np.int32)
+        if pair_indices.ndim != 2 or pair_indices.shape[1] != 2:
+            raise ValueError('pair_indices must have shape (N, 2)')
+        super(ContactFeaturizer, self).__init__(pair_indices, reference_traj,
+                                                periodic=periodic)
+
+    def featurize(self, traj):
+        return self.featurize_atoms(traj, np.arange(traj.n_atoms))
+
+    def featurize_atoms(self, traj, positions):
+        pairs = positions[self.pair_indices]
+        if self.periodic:
+            return md.geometry.compute_distances(
+                traj, pairs, periodic=True).astype(np.float32)
+        return _pair_distances(traj.xyz, pairs)
+
+
+def _pair_distances(xyz, pairs, block_elements=2**20):
+    """The distances between pairs of atoms in each frame, in float32.
+
+    The pairs are processed in blocks of about `block_elements` distances,
+    to bound the size of the temporary arrays.
+
+    Parameters
+    ----------
+    xyz : np.ndarray, shape=(n_frames, n_atoms, 3)
+    pairs : np.ndarray, shape=(n_pairs, 2)
+
+    Returns
+    -------
+    distances : np.ndarray, shape=(n_frames, n_pairs)
+    """
+    xyz = np.asarray(xyz, dtype=np.float32)
+    pairs = np.asarray(pairs)
+    out = np.empty((len(xyz), len(pairs)), dtype=np.float32)
+    block = max(1, block_elements // max(1, len(xyz)))
+    for start in range(0, len(pairs), block):
+        p = pairs[start:start + block]
+        diff = xyz[:, p[:, 0]] - xyz[:, p[:, 1]]
+        out[:, start:start + block] = np.sqrt(np.sum(diff**2, axis=2))
+    return out
+
+
+def _cell_list_pairs(X, cutoff):
+    """All of the pairs (i, j), i < j, of points within `cutoff` of each
+    other, by a cell-list search.
+
+    The points are binned into cubic cells of side `cutoff`, so only the
+    points in the same or adjacent cells need to be compared.
+
+    Parameters
+    ----------
+    X : np.ndarray, shape=(n_points, 3)
+    cutoff : float
+
+    Returns
+    -------
+    pairs : np.ndarray, shape=(n_pairs, 2)
+    """
+    X = np.asarray(X, dtype=np.float64)
+    # offset by one cell, so that the neighbors of every cell are in the grid
+    cells = np.floor((X - X.min(axis=0)) / cutoff).astype(np.int64) + 1
+    shape = cells.max(axis=0) + 2
+    ids = np.ravel_multi_index(cells.T, shape)
+    order = np.argsort(ids, kind='mergesort')
+    sorted_ids = ids[order]
+
+    first, second = [], []
+    for offset in itertools.product([-1, 0, 1], repeat=3):
+        # the points of the neighboring cell are order[lo:hi]
+        neighbors = np.ravel_multi_index((cells + offset).T, shape)
+        lo = np.searchsorted(sorted_ids, neighbors, side='left')
+        counts = np.searchsorted(sorted_ids, neighbors, side='right') - lo
+        i = np.repeat(np.arange(len(X)), counts)
+        within = np.arange(len(i)) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = order[np.repeat(lo, counts) + within]
+        # each pair is seen from both of its cells; keep it once
+        keep = i < j
+        i, j = i[keep], j[keep]
+        close = np.sum((X[i] - X[j])**2, axis=1) <= cutoff**2
+        first.append(i[close])
+        second.append(j[close])
+    return np.column_stack((np.concatenate(first), np.concatenate(second)))
+
+
+def contact_pairs(xyz, atom_indices, cutoff):
+    """The pairs of atoms that come within a distance cutoff of each other
+    in any of the frames.
+
+    Parameters
+    ----------
+    xyz : np.ndarray, shape=(n_frames, n_atoms, 3)
+        The coordinates of a sample of frames, e.g. ``traj.xyz``.
+    atom_indices : np.ndarray, shape=(n_atoms_selected,)
+        The atoms to consider.
+    cutoff : float
+        The distance cutoff, in the units of xyz (nm for mdtraj).
+
+    Returns
+    -------
+    pairs : np.ndarray, shape=(n_pairs, 2), dtype=int32
+        The pairs of atom indices, with the lower index first, sorted.
+    """
+    atom_indices = np.unique(atom_indices)
+    n = len(atom_indices)
+    codes = np.zeros(0, dtype=np.int64)
+    for frame in np.asarray(xyz)[:, atom_indices]:
+        pairs = _cell_list_pairs(frame, cutoff)
+        codes = np.union1d(codes, pairs[:, 0] * n + pairs[:, 1])
+    pairs = np.column_stack((codes // n, codes % n))
+    return atom_indices[pairs].astype(np.int32)
+
+
+def variable_pairs(xyz, pair_indices, n_pairs):
+    """The pairs of atoms whose distance varies the most over a sample of
+    frames.
+
+    Parameters
+    ----------
+    xyz : np.ndarray, shape=(n_frames, n_atoms, 3)
+        The coordinates of a sample of frames, e.g. ``traj.xyz``.
+    pair_indices : np.ndarray, shape=(n_candidates, 2)
+        The candidate pairs, e.g. from contact_pairs.
+    n_pairs : int
+        The number of pairs to keep.
+
+    Returns
+    -------
+    pairs : np.ndarray, shape=(min(n_pairs, n_candidates), 2), dtype=int32
+        The pairs with the highest variance of their distance, in the order
+        of `pair_indices`.
+    """
+    pair_indices = np.asarray(pair_indices, dtype=np.int32)
+    if n_pairs >= len(pair_indices):
+        return pair_indices
+    variance = np.var(_pair_distances(xyz, pair_indices), axis=0)
+    keep = np.argpartition(-variance, n_pairs - 1)[:n_pairs]
+    return pair_indices[np.sort(keep)]
 
 class RawPositionsFeaturizer(Featurizer):
     def __init__(self, n_features):
         self.n_features = n_features
 
     def featurize(self, traj):
-        return traj.xyz.reshape(len(traj), -1)
\ No newline at end of file
+        return traj.xyz.reshape(len(traj), -1)
+
+    def _get_state(self, prefix, arrays):
+        return {'n_features': int(self.n_features)}
+
+    @classmethod
+    def _from_state(cls, params, prefix, npz, filename):
+        return cls(params['n_features'])
+
+
+class DihedralFeaturizer(Featurizer):
+    """Featurizer based on dihedral (torsion) angles.
+
+    Parameters
+    ----------
+    dihedral_indices : np.ndarray, shape=(n_dihedrals, 4)
+        The indices of the four atoms forming each dihedral, e.g. from the
+        dihedralindices command.
+    sincos : bool
+        If False, the features are the angles, in radians in [-pi, pi], as
+        for a von Mises HMM. If True, the features are the sines of the
+        angles followed by their cosines, which are continuous across the
+        periodic boundary, as for a Gaussian HMM.
+    """
+    def __init__(self, dihedral_indices, sincos=False):
+        self.dihedral_indices = np.asarray(dihedral_indices)
+        if self.dihedral_indices.ndim != 2 or self.dihedral_indices.shape[1] != 4:
+            raise ValueError('dihedral_indices must have shape (N, 4)')
+        self.sincos = sincos
+        n_dihedrals = len(self.dihedral_indices)
+        self.n_features = 2 * n_dihedrals if sincos else n_dihedrals
+
+    def _get_state(self, prefix, arrays):
+        arrays[prefix + '.dihedral_indices'] = self.dihedral_indices
+        return {'sincos': bool(self.sincos)}
+
+    @classmethod
+    def _from_state(cls, params, prefix, npz, filename):
+        return cls(npz[prefix + '.dihedral_indices'], sincos=params['sincos'])
+
+    def featurize(self, traj):
+        return self.featurize_atoms(traj, np.arange(traj.n_atoms))
+
+    def required_atoms(self):
+        return np.unique(self.dihedral_indices)
+
+    def featurize_atoms(self, traj, positions):
+        angles = _dihedrals(traj.xyz, positions[self.dihedral_indices])
+        if self.sincos:
+            return np.hstack((np.sin(angles), np.cos(angles)))
+        return angles
+
+
+def _dihedrals(xyz, quartets):
+    """The dihedral angles of the quartets of atoms, for each frame, in
+    float32.
+
+    Parameters
+    ----------
+    xyz : np.ndarray, shape=(n_frames, n_atoms, 3)
+    quartets : np.ndarray, shape=(n_dihedrals, 4)
+
+    Returns
+    -------
+    angles : np.ndarray, shape=(n_frames, n_dihedrals)
+    """
+    xyz = np.asarray(xyz, dtype=np.float32)
+    b1 = xyz[:, quartets[:, 1]] - xyz[:, quartets[:, 0]]
+    b2 = xyz[:, quartets[:, 2]] - xyz[:, quartets[:, 1]]
+    b3 = xyz[:, quartets[:, 3]] - xyz[:, quartets[:, 2]]
+    n1 = np.cross(b1, b2)
+    n2 = np.cross(b2, b3)
+    b2_norm = np.sqrt(np.sum(b2**2, axis=2))
+    y = b2_norm * np.sum(b1 * n2, axis=2)
+    x = np.sum(n1 * n2, axis=2)
+    return np.arctan2(y, x)
+
+
+class FeatureUnion(Featurizer):
+    """The features of several featurizers, side by side.
+
+    When trajectories are featurized with featurize_files (and the
+    functions built on it), each chunk is loaded once, with only the atoms
+    that some of the featurizers need, and each featurizer writes its
+    features into its columns of one float32 array.
+
+    Parameters
+    ----------
+    featurizers : list of Featurizer
+    """
+    def __init__(self, featurizers):
+        self.featurizers = list(featurizers)
+        self.n_features = sum(f.n_features for f in self.featurizers)
+
+    def _get_state(self, prefix, arrays):
+        return {'featurizers': [_encode(f, '%s.%d' % (prefix, i), arrays)
+                                for i, f in enumerate(self.featurizers)]}
+
+    @classmethod
+    def _from_state(cls, params, prefix, npz, filename):
+        return cls([_decode(f, npz, filename) for f in params['featurizers']])
+
+    def featurize(self, traj):
+        return self._concatenate(lambda f: f.featurize(traj), len(traj))
+
+    def required_atoms(self):
+        atoms = [f.required_atoms() for f in self.featurizers]
+        if any(a is None for a in atoms):
+            return None
+        return np.unique(np.concatenate(atoms))
+
+    def featurize_atoms(self, traj, positions):
+        return self._concatenate(
+            lambda f: f.featurize_atoms(traj, positions), len(traj))
+
+    def _concatenate(self, featurize, n_frames):
+        out = np.empty((n_frames, self.n_features), dtype=np.float32)
+        start = 0
+        for f in self.featurizers:
+            out[:, start:start + f.n_features] = featurize(f)
+            start += f.n_features
+        return out
+
+
+# the featurizers that can be saved in the .npz format, by class name
+_SAVEABLE = dict((cls.__name__, cls) for cls in [
+    SuperposeFeaturizer, AtomPairsFeaturizer, ContactFeaturizer,
+    RawPositionsFeaturizer, DihedralFeaturizer, FeatureUnion])
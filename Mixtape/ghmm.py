@@ -36,9 +36,8 @@ from __future__ import print_function, division
 import time
 import warnings
 import numpy as np
-from sklearn import cluster
 _AVAILABLE_PLATFORMS = ['cpu', 'sklearn']
-from mixtape import _ghmm, _reversibility
+from mixtape import _ghmm, _reversibility, hotstart
 try:
     from mixtape import _cuda_ghmm_single
     from mixtape import _cuda_ghmm_mixed
@@ -102,9 +101,13 @@ class GaussianFusionHMM(object):
         If 't' is in params, the transition matrix will be set. If
         'm' is in params, the statemeans will be set. If 'v' is in
         params, the state variances will be set.
-    n_hotstart_sequences : int
-        Number of sequences to use when hotstarting the EM with kmeans.
-        Default=50
+    n_hotstart : int
+        Number of pairs of consecutive frames, sampled uniformly from all of
+        the sequences, to use when hotstarting the EM with mini-batch
+        kmeans. Default=10000
+    n_jobs : int
+        Number of processes used to run the restarts of the k-means hot
+        start. If -1, all CPUs are used. Default=1
 
     Notes
     -----
@@ -114,7 +117,7 @@ class GaussianFusionHMM(object):
                  transmat_prior=None, vars_prior=1e-3, vars_weight=1,
                  random_state=None, params='tmv', init_params='tmv',
                  platform='cpu', precision='mixed', timing=True,
-                 n_hotstart_sequences=50):
+                 n_hotstart=10000, n_jobs=1):
         self.n_states = n_states
         self.n_features = n_features
         self.n_em_iter = n_em_iter
@@ -130,7 +133,8 @@ class GaussianFusionHMM(object):
         self.init_params = init_params
         self.platform = platform
         self.timing = timing
-        self.n_hotstart_sequences = n_hotstart_sequences
+        self.n_hotstart = n_hotstart
+        self.n_jobs = n_jobs
         self._impl = None
 
         if not reversible_type in ['mle', 'transpose']:
@@ -211,24 +215,23 @@ class GaussianFusionHMM(object):
         return self
 
     def _init(self, sequences, init_params):
-        '''
-	Find initial means(hot start)
-	'''
-	self._impl._sequences = sequences
-
-        small_dataset = np.vstack(sequences[0:min(len(sequences), self.n_hotstart_sequences)])
+        """Find initial means, variances and transition matrix (hot start)
+        """
+        self._impl._sequences = sequences
 
+        if not any(p in init_params for p in 'mvt'):
+            return
+        means, vars, counts = hotstart.kmeans_hotstart(
+            sequences, self.n_states, n_samples=self.n_hotstart,
+            covariance_type='diag', n_jobs=self.n_jobs,
+            random_state=self.random_state)
         if 'm' in init_params:
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                self.means_ = cluster.KMeans(n_clusters=self.n_states).fit(small_dataset).cluster_centers_
+            self.means_ = means
         if 'v' in init_params:
-            self.vars_ = np.vstack([np.var(small_dataset, axis=0)] * self.n_states)
+            self.vars_ = vars
         if 't' in init_params:
-            transmat_ = np.empty((self.n_states, self.n_states))
-            transmat_.fill(1.0 / self.n_states)
-            self.transmat_ = transmat_
-            self.populations_ = np.ones(self.n_states) / self.n_states
+            self.transmat_, self.populations_ = \
+                _reversibility.reversible_transmat(counts + 1.0)
 
     def _do_mstep(self, stats, params):
         if 't' in params:
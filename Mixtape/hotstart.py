@@ -0,0 +1,227 @@
+"""
+Hot starting the EM of the hidden Markov models in mixtape.
+
+Instead of clustering the first few sequences, the initializers here draw a
+uniform random sample of transitions (pairs of consecutive frames) from all
+of the sequences, without stacking the dataset, and cluster the frames with
+mini-batch k-means, keeping the best of several restarts. The hard
+assignments of the sampled pairs also give an initial estimate of the
+transition counts.
+"""
+from __future__ import print_function, division
+
+import warnings
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.utils import check_random_state
+try:
+    from joblib import Parallel, delayed
+except ImportError:
+    from sklearn.externals.joblib import Parallel, delayed
+
+__all__ = ['reservoir_sample_pairs', 'kmeans_hotstart', 'vonmises_hotstart']
+
+
+def reservoir_sample_pairs(sequences, n_samples, random_state=None):
+    """Uniform random sample, without replacement, of pairs of consecutive
+    frames from a collection of sequences.
+
+    The sequences are visited once, in order, and only the sample is kept
+    in memory (reservoir sampling), so `sequences` can be any iterable of
+    arrays, including a generator.
+
+    Parameters
+    ----------
+    sequences : iterable of np.ndarray, shape=(n_samples_i, n_features)
+    n_samples : int
+        Number of pairs to sample. If there are fewer pairs in total, all
+        of them are returned.
+    random_state : RandomState or an int seed, optional
+
+    Returns
+    -------
+    first, second : np.ndarray, shape=(n_pairs, n_features)
+        The sampled frames x_t and x_{t+1}.
+    """
+    random_state = check_random_state(random_state)
+    first = second = None
+    n_seen = 0
+
+    for seq in sequences:
+        seq = np.asarray(seq)
+        if seq.ndim == 1:
+            seq = seq[:, np.newaxis]
+        n_pairs = len(seq) - 1
+        if n_pairs <= 0:
+            continue
+        if first is None:
+            first = np.empty((n_samples, seq.shape[1]), dtype=seq.dtype)
+            second = np.empty((n_samples, seq.shape[1]), dtype=seq.dtype)
+
+        # fill the reservoir
+        n_fill = max(0, min(n_samples - n_seen, n_pairs))
+        first[n_seen:n_seen + n_fill] = seq[:n_fill]
+        second[n_seen:n_seen + n_fill] = seq[1:n_fill + 1]
+
+        # then the i-th pair overall replaces a random element of the
+        # reservoir with probability n_samples / (i + 1)
+        if n_fill < n_pairs:
+            t = np.arange(n_fill, n_pairs)
+            slots = random_state.randint(0, n_seen + t + 1)
+            keep = slots < n_samples
+            t, slots = t[keep], slots[keep]
+            # if a slot is hit more than once, the last pair wins
+            slots, last = np.unique(slots[::-1], return_index=True)
+            t = t[::-1][last]
+            first[slots] = seq[t]
+            second[slots] = seq[t + 1]
+        n_seen += n_pairs
+
+    if first is None:
+        raise ValueError('The sequences must contain at least one pair of '
+                         'consecutive frames')
+    n_samples = min(n_samples, n_seen)
+    return first[:n_samples], second[:n_samples]
+
+
+def _fit_kmeans(X, n_clusters, seed):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        km = MiniBatchKMeans(n_clusters=n_clusters, random_state=seed).fit(X)
+    centers = km.cluster_centers_
+    labels, inertia = _assign(X, centers)
+    return centers, labels, inertia
+
+
+def _assign(X, centers):
+    # squared distances via |x|^2 - 2 x.c + |c|^2
+    dist = (np.sum(X**2, axis=1)[:, np.newaxis] - 2 * np.dot(X, centers.T)
+            + np.sum(centers**2, axis=1)[np.newaxis, :])
+    labels = np.argmin(dist, axis=1)
+    inertia = np.sum(np.maximum(dist[np.arange(len(X)), labels], 0))
+    return labels, inertia
+
+
+def _cluster_pairs(first, second, n_states, n_init, n_jobs, random_state):
+    """Cluster the frames of the sampled pairs, keeping the best of n_init
+    restarts. Returns the centers, the labels of the first and second
+    frames of each pair, and the transition counts between them."""
+    X = np.vstack((first, second)).astype(np.float64)
+    seeds = random_state.randint(np.iinfo(np.int32).max, size=n_init)
+    fits = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_kmeans)(X, n_states, seed) for seed in seeds)
+    centers, labels, _ = min(fits, key=lambda fit: fit[2])
+
+    labels_first, labels_second = labels[:len(first)], labels[len(first):]
+    counts = np.zeros((n_states, n_states))
+    np.add.at(counts, (labels_first, labels_second), 1)
+    return centers, labels_first, labels_second, counts
+
+
+def kmeans_hotstart(sequences, n_states, n_samples=10000, n_init=3,
+                    covariance_type='diag', n_jobs=1, random_state=None):
+    """Initial means, covariances and transition counts for a model with
+    Gaussian emissions.
+
+    Parameters
+    ----------
+    sequences : iterable of np.ndarray, shape=(n_samples_i, n_features)
+    n_states : int
+    n_samples : int
+        Number of pairs of consecutive frames sampled from the sequences.
+    n_init : int
+        Number of restarts of mini-batch k-means. The clustering with the
+        lowest inertia is used.
+    covariance_type : {'diag', 'full'}
+    n_jobs : int
+        Number of restarts run in parallel.
+    random_state : RandomState or an int seed, optional
+
+    Returns
+    -------
+    means : np.ndarray, shape=(n_states, n_features)
+    covars : np.ndarray, shape=(n_states, n_features) or
+            (n_states, n_features, n_features)
+        The variances (covariance_type='diag') or covariance matrices
+        (covariance_type='full') of the frames assigned to each state.
+        States with fewer than two frames get those of the whole sample.
+    counts : np.ndarray, shape=(n_states, n_states)
+        Transition counts between the hard assignments of the sampled pairs.
+    """
+    if covariance_type not in ('diag', 'full'):
+        raise ValueError("covariance_type must be 'diag' or 'full'")
+    random_state = check_random_state(random_state)
+    first, second = reservoir_sample_pairs(sequences, n_samples, random_state)
+    means, labels_first, labels_second, counts = _cluster_pairs(
+        first, second, n_states, n_init, n_jobs, random_state)
+
+    X = np.vstack((first, second)).astype(np.float64)
+    labels = np.concatenate((labels_first, labels_second))
+    if covariance_type == 'diag':
+        covars = np.vstack([np.var(X, axis=0)] * n_states)
+    else:
+        covars = np.array([np.atleast_2d(np.cov(X.T))] * n_states)
+    for k in range(n_states):
+        Xk = X[labels == k]
+        if len(Xk) < 2:
+            continue
+        if covariance_type == 'diag':
+            covars[k] = np.var(Xk, axis=0)
+        else:
+            covars[k] = np.atleast_2d(np.cov(Xk.T))
+    return means, covars, counts
+
+
+def vonmises_hotstart(sequences, n_states, n_samples=10000, n_init=3,
+                      n_jobs=1, random_state=None):
+    """Initial means, concentrations and transition counts for a model with
+    von Mises emissions.
+
+    The angles are embedded on the circle, by their sine and cosine, for
+    clustering. The mean of each state is the direction of its cluster
+    center, and the concentration is the maximum likelihood estimate from
+    the mean resultant length of the frames assigned to it.
+
+    Parameters
+    ----------
+    sequences : iterable of np.ndarray, shape=(n_samples_i, n_features)
+        Angles, in radians.
+    n_states : int
+    n_samples : int
+        Number of pairs of consecutive frames sampled from the sequences.
+    n_init : int
+        Number of restarts of mini-batch k-means. The clustering with the
+        lowest inertia is used.
+    n_jobs : int
+        Number of restarts run in parallel.
+    random_state : RandomState or an int seed, optional
+
+    Returns
+    -------
+    means : np.ndarray, shape=(n_states, n_features)
+    kappas : np.ndarray, shape=(n_states, n_features)
+    counts : np.ndarray, shape=(n_states, n_states)
+        Transition counts between the hard assignments of the sampled pairs.
+    """
+    # imported here, so that the Gaussian hot starts don't load the von
+    # Mises extension
+    from mixtape import _vmhmm
+    random_state = check_random_state(random_state)
+    first, second = reservoir_sample_pairs(sequences, n_samples, random_state)
+    n_features = first.shape[1]
+    embed = lambda X: np.hstack((np.sin(X), np.cos(X)))
+    centers, labels_first, labels_second, counts = _cluster_pairs(
+        embed(first), embed(second), n_states, n_init, n_jobs, random_state)
+    means = np.arctan2(centers[:, :n_features], centers[:, n_features:])
+
+    X = np.vstack((first, second)).astype(np.float64)
+    labels = np.concatenate((labels_first, labels_second))
+    kappas = np.ones((n_states, n_features))
+    for k in range(n_states):
+        Xk = X[labels == k]
+        if len(Xk) < 2:
+            continue
+        # mean resultant length, in the direction of the mean
+        R = np.mean(np.cos(Xk - means[k]), axis=0)
+        kappas[k] = _vmhmm._inv_mbessel_ratio(np.clip(R, 1e-3, 1 - 1e-6))
+    return means, kappas, counts
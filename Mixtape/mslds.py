@@ -5,22 +5,126 @@ The switch posteriors are used in the M-step to update parameter estimates.
 @author: Bharath Ramsundar
 @email: bharath.ramsundar@gmail.com
 """
+from __future__ import print_function
 
-import warnings
+import time
+import multiprocessing
 import numpy as np
-from numpy.random import multivariate_normal, randn, rand
-import scipy.linalg
+from cvxopt import matrix
 import numpy.linalg
-from sklearn import cluster
-from sklearn.hmm import GaussianHMM
-from sklearn.mixture import distribute_covar_matrix_to_match_covariance_type
+from sklearn.utils import check_random_state
 from mdtraj.utils import ensure_type
 
 from mixtape import _reversibility
+from mixtape import _switching_var1
 from mixtape._switching_var1 import SwitchingVAR1CPUImpl
 from mixtape.mslds_solvers.mslds_A_sdp import solve_A
 from mixtape.mslds_solvers.mslds_Q_sdp import solve_Q
-from mixtape.utils import iter_vars, categorical
+from mixtape import mslds_analysis, hotstart
+from mixtape.utils import categorical
+
+
+# The sufficient statistics that the A and Q updates of a state depend on,
+# including through the means and covariances
+_A_STATS = ['post', 'obs', 'obs*obs.T', 'obs*obs[t-1].T', 'obs[:-1]',
+            'obs[:-1]*obs[:-1].T']
+_Q_STATS = _A_STATS + ['post[1:]', 'obs[1:]', 'obs[1:]*obs[1:].T']
+
+def _solve_sdp(solver, args, warm_start):
+    """Solve an SDP, seeded with the previous solution if there is one. If
+    the warm start is rejected or doesn't converge, start over from
+    scratch."""
+    if warm_start is not None:
+        try:
+            sol = solver(*args, primalstart=warm_start[0],
+                         dualstart=warm_start[1])[0]
+            if sol['status'] == 'optimal':
+                return sol
+        except (ValueError, ArithmeticError):
+            pass
+    return solver(*args)[0]
+
+
+def _warm_start(sol, margin=1e-3):
+    """Starting point for the next solve from an SDP solution. The optimal
+    slacks lie on the boundary of the cone, but cvxopt requires a strictly
+    positive definite start, so they're shifted into the interior."""
+    def interior(m):
+        m = np.array(m)
+        shift = max(0, -np.linalg.eigvalsh(m).min()) + margin * max(
+            1, np.abs(m).max())
+        return matrix(m + shift * np.eye(len(m)))
+    return ({'x': sol['x'], 'ss': [interior(m) for m in sol['ss']]},
+            {'zs': [interior(m) for m in sol['zs']]})
+
+
+def _A_update_state(args):
+    """Update A for a single state. Module level, so that it can be
+    dispatched to a multiprocessing.Pool.
+
+    The objective of the SDP is minimized by the closed form least squares
+    solution (B-C) E^{-1}, which (in the vec(A) convention of the objective
+    blocks of construct_coeff_matrix) is the transpose of the A it returns.
+    When that A already satisfies the stability constraints, it is the
+    optimum, and the SDP is skipped.
+    """
+    n_features, B, C, E, Sigma, Q, warm_start = args
+    eps = 1e-4  # as in construct_const_matrix
+    try:
+        A = np.linalg.solve(E, (B - C).T)
+    except np.linalg.LinAlgError:
+        A = None
+    if A is not None and np.all(np.isfinite(A)):
+        schur = Sigma - eps * np.eye(n_features) - np.dot(A, np.dot(Sigma, A.T))
+        if (np.linalg.norm(A, 2) <= 1 and
+                np.linalg.eigvalsh(schur).min() >= 0):
+            return A, warm_start
+
+    sol = _solve_sdp(solve_A, (n_features, B, C, E, Sigma, Q), warm_start)
+    avec = np.array(sol['x'])
+    avec = avec[1 + n_features * (n_features + 1) // 2:]
+    A = np.reshape(avec, (n_features, n_features), order='F')
+    return A, _warm_start(sol)
+
+
+def _Q_update_state(args):
+    """Update Q for a single state. Module level, so that it can be
+    dispatched to a multiprocessing.Pool.
+
+    The objective of the SDP, tr(Q^{-1} B), only decreases as Q grows, so it
+    is minimized by the largest Q allowed by the constraint
+    D - Q - A D A.T >= 0, that is Q = D - A D A.T. When that is positive
+    definite, it is returned directly and the SDP is skipped.
+    """
+    n_features, A, B, Sigma, warm_start = args
+    Q = Sigma - np.dot(A, np.dot(Sigma, A.T))
+    Q = (Q + Q.T) / 2
+    if np.linalg.eigvalsh(Q).min() > 0:
+        return Q, warm_start
+
+    sol = _solve_sdp(solve_Q, (n_features, A, B, Sigma), warm_start)
+    qvec = np.array(sol['x'])
+    qvec = qvec[1 + n_features * (n_features + 1) // 2:]
+    Q = np.zeros((n_features, n_features))
+    for j in range(n_features):
+        for k in range(j + 1):
+            vec_pos = j * (j + 1) // 2 + k
+            Q[j, k] = qvec[vec_pos]
+            Q[k, j] = Q[j, k]
+    return Q, _warm_start(sol)
+
+
+def _psd_sqrt(M):
+    """A square root L of the positive semidefinite matrix M, M = L L^T. This
+    is the Cholesky factor if M is positive definite, and is computed from
+    the eigendecomposition otherwise."""
+    M = np.asarray(M, dtype=np.float64)
+    try:
+        return np.linalg.cholesky(M)
+    except np.linalg.LinAlgError:
+        w, V = np.linalg.eigh(M)
+        return V * np.sqrt(np.maximum(w, 0))
+
 
 class MetastableSwitchingLDS(object):
     """Metastable Switching Linear Dynamical System, fit via maximum
@@ -57,6 +161,10 @@ class MetastableSwitchingLDS(object):
         between.
     n_features : int
         Dimensionality of the space.
+    n_hotstart : int, optional, default=10000
+        Number of pairs of consecutive frames, sampled uniformly from all of
+        the sequences, that are clustered to initialize the means, covars
+        and transmat.
     As : np.ndarray, shape=(n_states, n_features, n_features):
         Each `A[i]` is the LDS evolution operator for the system, conditional
         on it being in state `i`.
@@ -85,16 +193,40 @@ class MetastableSwitchingLDS(object):
         covariance matrices Q[i] are initialized as eps*covars[i]. eps
         encodes the fact that local covariances Q[i] should be small and
         that A[i] should almost be identity.
+    n_jobs : int, optional, default=1
+        Number of processes used to solve the per-state semidefinite
+        programs in the A and Q updates, and to run the restarts of the
+        k-means hot start. If -1, all CPUs are used.
+    thresh : float, optional, default=1e-4
+        Convergence threshold. EM stops when the relative change in the
+        log likelihood between iterations is below this value.
+    stats_thresh : float, optional, default=1e-3
+        The A and Q of a state are only re-estimated when the sufficient
+        statistics they depend on have changed, relative to their values at
+        the last update, by more than this value. Set to 0 to always update.
+    timing : bool, optional, default=False
+        Record the speed of the EM iterations, in mean_fit_time_ and
+        std_fit_time_ (samples per second).
+    verbose : bool, optional, default=False
+        Print the log likelihood at each EM iteration.
+    random_state : RandomState or an int seed, optional
+        Random number generator used for the hot start.
+
+    Attributes
+    ----------
+    fit_logprob_ : list of floats
+        The log likelihood of the training sequences after each E-step.
     """
 
-    def __init__(self, n_states, n_features, n_hotstart_sequences=10,
+    def __init__(self, n_states, n_features, n_hotstart=10000,
         init_params='tmcqab', transmat_prior=None, params='tmcqab',
         n_iter=10, covars_prior=1e-2, covars_weight=1, precision='mixed',
-        eps=2.e-1):
+        eps=2.e-1, n_jobs=1, thresh=1e-4, stats_thresh=1e-3, timing=False,
+        verbose=False, random_state=None):
 
         self.n_states = n_states
         self.n_features = n_features
-        self.n_hotstart_sequences = n_hotstart_sequences
+        self.n_hotstart = n_hotstart
         self.n_iter = n_iter
         self.init_params = init_params
         self.transmat_prior = transmat_prior
@@ -106,6 +238,12 @@ class MetastableSwitchingLDS(object):
         self.covars_prior = covars_prior
         self.covars_weight = covars_weight
         self.eps = eps
+        self.n_jobs = n_jobs
+        self.thresh = thresh
+        self.stats_thresh = stats_thresh
+        self.timing = timing
+        self.verbose = verbose
+        self.random_state = random_state
         self._impl = SwitchingVAR1CPUImpl(n_states, n_features, precision)
 
         self._As_ = None
@@ -115,6 +253,12 @@ class MetastableSwitchingLDS(object):
         self._means_ = None
         self._transmat_ = None
         self._populations_ = None
+        # the SDP solutions from the previous M-step, for warm starting
+        self._A_warm_starts = [None] * n_states
+        self._Q_warm_starts = [None] * n_states
+        # the sufficient statistics as of the last update of A and Q
+        self._mstep_stats = {}
+        self._map = map
 
         if self.transmat_prior is None:
             self.transmat_prior = 1.0
@@ -125,25 +269,25 @@ class MetastableSwitchingLDS(object):
         sequences = [ensure_type(s, dtype=np.float32, ndim=2, name='s')
            for s in sequences]
         self._impl._sequences = sequences
-
-        small_dataset = np.vstack(
-            sequences[0:min(len(sequences), self.n_hotstart_sequences)])
-
+        self._A_warm_starts = [None] * self.n_states
+        self._Q_warm_starts = [None] * self.n_states
+        self._mstep_stats = {}
+
+        if any(p in self.init_params for p in 'mct'):
+            means, covars, counts = hotstart.kmeans_hotstart(
+                sequences, self.n_states, n_samples=self.n_hotstart,
+                covariance_type='full', n_jobs=self.n_jobs,
+                random_state=self.random_state)
         if 'm' in self.init_params:
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                self.means_ = cluster.KMeans(n_clusters=self.n_states).fit(small_dataset).cluster_centers_
+            self.means_ = means
         if 'c' in self.init_params:
-            cv = np.cov(small_dataset.T)
-            self.covars_ = \
-                distribute_covar_matrix_to_match_covariance_type(
-                  cv, 'full', self.n_states)
+            self.covars_ = covars
             self.covars_[self._covars_==0] = 1e-5
         if 't' in self.init_params:
-            transmat_ = np.empty((self.n_states, self.n_states))
-            transmat_.fill(1.0 / self.n_states)
-            self.transmat_ = transmat_
-            self.populations_ = np.ones(self.n_states) / self.n_states
+            # the transition counts between the hard assignments of the
+            # sampled pairs, with a pseudocount
+            self.transmat_, self.populations_ = \
+                _reversibility.reversible_transmat(counts + 1.0)
         if 'a' in self.init_params:
             self.As_ = np.zeros((self.n_states, self.n_features, self.n_features))
             for i in range(self.n_states):
@@ -161,7 +305,8 @@ class MetastableSwitchingLDS(object):
                 self.Qs_[i] = self.eps * self.covars_[i]
 
 
-    def sample(self, n_samples, init_state=None, init_obs=None):
+    def sample(self, n_samples, init_state=None, init_obs=None,
+               n_chains=None, random_state=None):
         """Sample a trajectory from model distribution
 
         Parameters
@@ -172,68 +317,129 @@ class MetastableSwitchingLDS(object):
             The initial hidden metastable state, in {0, ..., n_states-1}
         init_obs : np.ndarray, shape=(n_features)
             The initial "observed" data point.
+        n_chains : int, optional
+            If given, sample this many independent trajectories at once.
+        random_state : RandomState or an int seed, optional
+            A random number generator instance.
 
         Returns
         -------
         obs : np.ndarray, shape=(n_samples, n_features)
-            The "observed" data samples.
-        hidden_state : np.ndarray, shape=(n_samples, n_states)
-            The hidden state of the process.
+            The "observed" data samples. If n_chains is given, the shape is
+            (n_chains, n_samples, n_features).
+        hidden_state : np.ndarray, shape=(n_samples,)
+            The hidden state of the process. If n_chains is given, the shape
+            is (n_chains, n_samples).
         """
+        random_state = check_random_state(random_state)
+        n = 1 if n_chains is None else n_chains
+        As = np.asarray(self.As_, dtype=np.float64)
+        bs = np.asarray(self.bs_, dtype=np.float64)
+        means = np.asarray(self.means_, dtype=np.float64)
+        Q_chols = np.array([_psd_sqrt(Q) for Q in self.Qs_])
+        cum_transmat = np.cumsum(np.asarray(self.transmat_, dtype=np.float64),
+                                 axis=1)
+
         # Allocate Memory
-        obs = np.zeros((n_samples, self.n_features))
-        hidden_state = np.zeros(n_samples, dtype=int)
+        obs = np.empty((n, n_samples, self.n_features))
+        hidden_state = np.empty((n, n_samples), dtype=np.intp)
 
         # set the initial values of the sequences
         if init_state is None:
             # Sample Start conditions
-            hidden_state[0] = categorical(self.populations_)
+            hidden_state[:, 0] = categorical(self.populations_, size=(n,),
+                                             random_state=random_state)
         else:
-            hidden_state[0] = init_state
+            hidden_state[:, 0] = init_state
 
         if init_obs is None:
-            obs[0] = multivariate_normal(self.means_[hidden_state[0]],
-                                         self.covars_[hidden_state[0]])
+            cv_chols = np.array([_psd_sqrt(cv) for cv in self.covars_])
+            s0 = hidden_state[:, 0]
+            noise = random_state.standard_normal((n, self.n_features))
+            obs[:, 0] = means[s0] + np.einsum('cij,cj->ci', cv_chols[s0], noise)
         else:
-            obs[0] = init_obs
-
-        # Perform time updates
-        for t in range(n_samples - 1):
-            s = hidden_state[t]
-            A = self.As_[s]
-            b = self.bs_[s]
-            Q = self.Qs_[s]
-            obs[t + 1] = multivariate_normal(np.dot(A, obs[t]) + b, Q)
-            hidden_state[t + 1] = \
-              categorical(self.transmat_[s])
-
+            obs[:, 0] = init_obs
+
+        # Perform time updates. The state at t+1 only depends on the state
+        # at t, so the chains of hidden states are sampled first, and then
+        # the noise for all of the time steps in each state at once.
+        _switching_var1._sample_hidden_states(
+            cum_transmat, random_state.random_sample((n, n_samples - 1)),
+            hidden_state)
+        prev_state = hidden_state[:, :-1]
+        for k in range(self.n_states):
+            mask = (prev_state == k)
+            noise = random_state.standard_normal((np.count_nonzero(mask),
+                                                  self.n_features))
+            obs[:, 1:][mask] = bs[k] + np.dot(noise, Q_chols[k].T)
+        _switching_var1._propagate_var1(As, hidden_state, obs)
+
+        if n_chains is None:
+            return obs[0], hidden_state[0]
         return obs, hidden_state
 
-    def predict(self, obs):
-        """Find most likely state sequence corresponding to `obs`.
+    def score(self, sequences):
+        """Log-likelihood of sequences under the model, including the A, b
+        and Q dynamics within each state.
 
         Parameters
         ----------
-        obs : np.ndarray, shape=(n_samples, n_features)
-            Sequence of n_features-dimensional data points. Each row
-            corresponds to a single point in the sequence.
+        sequences : list
+            List of 2-dimensional array observation sequences, each of which
+            has shape (n_samples_i, n_features), where n_samples_i
+            is the length of the i_th observation.
+        """
+        self._impl._sequences = sequences
+        return self._impl.do_score()
+
+    def predict(self, sequences):
+        """Find most likely hidden-state sequence corresponding to
+        each data timeseries.
+
+        Uses the Viterbi algorithm, with the emission distribution of the
+        switching VAR(1) process: the first frame of each sequence is drawn
+        from N(means_[k], covars_[k]), and each later frame from
+        N(As_[k] x_{t-1} + bs_[k], Qs_[k]).
+
+        Parameters
+        ----------
+        sequences : list
+            List of 2-dimensional array observation sequences, each of which
+            has shape (n_samples_i, n_features), where n_samples_i
+            is the length of the i_th observation.
 
         Returns
         -------
-        hidden_states : np.ndarray, shape=(n_states)
-            Index of the most likely states for each observation
+        viterbi_logprob : float
+            Log probability of the maximum likelihood path through the HMM.
+
+        hidden_sequences : list of np.ndarrays[dtype=int, shape=n_samples_i]
+            Index of the most likely states for each observation.
         """
-        _, vl = scipy.linalg.eig(self.transmat_, left=True, right=False)
-        startprob = vl[:, 0] / np.sum(vl[:, 0])
+        self._impl._sequences = sequences
+        return self._impl.do_viterbi()
+
+    def predict_proba(self, sequences):
+        """Posterior probability of each hidden state, for each frame of
+        each data timeseries.
+
+        Parameters
+        ----------
+        sequences : list
+            List of 2-dimensional array observation sequences, each of which
+            has shape (n_samples_i, n_features), where n_samples_i
+            is the length of the i_th observation.
 
-        model = GaussianHMM(n_components=self.n_states, covariance_type='full')
-        model.startprob_ = startprob
-        model.transmat_ = self.transmat_
-        model.means_ = self.means_
-        model.covars_ = self.covars_
-        return model.predict(obs)
+        Returns
+        -------
+        posteriors : list of np.ndarrays, shape=(n_samples_i, n_states)
+            The posterior probabilities of the states.
+        """
+        self._impl._sequences = sequences
+        _, posteriors = self._impl.do_posteriors()
+        return posteriors
 
-    def fit(self, sequences):
+    def fit(self, sequences, callback=None):
         """Estimate model parameters.
 
         An initialization step is performed before entering the EM
@@ -246,23 +452,61 @@ class MetastableSwitchingLDS(object):
             List of 2-dimensional array observation sequences, each of which
             has shape (n_samples_i, n_features), where n_samples_i
             is the length of the i_th observation.
+        callback : callable, optional
+            Called as ``callback(model, i, logprob)`` after the E-step of
+            each iteration.
         """
         self._init(sequences)
+        self.fit_logprob_ = []
+        iterations_timing = []
         n_obs = sum(len(s) for s in sequences)
 
-        for i in range(self.n_iter):
-            print "Iteration %d" % i
-            _, stats = self._impl.do_estep()
-            if stats['trans'].sum() > 10*n_obs:
-                print('Number of transition counts', stats['trans'].sum())
-                print('Total sequence length', n_obs)
-                print("Numerical overflow detected. Try splitting your trajectories")
-                print("into shorter segments or running in double")
-                break
-
-            # Maximization step
-            self._do_mstep(stats, set(self.params))
-
+        # the per-state SDPs in the M-step are independent, so they're
+        # solved in a pool of worker processes, which is created once for
+        # the whole fit.
+        pool = None
+        if self.n_jobs != 1:
+            pool = multiprocessing.Pool(
+                self.n_jobs if self.n_jobs > 0 else None)
+            self._map = pool.map
+
+        try:
+            for i in range(self.n_iter):
+                if self.timing:
+                    iterations_timing.append(time.time())
+
+                # Expectation step
+                curr_logprob, stats = self._impl.do_estep()
+                if stats['trans'].sum() > 10*n_obs:
+                    print('Number of transition counts', stats['trans'].sum())
+                    print('Total sequence length', n_obs)
+                    print("Numerical overflow detected. Try splitting your trajectories")
+                    print("into shorter segments or running in double")
+                    break
+
+                self.fit_logprob_.append(curr_logprob)
+                if self.verbose:
+                    print('Iteration %d, log likelihood %f' % (i, curr_logprob))
+                if callback is not None:
+                    callback(self, i, curr_logprob)
+
+                # Check for convergence
+                if i > 0 and abs(self.fit_logprob_[-1] - self.fit_logprob_[-2]) \
+                        < self.thresh * abs(self.fit_logprob_[-2]):
+                    break
+
+                # Maximization step
+                self._do_mstep(stats, set(self.params))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            self._map = map
+
+        if self.timing and len(iterations_timing) > 1:
+            samples_per_s = n_obs / np.diff(iterations_timing)
+            self.mean_fit_time_ = np.mean(samples_per_s)
+            self.std_fit_time_ = np.std(samples_per_s)
 
         return self
 
@@ -274,10 +518,15 @@ class MetastableSwitchingLDS(object):
         if 't' in params:
             self._transmat_update(stats)
 
+        # the A and Q updates are expensive, so they're only done for the
+        # states whose statistics have changed since the last update.
+        A_states = np.zeros(self.n_states, dtype=bool)
         if 'a' in params:
-            self._A_update(stats)
+            A_states = self._moved_states(stats, 'a', _A_STATS)
+            self._A_update(stats, np.flatnonzero(A_states))
         if 'q' in params:
-            self._Q_update(stats)
+            Q_states = self._moved_states(stats, 'q', _Q_STATS) | A_states
+            self._Q_update(stats, np.flatnonzero(Q_states))
         if 'b' in params:
             self._b_update(stats)
 
@@ -302,8 +551,31 @@ class MetastableSwitchingLDS(object):
         counts = np.maximum(stats['trans'] + self.transmat_prior - 1.0, 1e-20).astype(np.float64)
         self.transmat_, self.populations_ = _reversibility.reversible_transmat(counts)
 
-    def _A_update(self, stats):
-        for i in range(self.n_states):
+    def _moved_states(self, stats, name, keys):
+        """Which states' sufficient statistics `keys` have changed by more
+        than stats_thresh (relative) since the last update of parameter
+        `name`. The reference statistics of those states are updated."""
+        prev = self._mstep_stats.get(name)
+        if prev is None or self.stats_thresh <= 0:
+            self._mstep_stats[name] = dict((key, np.array(stats[key]))
+                                           for key in keys)
+            return np.ones(self.n_states, dtype=bool)
+
+        moved = np.zeros(self.n_states, dtype=bool)
+        for key in keys:
+            curr = np.reshape(stats[key], (self.n_states, -1))
+            ref = np.reshape(prev[key], (self.n_states, -1))
+            change = np.sqrt(np.sum((curr - ref)**2, axis=1))
+            moved |= change > self.stats_thresh * np.sqrt(np.sum(ref**2, axis=1))
+        for key in keys:
+            prev[key][moved] = stats[key][moved]
+        return moved
+
+    def _A_update(self, stats, states=None):
+        if states is None:
+            states = range(self.n_states)
+        tasks = []
+        for i in states:
             b = np.reshape(self.bs_[i], (self.n_features, 1))
             B = stats['obs*obs[t-1].T'][i]
             mean_but_last = np.reshape(stats['obs[:-1]'][i],
@@ -312,15 +584,17 @@ class MetastableSwitchingLDS(object):
             E = stats['obs[:-1]*obs[:-1].T'][i]
             Sigma = self.covars_[i]
             Q = self.Qs_[i]
-            sol, _, G, _ = solve_A(self.n_features, B, C, E, Sigma, Q)
-            avec = np.array(sol['x'])
-            avec = avec[1 + self.n_features * (self.n_features + 1) / 2:]
-            A = np.reshape(avec, (self.n_features, self.n_features),
-                    order='F')
+            tasks.append((self.n_features, B, C, E, Sigma, Q,
+                          self._A_warm_starts[i]))
+        for i, (A, warm_start) in zip(states, self._map(_A_update_state, tasks)):
             self.As_[i] = A
+            self._A_warm_starts[i] = warm_start
 
-    def _Q_update(self, stats):
-        for i in range(self.n_states):
+    def _Q_update(self, stats, states=None):
+        if states is None:
+            states = range(self.n_states)
+        tasks = []
+        for i in states:
             A = self.As_[i]
             Sigma = self.covars_[i]
             b = np.reshape(self.bs_[i], (self.n_features, 1))
@@ -339,16 +613,11 @@ class MetastableSwitchingLDS(object):
                         (self.n_features, 1)).T,
                                A.T)) +
                     stats['post[1:]'][i] * np.dot(b, b.T)))
-            sol, _, _, _ = solve_Q(self.n_features, A, B, Sigma)
-            qvec = np.array(sol['x'])
-            qvec = qvec[1 + self.n_features * (self.n_features + 1) / 2:]
-            Q = np.zeros((self.n_features, self.n_features))
-            for j in range(self.n_features):
-                for k in range(j + 1):
-                    vec_pos = j * (j + 1) / 2 + k
-                    Q[j, k] = qvec[vec_pos]
-                    Q[k, j] = Q[j, k]
+            tasks.append((self.n_features, A, B, Sigma,
+                          self._Q_warm_starts[i]))
+        for i, (Q, warm_start) in zip(states, self._map(_Q_update_state, tasks)):
             self.Qs_[i] = Q
+            self._Q_warm_starts[i] = warm_start
 
     def _b_update(self, stats):
         for i in range(self.n_states):
@@ -424,27 +693,19 @@ class MetastableSwitchingLDS(object):
             x_i = (I - A)^{-1}b
           Output: wells
         """
-        wells = np.zeros((self.n_states, self.n_features))
-        for i in range(self.n_states):
-            wells[i] = np.dot(np.linalg.inv(np.eye(self.n_features) -
-                            self.As_[i]), self.bs_[i])
-        return wells
+        return mslds_analysis.metastable_wells(self.As_, self.bs_)
 
-    def compute_process_covariances(self, N=10000):
+    def compute_process_covariances(self, N=None):
         """Compute the emergent complexity D_i of metastable state i by
           solving the fixed point equation Q_i + A_i D_i A_i.T = D_i
           for D_i
+
+        The equations are solved directly (see
+        mslds_analysis.solve_lyapunov). States whose A_i is not stable have
+        no solution, and are NaN. N is ignored, and kept for backwards
+        compatibility.
         """
-        covs = np.zeros((self.n_states, self.n_features, self.n_features))
-        for k in range(self.n_states):
-            A = self.As_[k]
-            Q = self.Qs_[k]
-            V = iter_vars(A, Q, N)
-            covs[k] = V
-        return covs
+        return mslds_analysis.solve_lyapunov(self.As_, self.Qs_)
 
     def compute_eigenspectra(self):
-        eigenspectra = np.zeros((self.n_states, self.n_features, self.n_features))
-        for k in range(self.n_states):
-            eigenspectra[k] = np.diag(np.linalg.eigvals(self.As_[k]))
-        return eigenspectra
+        return mslds_analysis.eigenspectra(self.As_)
@@ -0,0 +1,123 @@
+"""
+Analysis of the linear dynamics within the states of a Metastable Switching
+LDS. Each function operates on the parameters of all of the states at once.
+"""
+import warnings
+import numpy as np
+import scipy.linalg
+
+__all__ = ['spectral_radius', 'solve_lyapunov', 'metastable_wells',
+           'eigenspectra']
+
+
+def spectral_radius(As):
+    """Largest absolute eigenvalue of each of the matrices As.
+
+    Parameters
+    ----------
+    As : np.ndarray, shape=(n_states, n_features, n_features)
+
+    Returns
+    -------
+    radius : np.ndarray, shape=(n_states,)
+    """
+    return np.abs(np.linalg.eigvals(As)).max(axis=-1)
+
+
+def solve_lyapunov(As, Qs, cond_max=1e8):
+    """Solve the discrete Lyapunov equations Q_k + A_k D_k A_k^T = D_k for
+    D_k, the stationary covariance of the process x_{t+1} = A_k x_t + e_t,
+    e_t ~ N(0, Q_k).
+
+    The equations are solved directly, for all of the states at once, by
+    diagonalizing A_k = V L V^{-1}, in which basis the equation decouples
+    to D'_ij = Q'_ij / (1 - l_i conj(l_j)). States for which V is badly
+    conditioned (e.g. A_k is close to defective) are solved instead with
+    the Schur-based solver from scipy.
+
+    The equation only has a positive semidefinite solution if A_k is stable,
+    i.e. all of its eigenvalues are inside the unit circle. For unstable
+    states, a RuntimeWarning is issued and D_k is set to NaN.
+
+    Parameters
+    ----------
+    As : np.ndarray, shape=(n_states, n_features, n_features)
+    Qs : np.ndarray, shape=(n_states, n_features, n_features)
+    cond_max : float
+        The largest condition number of V for which the eigendecomposition
+        is used.
+
+    Returns
+    -------
+    Ds : np.ndarray, shape=(n_states, n_features, n_features)
+    """
+    As = np.asarray(As, dtype=np.float64)
+    Qs = np.asarray(Qs, dtype=np.float64)
+    n_states, n_features, _ = As.shape
+
+    eigvals, V = np.linalg.eig(As)
+    unstable = np.abs(eigvals).max(axis=1) >= 1
+    if np.any(unstable):
+        warnings.warn('The dynamics of state(s) %s are not stable, so they '
+                      'have no stationary covariance' %
+                      ', '.join(str(k) for k in np.flatnonzero(unstable)),
+                      RuntimeWarning)
+    with np.errstate(all='ignore'):
+        cond = np.linalg.cond(V)
+    direct = ~unstable & np.isfinite(cond) & (cond < cond_max)
+
+    Ds = np.empty((n_states, n_features, n_features))
+    Ds[unstable] = np.nan
+    if np.any(direct):
+        L, W = eigvals[direct], V[direct]
+        W_inv = np.linalg.inv(W)
+        W_inv_H = np.conj(np.swapaxes(W_inv, 1, 2))
+        Qt = np.matmul(W_inv, np.matmul(Qs[direct], W_inv_H))
+        Dt = Qt / (1 - L[:, :, np.newaxis] * np.conj(L[:, np.newaxis, :]))
+        D = np.matmul(W, np.matmul(Dt, np.conj(np.swapaxes(W, 1, 2)))).real
+        Ds[direct] = 0.5 * (D + np.swapaxes(D, 1, 2))
+    for k in np.flatnonzero(~unstable & ~direct):
+        Ds[k] = scipy.linalg.solve_discrete_lyapunov(As[k], Qs[k])
+    return Ds
+
+
+def metastable_wells(As, bs):
+    """The fixed points x_k = (I - A_k)^{-1} b_k of the dynamics of each
+    state.
+
+    Parameters
+    ----------
+    As : np.ndarray, shape=(n_states, n_features, n_features)
+    bs : np.ndarray, shape=(n_states, n_features)
+
+    Returns
+    -------
+    wells : np.ndarray, shape=(n_states, n_features)
+    """
+    As = np.asarray(As, dtype=np.float64)
+    bs = np.asarray(bs, dtype=np.float64)
+    I_minus_A = np.eye(As.shape[1])[np.newaxis] - As
+    return np.linalg.solve(I_minus_A, bs[:, :, np.newaxis])[:, :, 0]
+
+
+def eigenspectra(As):
+    """The eigenvalues of each of the matrices As, on the diagonals.
+
+    Parameters
+    ----------
+    As : np.ndarray, shape=(n_states, n_features, n_features)
+
+    Returns
+    -------
+    spectra : np.ndarray, shape=(n_states, n_features, n_features)
+        spectra[k] is the diagonal matrix of the eigenvalues of As[k]. The
+        array is complex if any of the eigenvalues are.
+    """
+    eigvals = np.linalg.eigvals(np.asarray(As, dtype=np.float64))
+    if np.all(np.isreal(eigvals)):
+        eigvals = eigvals.real
+    n_states, n_features = eigvals.shape
+    spectra = np.zeros((n_states, n_features, n_features), dtype=eigvals.dtype)
+    diag = np.arange(n_features)
+    spectra[:, diag, diag] = eigvals
+    return spectra
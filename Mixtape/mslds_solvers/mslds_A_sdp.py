@@ -1,9 +1,10 @@
-from cvxopt import matrix, solvers
+from cvxopt import matrix, spmatrix, solvers
 from numpy import bmat, zeros, reshape, array, dot, eye, outer, shape
 from numpy import sqrt, real, ones
 from numpy.linalg import pinv, eig, matrix_rank
 from scipy.linalg import block_diag, sqrtm
 import numpy as np
+from mixtape.mslds_solvers import sdp_patterns
 
 
 def construct_coeff_matrix(x_dim, Q, C, B, E):
@@ -12,9 +13,9 @@ def construct_coeff_matrix(x_dim, Q, C, B, E):
     # J = Q^{-.5} (symmetric)
     # H = E^{.5} (symmetric)
     g_dim = 7 * x_dim
+    n_vars = 1 + x_dim * (x_dim + 1) // 2 + x_dim ** 2
     # Smallest number epsilon such that 1. + epsilon != 1.
     epsilon = np.finfo(np.float32).eps
-    G = zeros((g_dim ** 2, 1 + x_dim * (x_dim + 1) / 2 + x_dim ** 2))
     # Add a small positive offset to avoid taking sqrt of singular matrix
     J = real(sqrtm(pinv(Q)+epsilon*eye(x_dim)))
     H = real(sqrtm(E+epsilon*eye(x_dim)))
@@ -28,150 +29,61 @@ def construct_coeff_matrix(x_dim, Q, C, B, E):
     #|                                         A   I
     #|                                                Z
     # -------------------------------------------
-    # First Block Column
-    # Z+sI-JAF.T -FA.TJ
-    left = 0
-    top = 0
-    # Z
-    prev = 1
-    for j in range(x_dim):  # cols
-        for i in range(x_dim):  # rows
-            mat_pos = left * g_dim + j * g_dim + top + i
-            if i >= j:
-                (i, j) = (j, i)
-            vec_pos = prev + j * (j + 1) / 2 + i  # pos in param vector
-            G[mat_pos, vec_pos] += 1.
-    # sI
-    prev = 0
-    for i in range(x_dim):  # row/col on diag
-        vec_pos = prev  # pos in param vector
-        mat_pos = left * g_dim + i * g_dim + top + i
-        G[mat_pos, vec_pos] += 1.
-    # - J A F.T
-    prev = 1 + x_dim * (x_dim + 1) / 2
-    for i in range(x_dim):
-        for j in range(x_dim):
-            mat_pos = left * g_dim + j * g_dim + top + i
-            # For (i,j)-th element in matrix M
-            # do summation:
-            #   M    = J A F.T
-            #   M_ij = sum_m (JA)_im (F.T)_mj
-            #        = sum_m (JA)_im F_jm
-            #        = sum_m (sum_n J_in A_nm) F_jm
-            #        = sum_m sum_n J_in A_nm F_jm
-            for m in range(x_dim):
-                for n in range(x_dim):
-                    vec_pos = prev + n * x_dim + m
-                    G[mat_pos, vec_pos] += -J[i, n] * F[j, m]
-    # - F A.T J
-    prev = 1 + x_dim * (x_dim + 1) / 2
-    for i in range(x_dim):
-        for j in range(x_dim):
-            mat_pos = left * g_dim + j * g_dim + top + i
-            # For (i,j)-th element in matrix M
-            # do summation:
-            #   M    = F A.T J
-            #   M_ij = sum_m (FA.T)_im J_mj
-            #        = sum_m (sum_n F_in (A.T)_nm) J_mj
-            #        = sum_m (sum_n F_in A_mn) J_mj
-            #        = sum_m sum_n F_in A_mn J_mj
-            for m in range(x_dim):
-                for n in range(x_dim):
-                    vec_pos = prev + m * x_dim + n
-                    G[mat_pos, vec_pos] += -F[i, n] * J[m, j]
-    # H A.T J
-    left = 0
-    top = x_dim
-    prev = 1 + x_dim * (x_dim + 1) / 2
-    for i in range(x_dim):
-        for j in range(x_dim):
-            mat_pos = left * g_dim + j * g_dim + top + i
-            # For (i,j)-th element in matrix M
-            # do summation:
-            #   M    = H A.T J
-            #   M_ij = sum_m (HA.T)_im J_mj
-            #        = sum_m (sum_n H_in (A.T)_nm) J_mj
-            #        = sum_m (sum_n H_in A_mn) J_mj
-            #        = sum_m sum_n H_in A_mn J_mj
-            for m in range(x_dim):
-                for n in range(x_dim):
-                    vec_pos = prev + m * x_dim + n
-                    G[mat_pos, vec_pos] += H[i, n] * J[m, j]
-    # Second Block Column
-    # J A H
-    left = x_dim
-    top = 0
-    prev = 1 + x_dim * (x_dim + 1) / 2
-    for i in range(x_dim):
-        for j in range(x_dim):
-            mat_pos = left * g_dim + j * g_dim + top + i
-            # For (i,j)-th element in matrix M
-            # do summation:
-            #   M    = J A H
-            #   M_ij = sum_m (JA)_im H_mj
-            #        = sum_m (JA)_im H_mj
-            #        = sum_m (sum_n J_in A_nm) H_mj
-            #        = sum_m sum_n J_in A_nm H_mj
-            for m in range(x_dim):
-                for n in range(x_dim):
-                    vec_pos = prev + n * x_dim + m
-                    G[mat_pos, vec_pos] += J[i, n] * H[m, j]
-    # Third Block Column
-    # A.T
-    left = 2 * x_dim
-    top = 3 * x_dim
-    prev = 1 + x_dim * (x_dim + 1) / 2
-    for j in range(x_dim):  # cols
-        for i in range(x_dim):  # rows
-            vec_pos = prev + i * x_dim + j  # pos in param vector
-            mat_pos = left * g_dim + j * g_dim + top + i
-            G[mat_pos, vec_pos] += 1.
-    # Fourth Block Column
-    # A
-    left = 3 * x_dim
-    top = 2 * x_dim
-    prev = 1 + x_dim * (x_dim + 1) / 2
-    for j in range(x_dim):  # cols
-        for i in range(x_dim):  # rows
-            vec_pos = prev + j * x_dim + i  # pos in param vector
-            mat_pos = left * g_dim + j * g_dim + top + i
-            G[mat_pos, vec_pos] += 1.
-    # ------------------
-    # Fifth Block Column
-    # A
-    left = 4 * x_dim
-    top = 5 * x_dim
-    prev = 1 + x_dim * (x_dim + 1) / 2
-    for j in range(x_dim):  # cols
-        for i in range(x_dim):  # rows
-            vec_pos = prev + j * x_dim + i  # pos in param vector
-            mat_pos = left * g_dim + j * g_dim + top + i
-            G[mat_pos, vec_pos] += 1.
-    # Sixth Block Column
-    # A.T
-    left = 5 * x_dim
-    top = 4 * x_dim
-    prev = 1 + x_dim * (x_dim + 1) / 2
-    for j in range(x_dim):  # cols
-        for i in range(x_dim):  # rows
-            vec_pos = prev + i * x_dim + j  # pos in param vector
-            mat_pos = left * g_dim + j * g_dim + top + i
-            G[mat_pos, vec_pos] += 1.
-    # Seventh Block Column
-    # Z
-    left = 6 * x_dim
-    top = 6 * x_dim
-    prev = 1
-    for j in range(x_dim):  # cols
-        for i in range(x_dim):  # rows
-            mat_pos = left * g_dim + j * g_dim + top + i
-            if i >= j:
-                (i, j) = (j, i)
-            vec_pos = prev + j * (j + 1) / 2 + i  # pos in param vector
-            G[mat_pos, vec_pos] += 1.
-
+    # The entries with a constant coefficient only depend on x_dim, so their
+    # pattern is cached. Only the bilinear blocks depend on Q, C, B and E.
+    rows, cols = _constant_pattern(x_dim)
+    values = [ones(len(rows))]
+    rows, cols = [rows], [cols]
+    prev = 1 + x_dim * (x_dim + 1) // 2
+    # M_ij = sum_m sum_n X_in Y_mj A_nm (or A_mn), see product_block_values
+    for left, top, X, Y, order in [
+            (0, 0, -J, F.T, 'nm'),       # - J A F.T
+            (0, 0, -F, J, 'mn'),         # - F A.T J
+            (0, x_dim, H, J, 'mn'),      # H A.T J
+            (x_dim, 0, J, H, 'nm')]:     # J A H
+        block_rows, block_cols = sdp_patterns.product_block(x_dim, g_dim,
+                left, top, prev)
+        rows.append(block_rows)
+        cols.append(block_cols)
+        values.append(sdp_patterns.product_block_values(X, Y, order))
+    G = spmatrix(np.concatenate(values), np.concatenate(rows),
+            np.concatenate(cols), (g_dim ** 2, n_vars))
     return G, F, J, H
 
+
+@sdp_patterns.cached
+def _constant_pattern(x_dim):
+    g_dim = 7 * x_dim
+    prev = 1 + x_dim * (x_dim + 1) // 2
+    blocks = [
+        # First Block Column
+        # Z
+        sdp_patterns.packed_sym_block(x_dim, g_dim, 0, 0, 1),
+        # sI
+        sdp_patterns.diag_block(x_dim, g_dim, 0, 0, 0),
+        # Third Block Column
+        # A.T
+        sdp_patterns.dense_block(x_dim, g_dim, 2 * x_dim, 3 * x_dim, prev,
+            True),
+        # Fourth Block Column
+        # A
+        sdp_patterns.dense_block(x_dim, g_dim, 3 * x_dim, 2 * x_dim, prev,
+            False),
+        # Fifth Block Column
+        # A
+        sdp_patterns.dense_block(x_dim, g_dim, 4 * x_dim, 5 * x_dim, prev,
+            False),
+        # Sixth Block Column
+        # A.T
+        sdp_patterns.dense_block(x_dim, g_dim, 5 * x_dim, 4 * x_dim, prev,
+            True),
+        # Seventh Block Column
+        # Z
+        sdp_patterns.packed_sym_block(x_dim, g_dim, 6 * x_dim, 6 * x_dim, 1)]
+    rows = np.concatenate([r for r, _ in blocks])
+    cols = np.concatenate([c for _, c in blocks])
+    return rows, cols
+
 def construct_const_matrix(x_dim, Q, D):
     # --------------------------
     #| 0   0
@@ -206,27 +118,30 @@ def construct_const_matrix(x_dim, Q, D):
     return h
 
 
-def solve_A(x_dim, B, C, E, D, Q):
+def solve_A(x_dim, B, C, E, D, Q, primalstart=None, dualstart=None):
     # x = [s vec(Z) vec(A)]
+    # primalstart/dualstart are passed through to cvxopt to warm start the
+    # solver, e.g. with the solution from the previous EM iteration
     MAX_ITERS = 30
-    c_dim = 1 + x_dim * (x_dim + 1) / 2 + x_dim ** 2
+    c_dim = 1 + x_dim * (x_dim + 1) // 2 + x_dim ** 2
     c = zeros(c_dim)
     c[0] = x_dim
     prev = 1
     for i in range(x_dim):
-        vec_pos = prev + i * (i + 1) / 2 + i
+        vec_pos = prev + i * (i + 1) // 2 + i
         c[vec_pos] = 1.
     cm = matrix(c)
 
     G, _, _, _ = construct_coeff_matrix(x_dim, Q, C, B, E)
     G = -G  # set negative since s = h - Gx in cvxopt's sdp solver
-    Gs = [matrix(G)]
+    Gs = [G]
 
     h = construct_const_matrix(x_dim, Q, D)
     hs = [matrix(h)]
 
     solvers.options['maxiters'] = MAX_ITERS
-    sol = solvers.sdp(cm, Gs=Gs, hs=hs)
+    sol = solvers.sdp(cm, Gs=Gs, hs=hs, primalstart=primalstart,
+            dualstart=dualstart)
     return sol, c, G, h
 
 
@@ -1,16 +1,17 @@
-from cvxopt import matrix, solvers
+from cvxopt import matrix, spmatrix, solvers
 from numpy import bmat, zeros, reshape, array, dot, shape, eye, shape, real
 from numpy import ones
 from numpy.linalg import pinv, eig
 from scipy.linalg import block_diag, sqrtm
 import numpy as np
+from mixtape.mslds_solvers import sdp_patterns
 
 
 def construct_coeff_matrix(x_dim, B):
     # x = [s vec(Z) vec(Q)]
     # F = B^{.5}
     g_dim = 6 * x_dim
-    G = zeros((g_dim ** 2, 1 + 2 * x_dim * (x_dim + 1) / 2))
+    n_vars = 1 + 2 * x_dim * (x_dim + 1) // 2
     # ------------------------
     #|Z+sI  F
     #| F    Q
@@ -19,79 +20,45 @@ def construct_coeff_matrix(x_dim, B):
     #|                      Q
     #|                        Z
     # ------------------------
-
-    # First Block Column
-    # Z + sI
-    left = 0
-    top = 0
-    # Z
-    prev = 1
-    for j in range(x_dim):  # cols
-        for i in range(x_dim):  # rows
-            mat_pos = left * g_dim + j * g_dim + top + i
-            if i >= j:
-                (i, j) = (j, i)
-            vec_pos = prev + j * (j + 1) / 2 + i  # pos in param vector
-            G[mat_pos, vec_pos] += 1.
-    # sI
-    prev = 0
-    for i in range(x_dim):  # row/col on diag
-        vec_pos = 0  # pos in param vector
-        mat_pos = left * g_dim + i * g_dim + top + i
-        G[mat_pos, vec_pos] += 1.
-    # Second Block Column
-    # Q
-    left = x_dim
-    top = x_dim
-    prev = 1 + x_dim * (x_dim + 1) / 2
-    for j in range(x_dim):  # cols
-        for i in range(x_dim):  # rows
-            mat_pos = left * g_dim + j * g_dim + top + i
-            if i >= j:
-                (i, j) = (j, i)
-            vec_pos = prev + j * (j + 1) / 2 + i  # pos in param vector
-            G[mat_pos, vec_pos] += 1.
-    # Third Block Column
-    # -Q
-    left = 2 * x_dim
-    top = 2 * x_dim
-    prev = 1 + x_dim * (x_dim + 1) / 2
-    for j in range(x_dim):  # cols
-        for i in range(x_dim):  # rows
-            mat_pos = left * g_dim + j * g_dim + top + i
-            if i >= j:
-                (i, j) = (j, i)
-            vec_pos = prev + j * (j + 1) / 2 + i  # pos in param vector
-            G[mat_pos, vec_pos] += -1.
-    # Fourth Block Column
-    # -------------------
-    # Fifth Block Column
-    # Q
-    left = 4 * x_dim
-    top = 4 * x_dim
-    prev = 1 + x_dim * (x_dim + 1) / 2
-    for j in range(x_dim):  # cols
-        for i in range(x_dim):  # rows
-            mat_pos = left * g_dim + j * g_dim + top + i
-            if i >= j:
-                (i, j) = (j, i)
-            vec_pos = prev + j * (j + 1) / 2 + i  # pos in param vector
-            G[mat_pos, vec_pos] += 1.
-    # Sixth Block Column
-    # Z
-    left = 5 * x_dim
-    top = 5 * x_dim
-    prev = 1
-    for j in range(x_dim):  # cols
-        for i in range(x_dim):  # rows
-            mat_pos = left * g_dim + j * g_dim + top + i
-            if i >= j:
-                (i, j) = (j, i)
-            vec_pos = prev + j * (j + 1) / 2 + i  # pos in param vector
-            G[mat_pos, vec_pos] += 1.
+    # G doesn't depend on the data, only on x_dim.
+    rows, cols, values = _coeff_pattern(x_dim)
+    G = spmatrix(values, rows, cols, (g_dim ** 2, n_vars))
     return G
 
 
+@sdp_patterns.cached
+def _coeff_pattern(x_dim):
+    g_dim = 6 * x_dim
+    prev = 1 + x_dim * (x_dim + 1) // 2
+    blocks = [
+        # First Block Column
+        # Z
+        (sdp_patterns.packed_sym_block(x_dim, g_dim, 0, 0, 1), 1.),
+        # sI
+        (sdp_patterns.diag_block(x_dim, g_dim, 0, 0, 0), 1.),
+        # Second Block Column
+        # Q
+        (sdp_patterns.packed_sym_block(x_dim, g_dim, x_dim, x_dim, prev),
+            1.),
+        # Third Block Column
+        # -Q
+        (sdp_patterns.packed_sym_block(x_dim, g_dim, 2 * x_dim, 2 * x_dim,
+            prev), -1.),
+        # Fourth Block Column
+        # -------------------
+        # Fifth Block Column
+        # Q
+        (sdp_patterns.packed_sym_block(x_dim, g_dim, 4 * x_dim, 4 * x_dim,
+            prev), 1.),
+        # Sixth Block Column
+        # Z
+        (sdp_patterns.packed_sym_block(x_dim, g_dim, 5 * x_dim, 5 * x_dim,
+            1), 1.)]
+    rows = np.concatenate([r for (r, _), _ in blocks])
+    cols = np.concatenate([c for (_, c), _ in blocks])
+    values = np.concatenate([np.repeat(v, len(r)) for (r, _), v in blocks])
+    return rows, cols, values
+
 def construct_const_matrix(x_dim, A, B, D):
     # F = B^{.5}
     # -----------------------
@@ -129,25 +96,28 @@ def construct_const_matrix(x_dim, A, B, D):
     return h, F
 
 
-def solve_Q(x_dim, A, B, D):
+def solve_Q(x_dim, A, B, D, primalstart=None, dualstart=None):
     # x = [s vec(Z) vec(Q)]
-    c_dim = 1 + 2 * x_dim * (x_dim + 1) / 2
+    # primalstart/dualstart are passed through to cvxopt to warm start the
+    # solver, e.g. with the solution from the previous EM iteration
+    c_dim = 1 + 2 * x_dim * (x_dim + 1) // 2
     c = zeros(c_dim)
     c[0] = x_dim
     prev = 1
     for i in range(x_dim):
-        vec_pos = prev + i * (i + 1) / 2 + i
+        vec_pos = prev + i * (i + 1) // 2 + i
         c[vec_pos] = 1
     cm = matrix(c)
 
     G = construct_coeff_matrix(x_dim, B)
     G = -G  # set negative since s = h - Gx in cvxopt's sdp solver
-    Gs = [matrix(G)]
+    Gs = [G]
 
     h, _ = construct_const_matrix(x_dim, A, B, D)
     hs = [matrix(h)]
 
-    sol = solvers.sdp(cm, Gs=Gs, hs=hs)
+    sol = solvers.sdp(cm, Gs=Gs, hs=hs, primalstart=primalstart,
+            dualstart=dualstart)
     return sol, c, G, h
 
 
@@ -0,0 +1,99 @@
+"""Sparsity patterns shared by the MSLDS SDP constraint matrices.
+
+The coefficient matrices G of the A and Q SDPs are (g_dim**2, n_vars), where
+row (left + j) * g_dim + top + i is entry (top + i, left + j) of the block
+diagonal constraint matrix (column-major, as cvxopt expects), and the columns
+index the parameter vector x = [s vec(Z) vec(X)]. Most of G only depends on
+x_dim, so the patterns here are computed once per dimension and cached.
+"""
+import numpy as np
+
+_CACHE = {}
+
+
+def cached(func):
+    """Memoize a pattern builder on its (hashable) arguments."""
+    def wrapper(*args):
+        key = (func.__module__, func.__name__) + args
+        if key not in _CACHE:
+            _CACHE[key] = func(*args)
+        return _CACHE[key]
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+@cached
+def packed_sym_block(x_dim, g_dim, left, top, prev):
+    """Rows and columns of G for a symmetric variable, stored packed (lower
+    triangle) in x starting at `prev`, placed in the block at (top, left).
+
+    Note that in the original loop, swapping (i, j) also changes the column
+    j used for the remaining rows of the same column. That is reproduced
+    exactly here, so the constraints are unchanged.
+    """
+    rows, cols = [], []
+    for j in range(x_dim):  # cols
+        for i in range(x_dim):  # rows
+            mat_pos = left * g_dim + j * g_dim + top + i
+            if i >= j:
+                (i, j) = (j, i)
+            vec_pos = prev + j * (j + 1) // 2 + i  # pos in param vector
+            rows.append(mat_pos)
+            cols.append(vec_pos)
+    return np.array(rows, dtype=int), np.array(cols, dtype=int)
+
+
+@cached
+def diag_block(x_dim, g_dim, left, top, vec_pos):
+    """Rows and columns of G for the scalar x[vec_pos] times the identity,
+    placed in the block at (top, left)."""
+    i = np.arange(x_dim)
+    rows = left * g_dim + i * g_dim + top + i
+    return rows, np.repeat(vec_pos, x_dim)
+
+
+@cached
+def dense_block(x_dim, g_dim, left, top, prev, transpose):
+    """Rows and columns of G for a dense x_dim x x_dim variable, stored
+    column-major in x starting at `prev`, placed (transposed if `transpose`)
+    in the block at (top, left)."""
+    j, i = np.meshgrid(np.arange(x_dim), np.arange(x_dim), indexing='ij')
+    rows = left * g_dim + j * g_dim + top + i
+    if transpose:
+        cols = prev + i * x_dim + j
+    else:
+        cols = prev + j * x_dim + i
+    return rows.ravel(), cols.ravel()
+
+
+@cached
+def product_block(x_dim, g_dim, left, top, prev):
+    """Rows and columns of G for a block that is a bilinear function of the
+    x_dim**2 variables stored at `prev` (see product_block_values). Every
+    entry of the block depends on every one of those variables."""
+    j, i = np.meshgrid(np.arange(x_dim), np.arange(x_dim), indexing='ij')
+    block_rows = (left * g_dim + j * g_dim + top + i).ravel()
+    rows = np.repeat(block_rows, x_dim ** 2)
+    cols = np.tile(prev + np.arange(x_dim ** 2), x_dim ** 2)
+    return rows, cols
+
+
+def product_block_values(X, Y, order):
+    """Values of G for a block whose (i, j) entry is
+    sum_{n,m} X_in Y_mj x[prev + n * x_dim + m] (order='nm') or
+    sum_{n,m} X_in Y_mj x[prev + m * x_dim + n] (order='mn'), in the order of
+    product_block. These are the two index conventions used by the bilinear
+    blocks of the A constraint matrix.
+
+    The coefficients X_in Y_mj are the Kronecker product kron(Y.T, X), up to
+    a permutation of the columns.
+    """
+    x_dim = X.shape[0]
+    # K[j, i, m, n] = Y_mj X_in
+    K = np.kron(Y.T, X).reshape(x_dim, x_dim, x_dim, x_dim)
+    if order == 'mn':
+        return K.ravel()
+    elif order == 'nm':
+        return K.transpose(0, 1, 3, 2).ravel()
+    raise ValueError("order must be 'nm' or 'mn'")
@@ -4,6 +4,14 @@ from numpy import shape
 from sklearn.utils import check_random_state
 from numpy.linalg import norm
 from numpy.random import randint
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    from sklearn.utils.linear_assignment_ import linear_assignment
+
+    def linear_sum_assignment(cost):
+        indices = linear_assignment(cost)
+        return indices[:, 0], indices[:, 1]
 import mdtraj as md
 
 
@@ -17,6 +25,36 @@ def iterobjects(fn):
             pass
 
 
+def save_indices(filename, indices):
+    """Save an index file (of atoms, pairs or dihedrals) in the binary .npy
+    format, as int32.
+
+    Unlike np.save, no .npy extension is added to `filename`.
+    """
+    with open(filename, 'wb') as f:
+        np.save(f, np.asarray(indices, dtype=np.int32))
+
+
+def load_indices(filename):
+    """Load an index file, as a 2-dimensional array with one row per atom,
+    pair or dihedral.
+
+    Binary .npy files (from save_indices) are memory-mapped. Otherwise the
+    file is parsed as text, with one row of whitespace-separated indices
+    per line, as written by older versions of the atomindices and
+    dihedralindices commands.
+    """
+    with open(filename, 'rb') as f:
+        magic = f.read(6)
+    if magic != b'\x93NUMPY':
+        return np.loadtxt(filename, dtype=int, ndmin=2)
+    indices = np.load(filename, mmap_mode='r')
+    if indices.ndim == 1:
+        # a column of atom indices, as from loadtxt
+        indices = indices[:, np.newaxis]
+    return indices
+
+
 def categorical(pvals, size=None, random_state=None):
     """Return random integer from a categorical distribution
 
@@ -64,55 +102,103 @@ def iter_vars(A, Q, N):
 def assignment_to_weights(assignments, K):
     """Turns a hard assignment into a weights matrix. Useful for
        experimenting with Viterbi-learning.
+
+    Parameters
+    ----------
+    assignments : np.ndarray, shape=(T,), dtype=int
+        The state of each frame, in [0, K).
+    K : int
+        Number of states.
+
+    Returns
+    -------
+    W_i_Ts : np.ndarray, shape=(T, K)
+        One-hot encoding of the assignments.
     """
+    assignments = np.asarray(assignments, dtype=np.intp)
     (T,) = np.shape(assignments)
     W_i_Ts = np.zeros((T, K))
-    for t in range(T):
-        ind = assignments[t]
-        for k in range(K):
-            if k != ind:
-                W_i_Ts[t, k] = 0.0
-            else:
-                W_i_Ts[t.__int__(), ind.__int__()] = 1.0
+    W_i_Ts[np.arange(T), assignments] = 1.0
     return W_i_Ts
 
 
-def empirical_wells(Ys, W_i_Ts):
+def empirical_wells(Ys, W_i_Ts, chunk_size=100000):
+    """Weighted means and covariances of the data in each state.
+
+    The sums are accumulated over chunks of `chunk_size` frames with
+    matrix products, so the memory used besides the inputs is
+    O(chunk_size * y_dim). The data is shifted by the mean of the first
+    chunk before the second moments are accumulated, to limit the loss of
+    precision when the covariances are formed.
+
+    Parameters
+    ----------
+    Ys : np.ndarray, shape=(T, y_dim)
+    W_i_Ts : np.ndarray, shape=(T, K)
+        The weight of each frame in each state, e.g. from
+        assignment_to_weights.
+    chunk_size : int
+
+    Returns
+    -------
+    means : np.ndarray, shape=(K, y_dim)
+    covars : np.ndarray, shape=(K, y_dim, y_dim)
+    """
     (T, y_dim) = np.shape(Ys)
     (_, K) = np.shape(W_i_Ts)
-    means = np.zeros((K, y_dim))
-    covars = np.zeros((K, y_dim, y_dim))
-    for k in range(K):
-        num = np.zeros(y_dim)
-        denom = 0
-        for t in range(T):
-            num += W_i_Ts[t, k] * Ys[t]
-            denom += W_i_Ts[t, k]
-        means[k] = (1.0 / denom) * num
-    for k in range(K):
-        num = np.zeros((y_dim, y_dim))
-        denom = 0
-        for t in range(T):
-            num += W_i_Ts[t, k] * np.outer(Ys[t] - means[k],
-                Ys[t] - means[k])
-            denom += W_i_Ts[t, k]
-        covars[k] = (1.0 / denom) * num
-    return means, covars
+    shift = np.mean(Ys[:chunk_size], axis=0, dtype=np.float64)
+
+    denom = np.zeros(K)
+    first = np.zeros((K, y_dim))
+    second = np.zeros((K, y_dim, y_dim))
+    for start in range(0, T, chunk_size):
+        Y = np.asarray(Ys[start:start + chunk_size], dtype=np.float64) - shift
+        W = np.asarray(W_i_Ts[start:start + chunk_size], dtype=np.float64)
+        denom += W.sum(axis=0)
+        first += np.dot(W.T, Y)
+        for k in range(K):
+            second[k] += np.dot((W[:, k, np.newaxis] * Y).T, Y)
+
+    means = first / denom[:, np.newaxis]
+    covars = (second / denom[:, np.newaxis, np.newaxis]
+              - np.einsum('ki,kj->kij', means, means))
+    return means + shift, covars
 
 
 def means_match(base_means, means, assignments):
+    """Match the states of a model to those of a reference model, by the
+    distance between their means.
+
+    The matching is the one-to-one assignment of states that minimizes
+    the total distance between matched means (the Hungarian algorithm).
+
+    Parameters
+    ----------
+    base_means : np.ndarray, shape=(K, y_dim)
+        Means of the reference states.
+    means : np.ndarray, shape=(K, y_dim)
+        Means of the states to match.
+    assignments : np.ndarray, shape=(T,), dtype=int
+        Hard assignment of frames to the states of `means`.
+
+    Returns
+    -------
+    matching : np.ndarray, shape=(K,), dtype=int
+        State ``matching[i]`` of `means` is matched to state ``i`` of
+        `base_means`.
+    new_assignments : np.ndarray, shape=(T,), dtype=int
+        The assignments, relabeled to the states of `base_means`.
+    """
     (K, y_dim) = np.shape(means)
-    (T,) = np.shape(assignments)
-    matching = np.zeros(K)
-    new_assignments = np.zeros(T)
-    for i in range(K):
-        closest = -1
-        closest_dist = Inf
-        for j in range(K):
-            if norm(base_means[i] - means[j]) < closest_dist:
-                closest = j
-                closest_dist = norm(base_means[i] - means[j])
-        matching[i] = closest
-    for t in range(T):
-        new_assignments[t] = matching[assignments[t]]
+    base_means = np.asarray(base_means, dtype=np.float64)
+    means = np.asarray(means, dtype=np.float64)
+    dist = norm(base_means[:, np.newaxis, :] - means[np.newaxis, :, :],
+                axis=2)
+    rows, cols = linear_sum_assignment(dist)
+
+    matching = np.empty(K, dtype=int)
+    matching[rows] = cols
+    relabel = np.empty(K, dtype=int)
+    relabel[matching] = np.arange(K)
+    new_assignments = relabel[np.asarray(assignments, dtype=np.intp)]
     return matching, new_assignments
@@ -33,12 +33,11 @@
 from __future__ import print_function, division
 
 import numpy as np
-from sklearn import cluster
 from sklearn.hmm import _BaseHMM
 import scipy.special
 from sklearn.utils.extmath import logsumexp
 from scipy.stats.distributions import vonmises
-from mixtape import _vmhmm, _reversibility
+from mixtape import _vmhmm, _reversibility, hotstart
 
 #-----------------------------------------------------------------------------
 # Globals
@@ -94,6 +93,20 @@ class VonMisesHMM(_BaseHMM):
         training.  Can contain any combination of 't' for transmat, 'm' for
         means, and 'k' for kappas, the concentration parameters. Defaults to
         all parameters.
+    precision : str, {'single', 'mixed'}
+        The cosine and sine of the observations are stored in single
+        precision. With 'mixed' precision, the emission log likelihoods are
+        accumulated in double precision. With 'single' precision they are
+        accumulated in single precision, which is faster. The parameters,
+        and the sufficient statistics for the M-step, are always in double
+        precision.
+    n_hotstart : int
+        Number of pairs of consecutive frames, sampled uniformly from all of
+        the sequences, that are clustered to initialize the means, kappas and
+        transmat.
+    n_jobs : int, optional
+        Number of processes used to run the restarts of the k-means hot
+        start. If -1, all CPUs are used.
 
     Attributes
     ----------
@@ -120,7 +133,8 @@ class VonMisesHMM(_BaseHMM):
     """
     def __init__(self, n_states=1, transmat=None, transmat_prior=None,
                  reversible_type='mle', random_state=None, n_iter=10,
-                 thresh=1e-2, params='tmk', init_params='tmk'):
+                 thresh=1e-2, params='tmk', init_params='tmk',
+                 precision='mixed', n_hotstart=10000, n_jobs=1):
         _BaseHMM.__init__(self, n_states, startprob=None, transmat=transmat,
                           startprob_prior=None,
                           transmat_prior=transmat_prior, algorithm='viterbi',
@@ -129,16 +143,16 @@ class VonMisesHMM(_BaseHMM):
                           init_params=init_params)
         self._fitkappas = self._c_fitkappas
         self.reversible_type = reversible_type
+        if precision not in ['single', 'mixed']:
+            raise ValueError('precision must be one of "single" or "mixed"')
+        self.precision = precision
+        self.n_hotstart = n_hotstart
+        self.n_jobs = n_jobs
         self.n_states = n_states
         if self.transmat_prior is None:
             self.transmat_prior = 1.0
 
     def _init(self, obs, params='stmk'):
-        if 't' in params:
-            self.transmat_ = np.ones((self.n_states, self.n_states)) * (1.0 / self.n_components)
-            self.populations_ = np.ones(self.n_states) / self.n_states
-            self.startprob_ = self.populations_
-            
         if (hasattr(self, 'n_features')
                 and self.n_features != obs[0].shape[1]):
             raise ValueError('Unexpected number of dimensions, got %s but '
@@ -146,24 +160,27 @@ class VonMisesHMM(_BaseHMM):
                                               self.n_features))
         self.n_features = obs[0].shape[1]
 
+        if any(p in params for p in 'tmk'):
+            # Cluster the sine and cosine of a uniform sample of pairs of
+            # consecutive frames from all of the sequences
+            means, kappas, counts = hotstart.vonmises_hotstart(
+                obs, self.n_components, n_samples=self.n_hotstart,
+                n_jobs=self.n_jobs, random_state=self.random_state)
+        if 't' in params:
+            self.transmat_, self.populations_ = \
+                _reversibility.reversible_transmat(counts + 1.0)
+            self.startprob_ = self.populations_
         if 'm' in params:
-            # Cluster the sine and cosine of the input data with kmeans to
-            # get initial centers
-            # the number of initial trajectories used should be configurable...
-            # currently it's just the 0-th one
-            cluster_centers = cluster.KMeans(n_clusters=self.n_components).fit(
-                np.hstack((np.sin(obs[0]), np.cos(obs[0])))).cluster_centers_
-            self._means_ = np.arctan2(cluster_centers[:, :self.n_features],
-                                      cluster_centers[:, self.n_features:])
+            self._means_ = means
         if 'k' in params:
-            self._kappas_ = np.ones((self.n_components, self.n_features))
+            self._kappas_ = kappas
 
     def _get_means(self):
         """Mean parameters for each state."""
         return self._means_
 
     def _set_means(self, means):
-        means = np.asarray(means)
+        means = np.asarray(means, dtype=np.float64)
         if (hasattr(self, 'n_features')
                 and means.shape != (self.n_components, self.n_features)):
             raise ValueError('means must have shape '
@@ -180,7 +197,7 @@ class VonMisesHMM(_BaseHMM):
         return self._kappas_
 
     def _set_kappas(self, kappas):
-        kappas = np.asarray(kappas)
+        kappas = np.asarray(kappas, dtype=np.float64)
         if (hasattr(self, 'n_features')
                 and kappas.shape != (self.n_components, self.n_features)):
             raise ValueError('kappas must have shape '
@@ -211,12 +228,38 @@ class VonMisesHMM(_BaseHMM):
         -------
         logl : np.array, shape (`n_samples`, `n_components`)
         """
-        return _vmhmm._compute_log_likelihood(obs, self._means_, self._kappas_)
+        cos_obs, sin_obs = _trig_planes([obs], dtype=np.float32)
+        return np.asarray(self._compute_log_likelihood_trig(cos_obs, sin_obs),
+                          dtype=np.float64)
+
+    def _compute_log_likelihood_trig(self, cos_obs, sin_obs,
+                                     log_normalizer=None):
+        """Compute the log likelihood of each observation in each state,
+        from the precomputed cosine and sine of the observations.
+
+        Parameters
+        ----------
+        cos_obs : np.array, shape (`n_samples`, `n_features`)
+        sin_obs : np.array, shape (`n_samples`, `n_features`)
+        log_normalizer : np.array, shape (`n_components`), optional
+            Log normalization constant of each state, from
+            ``_vmhmm._log_normalizer(kappas)``. It only depends on the
+            parameters, so callers evaluating many sequences under the same
+            parameters should compute it once and pass it in.
+
+        Returns
+        -------
+        logl : np.array, shape (`n_samples`, `n_components`)
+            In single precision if the observations are single precision and
+            ``precision='single'``, otherwise in double precision.
+        """
+        return _vmhmm._compute_log_likelihood(cos_obs, sin_obs, self._means_,
+                                              self._kappas_, log_normalizer,
+                                              self.precision)
 
     def _initialize_sufficient_statistics(self):
         stats = super(VonMisesHMM, self)._initialize_sufficient_statistics()
         stats['posteriors'] = []
-        stats['obs'] = []
         return stats
 
     def _accumulate_sufficient_statistics(self, stats, obs, framelogprob,
@@ -229,34 +272,41 @@ class VonMisesHMM(_BaseHMM):
         # statistics here, because we need to know the mean shifted cosine of
         # the data, which requires knowing the mean. You could do two passes,
         # but that is MUCH more work, since you have to redo the
-        # forwardbackward, so we'll just accumulate the data.
+        # forwardbackward, so we'll just accumulate the posteriors. The
+        # cosine and sine of the data are computed once in fit() and put in
+        # the stats dict there.
         stats['posteriors'].append(posteriors)
-        stats['obs'].append(obs)
 
-    def _py_fitkappas(self, posteriors, obs, means):
+    def _py_fitkappas(self, posteriors, cos_obs, sin_obs, means):
         inv_kappas = np.zeros_like(self._kappas_)
         for i in range(self.n_features):
             for j in range(self.n_components):
-                n = np.sum(posteriors[:, j] * np.cos(obs[:, i] - means[j, i]))
+                # cos(obs - mean) = cos(obs)cos(mean) + sin(obs)sin(mean)
+                n = np.sum(posteriors[:, j] * (cos_obs[:, i] * np.cos(means[j, i]) +
+                                               sin_obs[:, i] * np.sin(means[j, i])))
                 d = np.sum(posteriors[:, j])
                 inv_kappas[j, i] = n / d
         self._kappas_ = inverse_mbessel_ratio(inv_kappas)
 
-    def _c_fitkappas(self, posteriors, obs, means):
-        _vmhmm._fitkappa(posteriors, obs, means, self._kappas_)
+    def _c_fitkappas(self, posteriors, cos_obs, sin_obs, means):
+        _vmhmm._fitkappa(posteriors, cos_obs, sin_obs, means, self._kappas_)
 
-    def _fitmeans(self, posteriors, obs, out):
+    def _fitmeans(self, posteriors, cos_obs, sin_obs, out):
         # this is no possible to speed up in C. the rate limiting step
         # are the matrix multiplys, which are already in MKL with fast
         # numpy. I tried it in C, and I'm 2x as slow for large matrix
         # sizes.
-        np.arctan2(np.dot(posteriors.T, np.sin(obs)),
-                   np.dot(posteriors.T, np.cos(obs)),
+        if self.precision == 'single':
+            # keep the data in single precision, rather than having numpy
+            # upcast the whole thing to double for the GEMM
+            posteriors = posteriors.astype(sin_obs.dtype)
+        np.arctan2(np.dot(posteriors.T, sin_obs),
+                   np.dot(posteriors.T, cos_obs),
                    out=out)
 
     def _do_mstep(self, stats, params):
         posteriors = np.vstack(stats['posteriors'])
-        obs = np.vstack(stats['obs'])
+        cos_obs, sin_obs = stats['cos_obs'], stats['sin_obs']
 
         if 't' in params:
             if self.reversible_type == 'mle':
@@ -274,9 +324,9 @@ class VonMisesHMM(_BaseHMM):
             self.startprob_ = self.populations_
 
         if 'm' in params:
-            self._fitmeans(posteriors, obs, out=self._means_)
+            self._fitmeans(posteriors, cos_obs, sin_obs, out=self._means_)
         if 'k' in params:
-            self._fitkappas(posteriors, obs, self._means_)
+            self._fitkappas(posteriors, cos_obs, sin_obs, self._means_)
 
     def fit(self, obs):
         """Estimate model parameters.
@@ -302,14 +352,23 @@ class VonMisesHMM(_BaseHMM):
         parameter.
         """
         self._init(obs, self.init_params)
+        # The observations don't change during the fit, so their cosine and
+        # sine are computed once here, and used by both the E and M steps.
+        cos_obs, sin_obs = _trig_planes(obs, dtype=np.float32)
+        offsets = np.cumsum([0] + [len(seq) for seq in obs])
 
         logprob = []
         for i in range(self.n_iter):
             # Expectation step
             stats = self._initialize_sufficient_statistics()
+            stats['cos_obs'], stats['sin_obs'] = cos_obs, sin_obs
+            log_normalizer = _vmhmm._log_normalizer(self._kappas_)
             curr_logprob = 0
-            for seq in obs:
-                framelogprob = self._compute_log_likelihood(seq)
+            for j, seq in enumerate(obs):
+                framelogprob = np.asarray(self._compute_log_likelihood_trig(
+                    cos_obs[offsets[j]:offsets[j+1]],
+                    sin_obs[offsets[j]:offsets[j+1]], log_normalizer),
+                    dtype=np.float64)
                 lpr, fwdlattice = self._do_forward_pass(framelogprob)
                 bwdlattice = self._do_backward_pass(framelogprob)
                 gamma = fwdlattice + bwdlattice
@@ -329,6 +388,94 @@ class VonMisesHMM(_BaseHMM):
         
         self.fit_logprob_ = logprob
         return self
+
+    def decode(self, obs, algorithm='viterbi', lengths=None):
+        """Find the most likely hidden state sequence corresponding to `obs`.
+
+        The Viterbi algorithm is run in C, with the sequences split between
+        threads.
+
+        Parameters
+        ----------
+        obs : array_like or list
+            Either a single observation sequence, shape (n, n_features), a
+            list of them, or, when `lengths` is given, several sequences
+            concatenated into one array.
+        algorithm : string, one of {'viterbi', 'map'}
+            Decoder algorithm to be used. Only 'viterbi' is implemented
+            natively.
+        lengths : array_like of integers, optional
+            Lengths of the sequences concatenated in `obs`.
+
+        Returns
+        -------
+        logprob : float
+            Log probability of the maximum likelihood path through the HMM,
+            summed over the sequences.
+        state_sequence : np.ndarray, dtype=int32, or list of them
+            Index of the most likely state for each observation. A list is
+            returned if `obs` was a list, otherwise a single array.
+        """
+        if algorithm != 'viterbi':
+            if lengths is not None or isinstance(obs, list):
+                raise NotImplementedError(
+                    'Only viterbi decoding is supported for multiple sequences')
+            return super(VonMisesHMM, self).decode(obs, algorithm)
+
+        cos_obs, sin_obs, offsets, is_list = _ragged_trig_planes(obs, lengths)
+        logprob, labels = _vmhmm._viterbi(
+            cos_obs, sin_obs, offsets, self._means_, self._kappas_,
+            np.log(self.startprob_), np.log(self.transmat_))
+        if is_list:
+            labels = np.split(labels, offsets[1:-1])
+        return np.sum(logprob), labels
+
+    def predict(self, obs, algorithm='viterbi', lengths=None):
+        """Find the most likely hidden state sequence corresponding to `obs`.
+
+        Parameters
+        ----------
+        obs : array_like or list
+            See :meth:`decode`.
+        algorithm : string, one of {'viterbi', 'map'}
+            Decoder algorithm to be used.
+        lengths : array_like of integers, optional
+            Lengths of the sequences concatenated in `obs`.
+
+        Returns
+        -------
+        state_sequence : np.ndarray, dtype=int32, or list of them
+            Index of the most likely state for each observation.
+        """
+        _, state_sequence = self.decode(obs, algorithm, lengths)
+        return state_sequence
+
+    def predict_proba(self, obs, lengths=None):
+        """Compute the posterior probability of each state given `obs`.
+
+        The forward-backward algorithm is run in C, with the sequences split
+        between threads.
+
+        Parameters
+        ----------
+        obs : array_like or list
+            See :meth:`decode`.
+        lengths : array_like of integers, optional
+            Lengths of the sequences concatenated in `obs`.
+
+        Returns
+        -------
+        posteriors : np.ndarray, shape=(n, n_components), dtype=float32, or list of them
+            Posterior probability of each state for each observation. A list
+            is returned if `obs` was a list, otherwise a single array.
+        """
+        cos_obs, sin_obs, offsets, is_list = _ragged_trig_planes(obs, lengths)
+        _, posteriors = _vmhmm._posteriors(
+            cos_obs, sin_obs, offsets, self._means_, self._kappas_,
+            np.log(self.startprob_), np.log(self.transmat_))
+        if is_list:
+            posteriors = np.split(posteriors, offsets[1:-1])
+        return posteriors
         
     def overlap_(self):
         """
@@ -406,6 +553,88 @@ def circwrap(x):
     return x - M_2PI * np.floor(x / M_2PI + 0.5)
 
 
+def _aligned_empty(shape, dtype, alignment=32):
+    """Like np.empty, but the data buffer is aligned to `alignment` bytes so
+    that the C kernels can use aligned SIMD loads."""
+    dtype = np.dtype(dtype)
+    n_bytes = int(np.prod(shape)) * dtype.itemsize
+    buf = np.empty(n_bytes + alignment, dtype=np.uint8)
+    offset = (-buf.ctypes.data) % alignment
+    return buf[offset:offset+n_bytes].view(dtype).reshape(shape)
+
+
+def _trig_planes(sequences, dtype=np.float64):
+    """Cosine and sine of a list of observation sequences, stacked.
+
+    Parameters
+    ----------
+    sequences : list
+        List of array-like observation sequences, each of which has shape
+        (n_i, n_features)
+    dtype : np.dtype
+        Data type of the output arrays
+
+    Returns
+    -------
+    cos_obs : np.array, shape=(sum(n_i), n_features)
+    sin_obs : np.array, shape=(sum(n_i), n_features)
+        The cosine and sine of the observations. The rows for the i-th
+        sequence start at sum(n_0, ... n_{i-1}). Both arrays are C-contiguous
+        and aligned.
+    """
+    n_samples = sum(len(seq) for seq in sequences)
+    n_features = np.shape(sequences[0])[1]
+    cos_obs = _aligned_empty((n_samples, n_features), dtype)
+    sin_obs = _aligned_empty((n_samples, n_features), dtype)
+
+    start = 0
+    for seq in sequences:
+        end = start + len(seq)
+        np.cos(seq, out=cos_obs[start:end])
+        np.sin(seq, out=sin_obs[start:end])
+        start = end
+    return cos_obs, sin_obs
+
+
+def _ragged_trig_planes(obs, lengths=None):
+    """Cosine and sine of one or more sequences, as a ragged buffer
+
+    Parameters
+    ----------
+    obs : array_like or list
+        A single sequence, a list of sequences, or several sequences
+        concatenated together (with `lengths`)
+    lengths : array_like of integers, optional
+        Lengths of the sequences concatenated in `obs`
+
+    Returns
+    -------
+    cos_obs, sin_obs : np.array, shape=(n_samples, n_features), dtype=float32
+        See _trig_planes
+    offsets : np.array, shape=(n_sequences+1,), dtype=intp
+        The i-th sequence occupies the rows [offsets[i], offsets[i+1])
+    is_list : bool
+        Whether `obs` was a list of sequences
+    """
+    is_list = isinstance(obs, (list, tuple))
+    if is_list:
+        sequences = obs
+    else:
+        sequences = [np.asarray(obs)]
+    offsets = np.cumsum([0] + [len(seq) for seq in sequences]).astype(np.intp)
+    cos_obs, sin_obs = _trig_planes(sequences, dtype=np.float32)
+
+    if lengths is not None:
+        if is_list:
+            raise ValueError('lengths can only be used with a single array')
+        lengths = np.asarray(lengths, dtype=np.intp)
+        if np.sum(lengths) != offsets[-1] or np.any(lengths < 0):
+            raise ValueError('lengths must sum to the number of samples, '
+                             '%d' % offsets[-1])
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.intp)
+    return cos_obs, sin_obs, offsets, is_list
+
+
 class inverse_mbessel_ratio(object):
     """
     Inverse the function given by the ratio modified Bessel function of the
@@ -414,49 +643,15 @@ class inverse_mbessel_ratio(object):
 
     y = A(x) = I_1(x) / I_0(x)
 
-    This function computes A^(-1)(y) by way of a precomputed spline
-    interpolation
+    This function computes A^(-1)(y) by way of a spline interpolation,
+    which is precomputed by setup.py at build time and evaluated in C (the
+    same tables are used by the C M-step), so there's no fitting cost on
+    first use. Values of y outside of the range of the spline (about
+    [5e-6, 0.9993]) are clipped.
     """
 
-    def __init__(self, n_points=512):
-        self._n_points = n_points
-        self._is_fit = False
-        self._min_x = 1e-5
-        self._max_x = 700
-
-    def _fit(self):
-        """We want to do the fitting once, but not at import time since it
-        slows down the loading of the interpreter"""
-        # Fitting takes about 0.5s on a laptop, and wth 512 points and cubic
-        # interpolation, gives typical errors around 1e-9
-        x = np.logspace(np.log10(self._min_x), np.log10(self._max_x),
-                        self._n_points)
-        y = self.bessel_ratio(x)
-        self._min = np.min(y)
-        self._max = np.max(y)
-
-        # Spline fit the log of the inverse function
-        from scipy.interpolate import interp1d
-        self._spline = interp1d(y, np.log(x), kind='cubic')
-        self._is_fit = True
-
     def __call__(self, y):
-        if not self._is_fit:
-            self._fit()
-
-        y = np.asarray(y)
-        y = np.clip(y, a_min=self._min, a_max=self._max)
-
-        if np.any(np.logical_or(0 > y, y > 1)):
-            raise ValueError('Domain error. y must be in (0, 1)')
-        x = np.exp(self._spline(y))
-
-        ## DEBUGGING CODE
-        # # for debugging, the line below prints the error in the inverse
-        # # by printing y - A(A^(-1)(y
-        # print('spline inverse error', y - self.bessel_ratio(x))
-
-        return x
+        return _vmhmm._inv_mbessel_ratio(y)
 
     @staticmethod
     def bessel_ratio(x):
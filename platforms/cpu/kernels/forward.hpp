@@ -5,6 +5,8 @@
 /*                                                               */
 /*****************************************************************/
 
+#ifndef MIXTAPE_CPU_FORWARD_H
+#define MIXTAPE_CPU_FORWARD_H
 #include "logsumexp.hpp"
 #include "stdlib.h"
 namespace Mixtape {
@@ -35,3 +37,4 @@ REAL* __restrict__ fwdlattice)
 }
 
 } // namespace
+#endif
@@ -42,52 +42,138 @@ void gaussian_loglikelihood_diag(const float* __restrict__ sequence,
 }
 
 
+int gaussian_loglikelihood_full_factorize(const float* __restrict__ covariances,
+                                          const int n_states,
+                                          const int n_features,
+                                          float* __restrict__ cv_chol,
+                                          float* __restrict__ cv_log_det)
+{
+    /* Cholesky factorization and log determinant of each state's covariance
+       matrix. These only depend on the parameters, so they should be computed
+       once per parameter update, and then shared (read-only) by every call to
+       gaussian_loglikelihood_full.
+
+       Returns 0 on success. If the covariance matrix of state i is not
+       positive definite, returns i+1.
+    */
+    int i, j, info;
+
+    memcpy(cv_chol, covariances, n_states*n_features*n_features*sizeof(float));
+    for (i = 0; i < n_states; i++) {
+        // Cholesky decomposition of the covariance matrix
+        spotrf_("L", &n_features, &cv_chol[i*n_features*n_features], &n_features, &info);
+        if (info != 0)
+            return i+1;
+
+        cv_log_det[i] = 0;
+        for (j = 0; j < n_features; j++)
+            cv_log_det[i] += 2*log(cv_chol[i*n_features*n_features + j*n_features + j]);
+    }
+    return 0;
+}
+
+
 void gaussian_loglikelihood_full(const float* __restrict__ sequence,
                                  const float* __restrict__ means,
-                                 const float* __restrict__ covariances,
+                                 const float* __restrict__ cv_chol,
+                                 const float* __restrict__ cv_log_det,
                                  const int n_observations,
                                  const int n_states,
                                  const int n_features,
+                                 float* __restrict__ work,
                                  float* __restrict__ loglikelihoods)
 {
-    int i, j, k, info;
-    float chol_sol, chol2, cv_log_det;
-    float* cv_chol;
-    float* sequence_minus_means = malloc(n_observations * n_features * sizeof(float));
-    float prefactor = n_features * log(2 * M_PI);
+    /* Log likelihood of each observation under each state's full covariance
+       Gaussian.
+
+       cv_chol and cv_log_det come from gaussian_loglikelihood_full_factorize.
+       work is a scratch buffer of size n_observations*n_features.
+    */
+    int i, j, k;
+    float chol_sol, chol2;
+    const float onef = 1.0;
+    const float prefactor = n_features * log(2 * M_PI);
 
     for (i = 0; i < n_states; i++) {
-        cv_chol = malloc(n_features * n_features * sizeof(float));
-        memcpy(cv_chol, &covariances[i*n_features*n_features], n_features*n_features*sizeof(float));
         for (j = 0; j < n_observations; j++)
             for (k = 0; k < n_features; k++)
-                sequence_minus_means[j*n_features + k] = sequence[j*n_features + k] - means[i*n_features + k];
-
-        // Cholesky decomposition of the covariance matrix
-        spotrf_("L", &n_features, cv_chol, &n_features, &info);
-        if (info != 0) { fprintf(stderr, "LAPACK Error in %s at %d\n", __FILE__, __LINE__); exit(1); }
-
-        cv_log_det = 0;
-        for (j = 0; j < n_features; j++) {
-            cv_log_det += 2*log(cv_chol[j*n_features + j]);
-        }
+                work[j*n_features + k] = sequence[j*n_features + k] - means[i*n_features + k];
 
-        // solve the triangular system
-        strtrs_("L", "N", "N", &n_features, &n_observations, cv_chol, &n_features,
-                sequence_minus_means, &n_features, &info);
-        if (info != 0) { fprintf(stderr, "LAPACK Error in %s at %d\n", __FILE__, __LINE__); exit(1); }
+        // solve the triangular system L^{-1} (x - mu) for all of the frames
+        // at once
+        strsm_("L", "L", "N", "N", &n_features, &n_observations, &onef,
+               &cv_chol[i*n_features*n_features], &n_features, work, &n_features);
 
         for (j = 0; j < n_observations; j++) {
-            loglikelihoods[j*n_states + i] = -0.5 * (cv_log_det + prefactor);
+            loglikelihoods[j*n_states + i] = -0.5 * (cv_log_det[i] + prefactor);
             for (k = 0; k < n_features; k++) {
-                chol_sol = sequence_minus_means[j*n_features + k];
+                chol_sol = work[j*n_features + k];
                 chol2 = chol_sol * chol_sol;
                 loglikelihoods[j*n_states + i] += -0.5*chol2;
             }
         }
-        free(cv_chol);
     }
-    free(sequence_minus_means);
+}
+
+
+void switching_var1_loglikelihood(const float* __restrict__ sequence,
+                                  const float* __restrict__ means,
+                                  const float* __restrict__ cv_chol,
+                                  const float* __restrict__ cv_log_det,
+                                  const float* __restrict__ As,
+                                  const float* __restrict__ bs,
+                                  const float* __restrict__ q_chol,
+                                  const float* __restrict__ q_log_det,
+                                  const int n_observations,
+                                  const int n_states,
+                                  const int n_features,
+                                  float* __restrict__ work,
+                                  float* __restrict__ loglikelihoods)
+{
+    /* Emission log likelihood of each observation under each state of the
+       switching VAR(1) model. The first frame is drawn from the state's
+       stationary Gaussian, N(y_0; means_k, covariances_k), and each of the
+       later frames conditionally on the one before,
+       N(y_t; A_k y_{t-1} + b_k, Q_k).
+
+       cv_chol/cv_log_det and q_chol/q_log_det are the factorizations of the
+       covariances and of the Qs, from gaussian_loglikelihood_full_factorize.
+       work is a scratch buffer of size n_observations*n_features.
+    */
+    int i, j, k;
+    float chol_sol;
+    const int n_transitions = n_observations - 1;
+    const float onef = 1.0;
+    const float neg_onef = -1.0;
+    const float prefactor = n_features * log(2 * M_PI);
+
+    if (n_observations <= 0)
+        return;
+    gaussian_loglikelihood_full(sequence, means, cv_chol, cv_log_det, 1,
+                                n_states, n_features, work, loglikelihoods);
+    if (n_transitions == 0)
+        return;
+
+    for (i = 0; i < n_states; i++) {
+        // the residuals y_t - b_k - A_k y_{t-1} of all of the transitions.
+        // In BLAS's column-major view, the (row-major) sequence is the
+        // n_features x n_observations matrix Y, and A_k is transposed.
+        for (j = 0; j < n_transitions; j++)
+            for (k = 0; k < n_features; k++)
+                work[j*n_features + k] = sequence[(j+1)*n_features + k] - bs[i*n_features + k];
+        sgemm_("T", "N", &n_features, &n_transitions, &n_features, &neg_onef,
+               &As[i*n_features*n_features], &n_features, (float*) sequence,
+               &n_features, &onef, work, &n_features);
 
+        strsm_("L", "L", "N", "N", &n_features, &n_transitions, &onef,
+               &q_chol[i*n_features*n_features], &n_features, work, &n_features);
+
+        for (j = 0; j < n_transitions; j++) {
+            loglikelihoods[(j+1)*n_states + i] = -0.5 * (q_log_det[i] + prefactor);
+            for (k = 0; k < n_features; k++) {
+                chol_sol = work[j*n_features + k];
+                loglikelihoods[(j+1)*n_states + i] += -0.5*chol_sol*chol_sol;
+            }
+        }
+    }
 }
-    
\ No newline at end of file
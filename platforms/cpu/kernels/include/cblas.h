@@ -13,6 +13,18 @@ int sgemm_(const char *transa, const char *transb, const int *m,
            const float *a, const int *lda,  float *b,
            const int *ldb, const float *beta, float *c, const int *ldc);
 
+// Single precision symmetric rank-k update, C = alpha*A*A^T + beta*C
+// (trans="N"), of either the upper or lower triangle of C
+int ssyrk_(const char *uplo, const char *trans, const int *n, const int *k,
+           const float *alpha, const float *a, const int *lda,
+           const float *beta, float *c, const int *ldc);
+
+// Single precision triangular solve with multiple right-hand sides,
+// op(A) X = alpha*B (side="L"), overwriting B with X
+int strsm_(const char *side, const char *uplo, const char *transa,
+           const char *diag, const int *m, const int *n, const float *alpha,
+           const float *a, const int *lda, float *b, const int *ldb);
+
 
 /* ---------------------------- LAPACK ------------------------------------ */
 
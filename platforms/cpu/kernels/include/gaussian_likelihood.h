@@ -15,13 +15,35 @@ void gaussian_loglikelihood_diag(const float* __restrict__ sequence,
                                  const int n_states, const int n_features,
                                  float* __restrict__ loglikelihoods);
 
+int gaussian_loglikelihood_full_factorize(const float* __restrict__ covariances,
+                                          const int n_states,
+                                          const int n_features,
+                                          float* __restrict__ cv_chol,
+                                          float* __restrict__ cv_log_det);
+
 void gaussian_loglikelihood_full(const float* __restrict__ sequence,
                                  const float* __restrict__ means,
-                                 const float* __restrict__ covariances,
+                                 const float* __restrict__ cv_chol,
+                                 const float* __restrict__ cv_log_det,
                                  const int n_observations,
                                  const int n_states,
                                  const int n_features,
+                                 float* __restrict__ work,
                                  float* __restrict__ loglikelihoods);
+
+void switching_var1_loglikelihood(const float* __restrict__ sequence,
+                                  const float* __restrict__ means,
+                                  const float* __restrict__ cv_chol,
+                                  const float* __restrict__ cv_log_det,
+                                  const float* __restrict__ As,
+                                  const float* __restrict__ bs,
+                                  const float* __restrict__ q_chol,
+                                  const float* __restrict__ q_log_det,
+                                  const int n_observations,
+                                  const int n_states,
+                                  const int n_features,
+                                  float* __restrict__ work,
+                                  float* __restrict__ loglikelihoods);
 #ifdef __cplusplus
 }
 #endif
@@ -0,0 +1,166 @@
+/*****************************************************************/
+/*    Copyright (c) 2013, Stanford University and the Authors    */
+/*    Author: Robert McGibbon <rmcgibbo@gmail.com>               */
+/*    Contributors:                                              */
+/*                                                               */
+/*****************************************************************/
+#ifndef MIXTAPE_CPU_MSLDS_DECODE
+#define MIXTAPE_CPU_MSLDS_DECODE
+
+#include "stdlib.h"
+#include "stdio.h"
+#ifdef _OPENMP
+#include "omp.h"
+#endif
+#include "math.h"
+
+#include "gaussian_likelihood.h"
+#include "logsumexp.hpp"
+#include "forward.hpp"
+#include "backward.hpp"
+#include "posteriors.hpp"
+#include "viterbi.hpp"
+
+namespace Mixtape {
+
+/**
+ * Decode sequences under the Metastable Switching Linear Dynamical System,
+ * whose emission distribution in state k is N(y_0; means_k, covariances_k)
+ * for the first frame, and N(y_t; A_k y_{t-1} + b_k, Q_k) for the rest.
+ *
+ * The sequences are independent, so they're split between the threads. The
+ * per-sequence outputs, state_sequences (sum(sequence_lengths)) and
+ * posteriors (sum(sequence_lengths) x n_states), are the concatenation over
+ * the sequences, and either of them may be NULL if it isn't needed.
+ * viterbi_logprob is the sum over the sequences of the log probability of
+ * the most likely path, and logprob is the total log likelihood.
+ *
+ * The template parameter controls the precision of the lattices.
+ *
+ * Returns 0 on success. If the covariance matrix of state i is not positive
+ * definite, nothing is computed and i+1 is returned, and if Q_i isn't,
+ * -(i+1) is returned.
+ */
+template<typename REAL>
+int do_mslds_decode(const float* __restrict__ log_transmat,
+                    const float* __restrict__ log_transmat_T,
+                    const float* __restrict__ log_startprob,
+                    const float* __restrict__ means,
+                    const float* __restrict__ covariances,
+                    const float* __restrict__ As,
+                    const float* __restrict__ bs,
+                    const float* __restrict__ Qs,
+                    const float** __restrict__ sequences,
+                    const int n_sequences,
+                    const int* __restrict__ sequence_lengths,
+                    const int n_features,
+                    const int n_states,
+                    int* __restrict__ state_sequences,
+                    float* __restrict__ viterbi_logprob,
+                    float* __restrict__ posteriors,
+                    float* __restrict__ logprob)
+{
+    int i, length;
+    long* offsets;
+    const float *sequence;
+    float *framelogprob, *likelihood_work;
+    float *cv_chol, *cv_log_det, *q_chol, *q_log_det;
+    REAL *fwdlattice, *bwdlattice;
+    int *backpointers;
+    REAL seq_viterbi_logprob, seq_logprob;
+    int info;
+
+    // The Cholesky factors of the covariance matrices and of the Qs are
+    // shared by all of the sequences
+    cv_chol = (float*) malloc(n_states*n_features*n_features*sizeof(float));
+    cv_log_det = (float*) malloc(n_states*sizeof(float));
+    q_chol = (float*) malloc(n_states*n_features*n_features*sizeof(float));
+    q_log_det = (float*) malloc(n_states*sizeof(float));
+    offsets = (long*) malloc((n_sequences+1)*sizeof(long));
+    if (cv_chol == NULL || cv_log_det == NULL || q_chol == NULL || q_log_det == NULL || offsets == NULL) {
+        fprintf(stderr, "Memory allocation failure in %s at %d\n", __FILE__, __LINE__); exit(EXIT_FAILURE);
+    }
+    info = gaussian_loglikelihood_full_factorize(covariances, n_states, n_features, cv_chol, cv_log_det);
+    if (info == 0) {
+        info = gaussian_loglikelihood_full_factorize(Qs, n_states, n_features, q_chol, q_log_det);
+        info = -info;
+    }
+    if (info != 0) {
+        free(cv_chol);
+        free(cv_log_det);
+        free(q_chol);
+        free(q_log_det);
+        free(offsets);
+        return info;
+    }
+
+    offsets[0] = 0;
+    for (i = 0; i < n_sequences; i++)
+        offsets[i+1] = offsets[i] + sequence_lengths[i];
+
+    // the sequences can have very different lengths, so they're handed
+    // out dynamically
+    #ifdef _OPENMP
+    #pragma omp parallel for schedule(dynamic)                                \
+        private(sequence, length, framelogprob, likelihood_work, fwdlattice,  \
+                bwdlattice, backpointers, seq_viterbi_logprob, seq_logprob)
+    #endif
+    for (i = 0; i < n_sequences; i++) {
+        sequence = sequences[i];
+        length = sequence_lengths[i];
+        if (length == 0)
+            continue;
+        framelogprob = (float*) malloc(length*n_states*sizeof(float));
+        likelihood_work = (float*) malloc(length*n_features*sizeof(float));
+        fwdlattice = (REAL*) malloc(length*n_states*sizeof(REAL));
+        bwdlattice = (REAL*) malloc(length*n_states*sizeof(REAL));
+        backpointers = (int*) malloc(length*n_states*sizeof(int));
+        if (framelogprob == NULL || likelihood_work == NULL || fwdlattice == NULL
+            || bwdlattice == NULL || backpointers == NULL) {
+            fprintf(stderr, "Memory allocation failure in %s at %d\n", __FILE__, __LINE__); exit(EXIT_FAILURE);
+        }
+
+        switching_var1_loglikelihood(sequence, means, cv_chol, cv_log_det, As, bs, q_chol, q_log_det,
+                                     length, n_states, n_features, likelihood_work, framelogprob);
+
+        seq_viterbi_logprob = 0;
+        if (state_sequences != NULL)
+            // the forward lattice is reused as the viterbi lattice
+            seq_viterbi_logprob = viterbi(log_transmat, log_startprob, framelogprob, length, n_states,
+                                          fwdlattice, backpointers, &state_sequences[offsets[i]]);
+
+        forward(log_transmat_T, log_startprob, framelogprob, length, n_states, fwdlattice);
+        seq_logprob = logsumexp(&fwdlattice[(length-1)*n_states], n_states);
+        if (posteriors != NULL) {
+            backward(log_transmat, log_startprob, framelogprob, length, n_states, bwdlattice);
+            compute_posteriors(fwdlattice, bwdlattice, length, n_states, &posteriors[offsets[i]*n_states]);
+        }
+
+        #ifdef _OPENMP
+        #pragma omp critical
+        {
+        #endif
+        *viterbi_logprob += seq_viterbi_logprob;
+        *logprob += seq_logprob;
+        #ifdef _OPENMP
+        }
+        #endif
+
+        free(framelogprob);
+        free(likelihood_work);
+        free(fwdlattice);
+        free(bwdlattice);
+        free(backpointers);
+    }
+
+    free(cv_chol);
+    free(cv_log_det);
+    free(q_chol);
+    free(q_log_det);
+    free(offsets);
+    return 0;
+}
+
+} // namespace
+
+#endif
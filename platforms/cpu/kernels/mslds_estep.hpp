@@ -23,13 +23,29 @@
 
 namespace Mixtape {
 
-void _update_state_matricies(int k, int n, float* A, const float* alpha, const float* B)
+/**
+ * Add alpha * x * x^T to the lower triangle (in BLAS column-major terms) of
+ * the n x n symmetric matrix A.
+ */
+void _add_lower_rank1(int n, float alpha, const float* x, float* A)
 {
-    int kk, i;
-    for (kk = 0; kk < k; kk++) {
-        for (i = 0; i < n*n; i++)
-            A[kk * n * n + i] += alpha[kk] * B[i];
-    }
+    int m, l;
+    for (l = 0; l < n; l++)
+        for (m = l; m < n; m++)
+            A[l*n + m] += alpha * x[m] * x[l];
+}
+
+/**
+ * Copy the lower triangle (in BLAS column-major terms) of each of the k
+ * n x n symmetric matrices in A into the upper triangle.
+ */
+void _symmetrize_lower(int k, int n, float* A)
+{
+    int kk, m, l;
+    for (kk = 0; kk < k; kk++)
+        for (l = 0; l < n; l++)
+            for (m = l+1; m < n; m++)
+                A[kk*n*n + m*n + l] = A[kk*n*n + l*n + m];
 }
 
 /**
@@ -39,9 +55,12 @@ void _update_state_matricies(int k, int n, float* A, const float* alpha, const f
  * The template parameter controls the precision of the foward and backward
  * lattices which are subject to accumulated floating point error during long
  * trajectories.
+ *
+ * Returns 0 on success. If the covariance matrix of state i is not positive
+ * definite, nothing is computed and i+1 is returned.
  */
 template<typename REAL>
-void do_mslds_estep(const float* __restrict__ log_transmat,
+int do_mslds_estep(const float* __restrict__ log_transmat,
               const float* __restrict__ log_transmat_T,
               const float* __restrict__ log_startprob,
               const float* __restrict__ means,
@@ -64,18 +83,33 @@ void do_mslds_estep(const float* __restrict__ log_transmat,
               float* __restrict__ post_but_last,
               float* __restrict__ logprob)
 {
-    int i, j, k, m, n, length, length_minus_1;
-    float tlocallogprob;
+    int i, j, k, m, length, length_minus_1, length_minus_2;
+    float tlocallogprob, sqrt_w;
     const float onef = 1.0;
     const float *sequence;
     float *framelogprob, *posteriors, *seq_transcounts, *seq_obs, *seq_obs_but_first;
     float *seq_obs_but_last, *seq_obs_obs_T, *seq_obs_obs_T_offset;
     float *seq_obs_obs_T_but_first, *seq_obs_obs_T_but_last, *seq_post;
     float *seq_post_but_last, *seq_post_but_first;
-    float *frame_obs_obs_T, *frame_obs_obs_T_offset;
-    float obs_m, obs_n;
+    float *weighted_obs, *seq_obs_obs_T_middle;
 
     REAL *fwdlattice, *bwdlattice;
+    float *cv_chol, *cv_log_det, *likelihood_work;
+    int info;
+
+    // The Cholesky factors of the covariance matrices are shared by all of
+    // the sequences
+    cv_chol = (float*) malloc(n_states*n_features*n_features*sizeof(float));
+    cv_log_det = (float*) malloc(n_states*sizeof(float));
+    if (cv_chol == NULL || cv_log_det == NULL) {
+        fprintf(stderr, "Memory allocation failure in %s at %d\n", __FILE__, __LINE__); exit(EXIT_FAILURE);
+    }
+    info = gaussian_loglikelihood_full_factorize(covariances, n_states, n_features, cv_chol, cv_log_det);
+    if (info != 0) {
+        free(cv_chol);
+        free(cv_log_det);
+        return info;
+    }
 
     #ifdef _OPENMP
     #pragma omp parallel for default(none)                                    \
@@ -83,19 +117,21 @@ void do_mslds_estep(const float* __restrict__ log_transmat,
                covariances, sequences, sequence_lengths, transcounts,         \
                obs, obs_but_first, obs_but_last, obs_obs_T, obs_obs_T_offset, \
                obs_obs_T_but_first, obs_obs_T_but_last, post, post_but_first, \
-               post_but_last, logprob, stderr)                                \
+               post_but_last, logprob, cv_chol, cv_log_det, stderr)           \
         private(sequence, framelogprob, fwdlattice, bwdlattice,               \
                 posteriors, seq_transcounts, seq_obs, seq_obs_but_first,      \
                 seq_obs_but_last, seq_obs_obs_T,          \
                 seq_obs_obs_T_offset, seq_obs_obs_T_but_first,                \
-                seq_obs_obs_T_but_last, frame_obs_obs_T, seq_post,            \
-                seq_post_but_first, seq_post_but_last, tlocallogprob, j, k,   \
-                length, length_minus_1, m, obs_m, n, obs_n)
+                seq_obs_obs_T_but_last, seq_obs_obs_T_middle, weighted_obs,   \
+                seq_post, seq_post_but_first, seq_post_but_last,              \
+                tlocallogprob, j, k, length, length_minus_1, length_minus_2,  \
+                m, sqrt_w, likelihood_work)
     #endif
     for (i = 0; i < n_sequences; i++) {
         sequence = sequences[i];
         length = sequence_lengths[i];
         length_minus_1 = length - 1;
+        length_minus_2 = length - 2;
         framelogprob = (float*) malloc(sequence_lengths[i]*n_states*sizeof(float));
         fwdlattice = (REAL*) malloc(sequence_lengths[i]*n_states*sizeof(REAL));
         bwdlattice = (REAL*) malloc(sequence_lengths[i]*n_states*sizeof(REAL));
@@ -108,7 +144,9 @@ void do_mslds_estep(const float* __restrict__ log_transmat,
         seq_obs_obs_T_offset = (float*) calloc(n_states*n_features*n_features, sizeof(float));
         seq_obs_obs_T_but_first = (float*) calloc(n_states*n_features*n_features, sizeof(float));
         seq_obs_obs_T_but_last = (float*) calloc(n_states*n_features*n_features, sizeof(float));
-        frame_obs_obs_T = (float*) malloc(n_features*n_features*sizeof(float));
+        seq_obs_obs_T_middle = (float*) malloc(n_features*n_features*sizeof(float));
+        weighted_obs = (float*) malloc(length*n_features*sizeof(float));
+        likelihood_work = (float*) malloc(length*n_features*sizeof(float));
         seq_post = (float*) calloc(n_states, sizeof(float));
         seq_post_but_first = (float*) calloc(n_states, sizeof(float));
         seq_post_but_last = (float*) calloc(n_states, sizeof(float));
@@ -116,13 +154,14 @@ void do_mslds_estep(const float* __restrict__ log_transmat,
         if (framelogprob == NULL || fwdlattice == NULL || bwdlattice == NULL || posteriors == NULL
             || seq_transcounts == NULL || seq_obs == NULL || seq_obs_obs_T ==NULL
             || seq_obs_obs_T_offset == NULL || seq_obs_obs_T_but_first == NULL
-            || seq_obs_obs_T_but_last == NULL || frame_obs_obs_T == NULL || seq_post == NULL
+            || seq_obs_obs_T_but_last == NULL || seq_obs_obs_T_middle == NULL
+            || weighted_obs == NULL || likelihood_work == NULL || seq_post == NULL
             || seq_post_but_first == NULL || seq_post_but_last == NULL) {
             fprintf(stderr, "Memory allocation failure in %s at %d\n", __FILE__, __LINE__); exit(EXIT_FAILURE);
         }
 
         // Do work for this sequence
-        gaussian_loglikelihood_full(sequence, means, covariances, length, n_states, n_features, framelogprob);
+        gaussian_loglikelihood_full(sequence, means, cv_chol, cv_log_det, length, n_states, n_features, likelihood_work, framelogprob);
         forward(log_transmat_T, log_startprob, framelogprob, length, n_states, fwdlattice);
         backward(log_transmat, log_startprob, framelogprob, length, n_states, bwdlattice);
         compute_posteriors(fwdlattice, bwdlattice, length, n_states, posteriors);
@@ -144,33 +183,56 @@ void do_mslds_estep(const float* __restrict__ log_transmat,
             }
         }
 
-        for (j = 0; j < sequence_lengths[i]; j++) {
+        // The second moments are posterior-weighted Gram matrices, computed
+        // one state at a time with BLAS over the whole sequence. In BLAS's
+        // column-major view, the (row-major) sequence is the n_features x
+        // length matrix X, so sum_j w_j x_j x_j^T = (X W^1/2)(X W^1/2)^T is
+        // a symmetric rank-k update, of which only the lower triangle is
+        // computed. The statistics over all of the frames, all but the
+        // first, and all but the last only differ by the contributions of
+        // the first and last frames, so the update is done once, on the
+        // frames in the middle.
+        for (k = 0; k < n_states; k++) {
+            float* obs_obs_T_k = &seq_obs_obs_T[k*n_features*n_features];
+            float* obs_obs_T_but_first_k = &seq_obs_obs_T_but_first[k*n_features*n_features];
+            float* obs_obs_T_but_last_k = &seq_obs_obs_T_but_last[k*n_features*n_features];
+            const float w_first = posteriors[0*n_states + k];
+            const float w_last = posteriors[length_minus_1*n_states + k];
 
-            // sequence[j]*sequence[j].T
-            for (int m = 0; m < n_features; m++) {
-                obs_m = sequence[j*n_features + m];
-                for (int n = 0; n < n_features; n++) {
-                    obs_n = sequence[j*n_features + n];
-                    frame_obs_obs_T[m*n_features + n] = obs_m*obs_n;
+            for (m = 0; m < n_features*n_features; m++)
+                seq_obs_obs_T_middle[m] = 0;
+            if (length_minus_2 > 0) {
+                for (j = 1; j < length_minus_1; j++) {
+                    sqrt_w = sqrtf(posteriors[j*n_states + k]);
+                    for (m = 0; m < n_features; m++)
+                        weighted_obs[(j-1)*n_features + m] = sqrt_w * sequence[j*n_features + m];
                 }
+                ssyrk_("L", "N", &n_features, &length_minus_2, &onef, weighted_obs,
+                       &n_features, &onef, seq_obs_obs_T_middle, &n_features);
             }
 
-            _update_state_matricies(n_states, n_features, seq_obs_obs_T, &posteriors[j*n_states], frame_obs_obs_T);
-            if (j > 0)
-                _update_state_matricies(n_states, n_features, seq_obs_obs_T_but_first, &posteriors[j*n_states], frame_obs_obs_T);
-            if (j < sequence_lengths[i] - 1)
-                _update_state_matricies(n_states, n_features, seq_obs_obs_T_but_last, &posteriors[j*n_states], frame_obs_obs_T);
-
-            if (j > 0) {
-                // sequence[j]*sequence[j-1].T
-                for (m = 0; m < n_features; m++) {
-                    obs_m = sequence[j*n_features + m];
-                    for (n = 0; n < n_features; n++) {
-                        obs_n = sequence[(j-1)*n_features + n];
-                        frame_obs_obs_T[m*n_features + n] = obs_m*obs_n;
-                    }
+            for (m = 0; m < n_features*n_features; m++) {
+                obs_obs_T_k[m] = seq_obs_obs_T_middle[m];
+                if (length > 1) {
+                    obs_obs_T_but_first_k[m] = seq_obs_obs_T_middle[m];
+                    obs_obs_T_but_last_k[m] = seq_obs_obs_T_middle[m];
                 }
-                _update_state_matricies(n_states, n_features, seq_obs_obs_T_offset, &posteriors[j*n_states], frame_obs_obs_T);
+            }
+            _add_lower_rank1(n_features, w_first, sequence, obs_obs_T_k);
+            if (length > 1) {
+                _add_lower_rank1(n_features, w_last, &sequence[length_minus_1*n_features], obs_obs_T_k);
+                _add_lower_rank1(n_features, w_last, &sequence[length_minus_1*n_features], obs_obs_T_but_first_k);
+                _add_lower_rank1(n_features, w_first, sequence, obs_obs_T_but_last_k);
+            }
+
+            // sum_{j>0} w_j x_j x_{j-1}^T, which is stored row-major, so in
+            // column-major terms it's X[:, :-1] (W X[:, 1:])^T
+            if (length_minus_1 > 0) {
+                for (j = 1; j < length; j++)
+                    for (m = 0; m < n_features; m++)
+                        weighted_obs[(j-1)*n_features + m] = posteriors[j*n_states + k] * sequence[j*n_features + m];
+                sgemm_("N", "T", &n_features, &n_features, &length_minus_1, &onef, sequence, &n_features,
+                       weighted_obs, &n_features, &onef, &seq_obs_obs_T_offset[k*n_features*n_features], &n_features);
             }
         }
 
@@ -194,11 +256,15 @@ void do_mslds_estep(const float* __restrict__ log_transmat,
             for (k = 0; k < n_states; k++)
                 transcounts[j*n_states+k] += seq_transcounts[j*n_states+k];
 
-            for (k = 0; k < n_features*n_features; k++) {
-                obs_obs_T[j*n_features*n_features + k] += seq_obs_obs_T[j*n_features*n_features + k];
+            for (k = 0; k < n_features*n_features; k++)
                 obs_obs_T_offset[j*n_features*n_features + k] += seq_obs_obs_T_offset[j*n_features*n_features + k];
-                obs_obs_T_but_first[j*n_features*n_features + k] += seq_obs_obs_T_but_first[j*n_features*n_features + k];
-                obs_obs_T_but_last[j*n_features*n_features + k] += seq_obs_obs_T_but_last[j*n_features*n_features + k];
+            // only the lower triangles of the symmetric statistics
+            for (k = 0; k < n_features; k++) {
+                for (m = k; m < n_features; m++) {
+                    obs_obs_T[j*n_features*n_features + k*n_features + m] += seq_obs_obs_T[j*n_features*n_features + k*n_features + m];
+                    obs_obs_T_but_first[j*n_features*n_features + k*n_features + m] += seq_obs_obs_T_but_first[j*n_features*n_features + k*n_features + m];
+                    obs_obs_T_but_last[j*n_features*n_features + k*n_features + m] += seq_obs_obs_T_but_last[j*n_features*n_features + k*n_features + m];
+                }
             }
         }
         #ifdef _OPENMP
@@ -221,9 +287,19 @@ void do_mslds_estep(const float* __restrict__ log_transmat,
         free(seq_post);
         free(seq_post_but_first);
         free(seq_post_but_last);
-        free(frame_obs_obs_T);
+        free(seq_obs_obs_T_middle);
+        free(weighted_obs);
+        free(likelihood_work);
     }
 
+    free(cv_chol);
+    free(cv_log_det);
+
+    // Fill in the upper triangles of the symmetric statistics
+    _symmetrize_lower(n_states, n_features, obs_obs_T);
+    _symmetrize_lower(n_states, n_features, obs_obs_T_but_first);
+    _symmetrize_lower(n_states, n_features, obs_obs_T_but_last);
+    return 0;
 }
 
 
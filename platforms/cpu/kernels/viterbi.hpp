@@ -0,0 +1,71 @@
+/*****************************************************************/
+/*    Copyright (c) 2013, Stanford University and the Authors    */
+/*    Author: Robert McGibbon <rmcgibbo@gmail.com>               */
+/*    Contributors:                                              */
+/*                                                               */
+/*****************************************************************/
+#ifndef MIXTAPE_CPU_VITERBI_H
+#define MIXTAPE_CPU_VITERBI_H
+#include "math.h"
+namespace Mixtape {
+
+/**
+ * Most likely hidden state sequence of a single sequence, given the
+ * emission log likelihoods. lattice is a scratch buffer of size
+ * sequence_length*n_states, and backpointers one of the same size.
+ *
+ * Returns the log probability of the most likely path.
+ */
+template <typename REAL>
+REAL viterbi(const float* __restrict__ log_transmat,
+             const float* __restrict__ log_startprob,
+             const float* __restrict__ frame_logprob,
+             const int sequence_length,
+             const int n_states,
+             REAL* __restrict__ lattice,
+             int* __restrict__ backpointers,
+             int* __restrict__ state_sequence)
+{
+    int t, i, j, argmax;
+    REAL val, max;
+
+    for (j = 0; j < n_states; j++)
+        lattice[0*n_states + j] = log_startprob[j] + frame_logprob[0*n_states + j];
+
+    for (t = 1; t < sequence_length; t++) {
+        for (j = 0; j < n_states; j++) {
+            lattice[t*n_states + j] = -INFINITY;
+            backpointers[t*n_states + j] = 0;
+        }
+        // loop over the rows of the transition matrix in the outer loop, so
+        // that the inner loop is contiguous
+        for (i = 0; i < n_states; i++) {
+            for (j = 0; j < n_states; j++) {
+                val = lattice[(t-1)*n_states + i] + log_transmat[i*n_states + j];
+                if (val > lattice[t*n_states + j]) {
+                    lattice[t*n_states + j] = val;
+                    backpointers[t*n_states + j] = i;
+                }
+            }
+        }
+        for (j = 0; j < n_states; j++)
+            lattice[t*n_states + j] += frame_logprob[t*n_states + j];
+    }
+
+    max = -INFINITY;
+    argmax = 0;
+    for (j = 0; j < n_states; j++) {
+        if (lattice[(sequence_length-1)*n_states + j] > max) {
+            max = lattice[(sequence_length-1)*n_states + j];
+            argmax = j;
+        }
+    }
+
+    state_sequence[sequence_length-1] = argmax;
+    for (t = sequence_length-1; t > 0; t--)
+        state_sequence[t-1] = backpointers[t*n_states + state_sequence[t]];
+    return max;
+}
+
+} // namespace
+#endif
@@ -2,11 +2,12 @@ import numpy as np
 from sklearn.hmm import GaussianHMM
 
 
+cimport cython
 cimport numpy as np
 from libc.stdlib cimport malloc, free
 
 cdef extern from "mslds_estep.hpp" namespace "Mixtape":
-    void do_estep_single "Mixtape::do_mslds_estep<float>"(
+    int do_estep_single "Mixtape::do_mslds_estep<float>"(
         const float* log_transmat, const float* log_transmat_T,
         const float* log_startprob, const float* means,
         const float* covariances, const float** sequences,
@@ -18,7 +19,7 @@ cdef extern from "mslds_estep.hpp" namespace "Mixtape":
         float* post, float* post_but_first, float* post_but_last,
         float* logprob) nogil
     
-    void do_estep_mixed "Mixtape::do_mslds_estep<double>"(
+    int do_estep_mixed "Mixtape::do_mslds_estep<double>"(
         const float* log_transmat, const float* log_transmat_T,
         const float* log_startprob, const float* means,
         const float* covariances, const float** sequences,
@@ -31,6 +32,28 @@ cdef extern from "mslds_estep.hpp" namespace "Mixtape":
         float* logprob) nogil
 
 
+cdef extern from "mslds_decode.hpp" namespace "Mixtape":
+    int do_decode_single "Mixtape::do_mslds_decode<float>"(
+        const float* log_transmat, const float* log_transmat_T,
+        const float* log_startprob, const float* means,
+        const float* covariances, const float* As, const float* bs,
+        const float* Qs, const float** sequences,
+        const int n_sequences, const int* sequence_lengths,
+        const int n_features, const int n_states,
+        int* state_sequences, float* viterbi_logprob, float* posteriors,
+        float* logprob) nogil
+
+    int do_decode_mixed "Mixtape::do_mslds_decode<double>"(
+        const float* log_transmat, const float* log_transmat_T,
+        const float* log_startprob, const float* means,
+        const float* covariances, const float* As, const float* bs,
+        const float* Qs, const float** sequences,
+        const int n_sequences, const int* sequence_lengths,
+        const int n_features, const int n_states,
+        int* state_sequences, float* viterbi_logprob, float* posteriors,
+        float* logprob) nogil
+
+
 cdef class SwitchingVAR1CPUImpl:
     cdef list sequences
     cdef int n_sequences
@@ -160,6 +183,7 @@ cdef class SwitchingVAR1CPUImpl:
         cdef np.ndarray[ndim=1, mode='c', dtype=np.float32_t] post_but_first = np.zeros(self.n_states, dtype=np.float32)
         cdef np.ndarray[ndim=1, mode='c', dtype=np.float32_t] post_but_last = np.zeros(self.n_states, dtype=np.float32)
         cdef float logprob
+        cdef int info
 
         seq_pointers = <float**>malloc(self.n_sequences * sizeof(float*))
         cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] sequence
@@ -168,7 +192,7 @@ cdef class SwitchingVAR1CPUImpl:
             seq_pointers[i] = &sequence[0,0]
 
         if self.precision == 'single':
-            do_estep_single(
+            info = do_estep_single(
                 <float*> &log_transmat[0,0], 
                 <float*> &log_transmat_T[0,0], <float*> &log_startprob[0],
                 <float*> &means[0,0], <float*> &covars[0,0,0], 
@@ -183,7 +207,7 @@ cdef class SwitchingVAR1CPUImpl:
                 <float*> &post_but_first[0], <float*> &post_but_last[0],
                 &logprob)
         elif self.precision == 'mixed':
-            do_estep_mixed(
+            info = do_estep_mixed(
                 <float*> &log_transmat[0,0], 
                 <float*> &log_transmat_T[0,0], <float*> &log_startprob[0],
                 <float*> &means[0,0], <float*> &covars[0,0,0], 
@@ -198,9 +222,14 @@ cdef class SwitchingVAR1CPUImpl:
                 <float*> &post_but_first[0], <float*> &post_but_last[0],
                 &logprob)
         else:
+            free(seq_pointers)
             raise RuntimeError('Invalid precision')
 
         free(seq_pointers)
+        if info != 0:
+            raise np.linalg.LinAlgError(
+                'The covariance matrix of state %d is not positive definite'
+                % (info - 1))
         result = {
             'trans': transcounts,
             'obs': obs,
@@ -216,18 +245,216 @@ cdef class SwitchingVAR1CPUImpl:
         }
         return logprob, result
 
+    def do_viterbi(self):
+        """Most likely hidden state sequences, under the switching VAR(1)
+        emission model.
+
+        Returns
+        -------
+        viterbi_logprob : float
+            Log probability of the most likely paths, summed over the
+            sequences.
+        state_sequences : list of np.ndarray, dtype=int32
+            The most likely hidden state sequence of each sequence.
+        """
+        viterbi_logprob, _, state_sequences, _ = self._decode(True, False)
+        return viterbi_logprob, state_sequences
+
+    def do_posteriors(self):
+        """Posterior probabilities of the hidden states, under the switching
+        VAR(1) emission model.
+
+        Returns
+        -------
+        logprob : float
+            Log likelihood of the sequences.
+        posteriors : list of np.ndarray, shape=(n_samples_i, n_states)
+            The posterior probability of each state, for each frame.
+        """
+        _, logprob, _, posteriors = self._decode(False, True)
+        return logprob, posteriors
+
+    def do_score(self):
+        """Log likelihood of the sequences under the switching VAR(1)
+        emission model."""
+        _, logprob, _, _ = self._decode(False, False)
+        return logprob
+
+    def _decode(self, compute_viterbi, compute_posteriors):
+        if self.As is None or self.bs is None or self.Qs is None:
+            raise ValueError('As_, bs_ and Qs_ must be set before decoding')
+
+        cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] log_transmat = self.log_transmat
+        cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] log_transmat_T = self.log_transmat_T
+        cdef np.ndarray[ndim=1, mode='c', dtype=np.float32_t] log_startprob = self.log_startprob
+        cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] means = self.means
+        cdef np.ndarray[ndim=3, mode='c', dtype=np.float32_t] covars = self.covars
+        cdef np.ndarray[ndim=3, mode='c', dtype=np.float32_t] As = self.As
+        cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] bs = self.bs
+        cdef np.ndarray[ndim=3, mode='c', dtype=np.float32_t] Qs = self.Qs
+        cdef np.ndarray[ndim=1, mode='c', dtype=int] seq_lengths = self.seq_lengths
+        cdef int n_samples = seq_lengths.sum()
+
+        # the outputs are concatenated over the sequences
+        cdef np.ndarray[ndim=1, mode='c', dtype=np.int32_t] state_sequences = np.zeros(max(n_samples, 1), dtype=np.int32)
+        cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] posteriors = np.zeros((max(n_samples, 1), self.n_states), dtype=np.float32)
+        cdef int* state_sequences_ptr = NULL
+        cdef float* posteriors_ptr = NULL
+        cdef float viterbi_logprob = 0
+        cdef float logprob = 0
+        cdef int info
+        if compute_viterbi:
+            state_sequences_ptr = <int*> &state_sequences[0]
+        if compute_posteriors:
+            posteriors_ptr = <float*> &posteriors[0,0]
+
+        seq_pointers = <float**>malloc(self.n_sequences * sizeof(float*))
+        cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] sequence
+        for i in range(self.n_sequences):
+            sequence = self.sequences[i]
+            seq_pointers[i] = &sequence[0,0]
+
+        if self.precision == 'single':
+            info = do_decode_single(
+                <float*> &log_transmat[0,0], <float*> &log_transmat_T[0,0],
+                <float*> &log_startprob[0], <float*> &means[0,0],
+                <float*> &covars[0,0,0], <float*> &As[0,0,0],
+                <float*> &bs[0,0], <float*> &Qs[0,0,0],
+                <const float**> seq_pointers, self.n_sequences,
+                <int*> &seq_lengths[0], self.n_features, self.n_states,
+                state_sequences_ptr, &viterbi_logprob, posteriors_ptr,
+                &logprob)
+        elif self.precision == 'mixed':
+            info = do_decode_mixed(
+                <float*> &log_transmat[0,0], <float*> &log_transmat_T[0,0],
+                <float*> &log_startprob[0], <float*> &means[0,0],
+                <float*> &covars[0,0,0], <float*> &As[0,0,0],
+                <float*> &bs[0,0], <float*> &Qs[0,0,0],
+                <const float**> seq_pointers, self.n_sequences,
+                <int*> &seq_lengths[0], self.n_features, self.n_states,
+                state_sequences_ptr, &viterbi_logprob, posteriors_ptr,
+                &logprob)
+        else:
+            free(seq_pointers)
+            raise RuntimeError('Invalid precision')
+
+        free(seq_pointers)
+        if info > 0:
+            raise np.linalg.LinAlgError(
+                'The covariance matrix of state %d is not positive definite'
+                % (info - 1))
+        elif info < 0:
+            raise np.linalg.LinAlgError(
+                'The Q matrix of state %d is not positive definite'
+                % (-info - 1))
+
+        offsets = np.concatenate(([0], np.cumsum(seq_lengths)))
+        state_sequence_list = [state_sequences[offsets[i]:offsets[i+1]]
+                               for i in range(self.n_sequences)]
+        posteriors_list = [posteriors[offsets[i]:offsets[i+1]]
+                           for i in range(self.n_sequences)]
+        return viterbi_logprob, logprob, state_sequence_list, posteriors_list
+
+###############################################################################
+# Sampling. The hidden state chain doesn't depend on the observations, so
+# it's sampled first. Given the states, the noise terms can be drawn in bulk,
+# leaving only the linear recursion, which is done here.
+###############################################################################
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+def _sample_hidden_states(
+        np.ndarray[ndim=2, mode='c', dtype=np.float64_t] cum_transmat not None,
+        np.ndarray[ndim=2, mode='c', dtype=np.float64_t] uniforms not None,
+        np.ndarray[ndim=2, mode='c', dtype=np.intp_t] states not None):
+    """Sample Markov chains of hidden states, in place.
+
+    Parameters
+    ----------
+    cum_transmat : np.ndarray, shape=(n_states, n_states)
+        The cumulative sums of the rows of the transition matrix.
+    uniforms : np.ndarray, shape=(n_chains, n_samples-1)
+        Uniform random numbers on [0, 1), one per transition.
+    states : np.ndarray, shape=(n_chains, n_samples)
+        The first column holds the initial states, and the rest is
+        overwritten with the sampled chains.
+    """
+    cdef Py_ssize_t c, t, k
+    cdef Py_ssize_t n_chains = states.shape[0]
+    cdef Py_ssize_t n_samples = states.shape[1]
+    cdef Py_ssize_t n_states = cum_transmat.shape[0]
+    cdef np.intp_t s
+    assert uniforms.shape[0] == n_chains and uniforms.shape[1] >= n_samples - 1
+
+    with nogil:
+        for c in range(n_chains):
+            for t in range(n_samples - 1):
+                s = states[c, t]
+                # same as utils.categorical: the number of entries of the
+                # cumulative distribution below the uniform draw
+                k = 0
+                while k < n_states - 1 and cum_transmat[s, k] < uniforms[c, t]:
+                    k += 1
+                states[c, t+1] = k
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+def _propagate_var1(
+        np.ndarray[ndim=3, mode='c', dtype=np.float64_t] As not None,
+        np.ndarray[ndim=2, mode='c', dtype=np.intp_t] states not None,
+        np.ndarray[ndim=3, mode='c', dtype=np.float64_t] obs not None):
+    """Run the switching VAR(1) recursion obs[t+1] = A_{s_t} obs[t] + e_t,
+    in place.
+
+    Parameters
+    ----------
+    As : np.ndarray, shape=(n_states, n_features, n_features)
+    states : np.ndarray, shape=(n_chains, n_samples)
+        The hidden state chains.
+    obs : np.ndarray, shape=(n_chains, n_samples, n_features)
+        On entry, obs[:, 0] holds the initial observations and obs[:, t+1]
+        the noise e_t (including b_{s_t}). On exit, the trajectories.
+    """
+    cdef Py_ssize_t c, t, i, j
+    cdef Py_ssize_t n_chains = obs.shape[0]
+    cdef Py_ssize_t n_samples = obs.shape[1]
+    cdef Py_ssize_t n_features = obs.shape[2]
+    cdef np.intp_t s
+    cdef double acc
+    assert states.shape[0] == n_chains and states.shape[1] == n_samples
+    assert As.shape[1] == n_features and As.shape[2] == n_features
+
+    with nogil:
+        for c in range(n_chains):
+            for t in range(n_samples - 1):
+                s = states[c, t]
+                for i in range(n_features):
+                    acc = 0
+                    for j in range(n_features):
+                        acc = acc + As[s, i, j] * obs[c, t, j]
+                    obs[c, t+1, i] += acc
+
+
 ###############################################################################
 # Tests. These are exposed to nose by being called from one of the python
 # test files
 ###############################################################################
 
 cdef extern from "gaussian_likelihood.h":
+    int gaussian_loglikelihood_full_factorize(const float* covariances,
+                                              const int n_states,
+                                              const int n_features,
+                                              float* cv_chol,
+                                              float* cv_log_det)
     void gaussian_loglikelihood_full(const float* sequence,
                                      const float* means,
-                                     const float* covariances,
+                                     const float* cv_chol,
+                                     const float* cv_log_det,
                                      const int n_observations,
                                      const int n_states,
                                      const int n_features,
+                                     float* work,
                                      float* loglikelihoods)
 
 def test_gaussian_loglikelihood_full():
@@ -245,9 +472,81 @@ def test_gaussian_loglikelihood_full():
     for i in range(n_states):
         covariances[i] += covariances[i].T + 10*np.eye(n_features, n_features)
     cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] loglikelihoods = np.zeros((length, n_states), dtype=np.float32)
+    cdef np.ndarray[ndim=3, mode='c', dtype=np.float32_t] cv_chol = np.zeros((n_states, n_features, n_features), dtype=np.float32)
+    cdef np.ndarray[ndim=1, mode='c', dtype=np.float32_t] cv_log_det = np.zeros(n_states, dtype=np.float32)
+    cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] work = np.zeros((length, n_features), dtype=np.float32)
     
     val = _log_multivariate_normal_density_full(sequence, means, covariances)
-    gaussian_loglikelihood_full(&sequence[0, 0], &means[0, 0], &covariances[0, 0,0],
-       length, n_states, n_features, &loglikelihoods[0, 0]);
+    info = gaussian_loglikelihood_full_factorize(&covariances[0, 0, 0], n_states, n_features,
+       &cv_chol[0, 0, 0], &cv_log_det[0])
+    assert info == 0
+    gaussian_loglikelihood_full(&sequence[0, 0], &means[0, 0], &cv_chol[0, 0, 0], &cv_log_det[0],
+       length, n_states, n_features, &work[0, 0], &loglikelihoods[0, 0]);
 
     np.testing.assert_array_almost_equal(val, loglikelihoods)
+
+    # a covariance matrix which isn't positive definite is reported, rather
+    # than killing the process
+    covariances[1] = -np.eye(n_features, n_features)
+    info = gaussian_loglikelihood_full_factorize(&covariances[0, 0, 0], n_states, n_features,
+       &cv_chol[0, 0, 0], &cv_log_det[0])
+    assert info == 2
+
+cdef extern from "gaussian_likelihood.h":
+    void switching_var1_loglikelihood(const float* sequence,
+                                      const float* means,
+                                      const float* cv_chol,
+                                      const float* cv_log_det,
+                                      const float* As,
+                                      const float* bs,
+                                      const float* q_chol,
+                                      const float* q_log_det,
+                                      const int n_observations,
+                                      const int n_states,
+                                      const int n_features,
+                                      float* work,
+                                      float* loglikelihoods)
+
+def test_switching_var1_loglikelihood():
+    # check switching_var1_loglikelihood vs. a reference python implementation
+
+    from sklearn.mixture.gmm import _log_multivariate_normal_density_full
+
+    cdef int length = 5
+    cdef int n_states = 2
+    cdef int n_features = 3
+
+    cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] sequence = np.random.randn(length, n_features).astype(np.float32)
+    cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] means = np.random.randn(n_states, n_features).astype(np.float32)
+    cdef np.ndarray[ndim=3, mode='c', dtype=np.float32_t] covariances = np.random.rand(n_states, n_features, n_features).astype(np.float32)
+    cdef np.ndarray[ndim=3, mode='c', dtype=np.float32_t] As = np.random.randn(n_states, n_features, n_features).astype(np.float32)
+    cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] bs = np.random.randn(n_states, n_features).astype(np.float32)
+    cdef np.ndarray[ndim=3, mode='c', dtype=np.float32_t] Qs = np.random.rand(n_states, n_features, n_features).astype(np.float32)
+    for i in range(n_states):
+        covariances[i] += covariances[i].T + 10*np.eye(n_features, n_features)
+        Qs[i] += Qs[i].T + 5*np.eye(n_features, n_features)
+    cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] loglikelihoods = np.zeros((length, n_states), dtype=np.float32)
+    cdef np.ndarray[ndim=3, mode='c', dtype=np.float32_t] cv_chol = np.zeros((n_states, n_features, n_features), dtype=np.float32)
+    cdef np.ndarray[ndim=1, mode='c', dtype=np.float32_t] cv_log_det = np.zeros(n_states, dtype=np.float32)
+    cdef np.ndarray[ndim=3, mode='c', dtype=np.float32_t] q_chol = np.zeros((n_states, n_features, n_features), dtype=np.float32)
+    cdef np.ndarray[ndim=1, mode='c', dtype=np.float32_t] q_log_det = np.zeros(n_states, dtype=np.float32)
+    cdef np.ndarray[ndim=2, mode='c', dtype=np.float32_t] work = np.zeros((length, n_features), dtype=np.float32)
+
+    # the first frame is drawn from the state's stationary distribution, and
+    # the rest conditionally on the frame before
+    val = np.zeros((length, n_states))
+    val[0] = _log_multivariate_normal_density_full(sequence[:1], means, covariances)[0]
+    for i in range(n_states):
+        predicted = np.dot(sequence[:-1], As[i].T) + bs[i]
+        val[1:, i] = _log_multivariate_normal_density_full(
+            sequence[1:] - predicted, np.zeros((1, n_features)), Qs[i:i+1])[:, 0]
+
+    assert gaussian_loglikelihood_full_factorize(&covariances[0, 0, 0], n_states, n_features,
+       &cv_chol[0, 0, 0], &cv_log_det[0]) == 0
+    assert gaussian_loglikelihood_full_factorize(&Qs[0, 0, 0], n_states, n_features,
+       &q_chol[0, 0, 0], &q_log_det[0]) == 0
+    switching_var1_loglikelihood(&sequence[0, 0], &means[0, 0], &cv_chol[0, 0, 0], &cv_log_det[0],
+       &As[0, 0, 0], &bs[0, 0], &q_chol[0, 0, 0], &q_log_det[0], length, n_states, n_features,
+       &work[0, 0], &loglikelihoods[0, 0])
+
+    np.testing.assert_array_almost_equal(val, loglikelihoods, decimal=4)
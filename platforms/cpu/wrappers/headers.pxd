@@ -28,10 +28,18 @@ cdef extern from "gaussian_likelihood.h":
                                  const int n_states, const int n_features,
                                  float* loglikelihoods)
 
+     int gaussian_loglikelihood_full_factorize(const float* covariances,
+                                 const int n_states,
+                                 const int n_features,
+                                 float* cv_chol,
+                                 float* cv_log_det)
+
      void gaussian_loglikelihood_full(const float*  sequence,
                                  const float*  means,
-                                 const float*  covariances,
+                                 const float*  cv_chol,
+                                 const float*  cv_log_det,
                                  const int n_observations,
                                  const int n_states,
                                  const int n_features,
+                                 float* work,
                                  float*  loglikelihoods)
@@ -303,11 +303,13 @@ extensions.append(
 
 extensions.append(
     Extension('mixtape._vmhmm',
-              sources=['src/vonmises/vmhmm.c', 'src/vonmises/vmhmmwrap.pyx',
+              sources=['src/vonmises/vmhmm.c', 'src/vonmises/decode.c',
+                       'src/vonmises/vmhmmwrap.pyx',
                        'src/vonmises/spleval.c',
                        'src/cephes/i0.c', 'src/cephes/chbevl.c'],
-              libraries=['m'],
-              include_dirs=[np.get_include(), 'src/cephes']))
+              libraries=libraries + ['m'],
+              extra_compile_args=extra_compile_args,
+              include_dirs=[np.get_include(), 'src/cephes', 'src/vonmises']))
 
 try:
     if '--disable-cuda' in sys.argv:
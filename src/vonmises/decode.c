@@ -0,0 +1,186 @@
+/*****************************************************************/
+/*    Copyright (c) 2013, Stanford University and the Authors    */
+/*    Author: Robert McGibbon <rmcgibbo@gmail.com>               */
+/*    Contributors:                                              */
+/*                                                               */
+/*****************************************************************/
+
+/* Viterbi and posterior decoding for the von Mises HMM.
+ *
+ * The observations are given as a ragged buffer: the (precomputed) cosine
+ * and sine of all of the sequences, stacked, together with an array of
+ * offsets, such that the i-th sequence occupies the rows
+ * [offsets[i], offsets[i+1]). The sequences are independent, so they're
+ * split between the OpenMP threads, and each thread computes the emission
+ * log likelihoods of its sequence into a private workspace, so the full
+ * [n_samples, n_components] matrix is never materialized.
+ */
+
+#include <stdlib.h>
+#include <stdio.h>
+#include <math.h>
+#include <float.h>
+#include "decode.h"
+
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+/* defined in vmhmm.c */
+int compute_log_likelihood(const double* cos_obs, const double* sin_obs,
+                           const double* means, const double* kappas,
+                           const double* log_normalizer,
+                           long n_samples, long n_components, long n_features,
+                           double* out);
+int compute_log_likelihood_mixed(const float* cos_obs, const float* sin_obs,
+                                 const double* means, const double* kappas,
+                                 const double* log_normalizer,
+                                 long n_samples, long n_components,
+                                 long n_features, double* out);
+
+
+static double logsumexp(const double* buf, long n) {
+  long i;
+  double sum = 0;
+  double max = -INFINITY;
+
+  for (i = 0; i < n; i++)
+    if (buf[i] > max)
+      max = buf[i];
+  if (isinf(max))
+    return max;
+  for (i = 0; i < n; i++)
+    sum += exp(buf[i] - max);
+  return log(sum) + max;
+}
+
+
+static void* checked_malloc(size_t size) {
+  void* p = malloc(size);
+  if (NULL == p) {
+    fprintf(stderr, "decode: Memory allocation failure");
+    exit(EXIT_FAILURE);
+  }
+  return p;
+}
+
+
+static void viterbi_sequence(const double* framelogprob,
+                             const double* log_startprob,
+                             const double* log_transmat,
+                             long length, long n_components,
+                             double* lattice, int* backpointers,
+                             int* labels, double* logprob) {
+  long t, i, j;
+  double val, max;
+  int argmax;
+
+  for (j = 0; j < n_components; j++)
+    lattice[j] = log_startprob[j] + framelogprob[j];
+
+  for (t = 1; t < length; t++) {
+    double* prev = &lattice[(t-1)*n_components];
+    double* curr = &lattice[t*n_components];
+    int* bp = &backpointers[t*n_components];
+
+    for (j = 0; j < n_components; j++) {
+      curr[j] = -INFINITY;
+      bp[j] = 0;
+    }
+    // loop over the rows of the transition matrix in the outer loop, so
+    // that the inner loop is contiguous.
+    for (i = 0; i < n_components; i++) {
+      for (j = 0; j < n_components; j++) {
+        val = prev[i] + log_transmat[i*n_components + j];
+        if (val > curr[j]) {
+          curr[j] = val;
+          bp[j] = i;
+        }
+      }
+    }
+    for (j = 0; j < n_components; j++)
+      curr[j] += framelogprob[t*n_components + j];
+  }
+
+  max = -INFINITY;
+  argmax = 0;
+  for (j = 0; j < n_components; j++) {
+    if (lattice[(length-1)*n_components + j] > max) {
+      max = lattice[(length-1)*n_components + j];
+      argmax = j;
+    }
+  }
+  *logprob = max;
+
+  labels[length-1] = argmax;
+  for (t = length-1; t > 0; t--)
+    labels[t-1] = backpointers[t*n_components + labels[t]];
+}
+
+
+static void posteriors_sequence(const double* framelogprob,
+                                const double* log_startprob,
+                                const double* log_transmat,
+                                const double* log_transmat_T,
+                                long length, long n_components,
+                                double* fwdlattice, double* bwdlattice,
+                                double* work, float* posteriors,
+                                double* logprob) {
+  long t, i, j;
+  double lpr;
+
+  // forward pass
+  for (j = 0; j < n_components; j++)
+    fwdlattice[j] = log_startprob[j] + framelogprob[j];
+  for (t = 1; t < length; t++) {
+    for (j = 0; j < n_components; j++) {
+      for (i = 0; i < n_components; i++)
+        work[i] = fwdlattice[(t-1)*n_components + i] + log_transmat_T[j*n_components + i];
+      fwdlattice[t*n_components + j] = logsumexp(work, n_components) + framelogprob[t*n_components + j];
+    }
+  }
+
+  // backward pass
+  for (j = 0; j < n_components; j++)
+    bwdlattice[(length-1)*n_components + j] = 0;
+  for (t = length-2; t >= 0; t--) {
+    for (i = 0; i < n_components; i++) {
+      for (j = 0; j < n_components; j++)
+        work[j] = log_transmat[i*n_components + j] + framelogprob[(t+1)*n_components + j]
+                  + bwdlattice[(t+1)*n_components + j];
+      bwdlattice[t*n_components + i] = logsumexp(work, n_components);
+    }
+  }
+
+  lpr = logsumexp(&fwdlattice[(length-1)*n_components], n_components);
+  *logprob = lpr;
+
+  for (t = 0; t < length; t++)
+    for (j = 0; j < n_components; j++)
+      posteriors[t*n_components + j] = (float) exp(fwdlattice[t*n_components + j] +
+                                                   bwdlattice[t*n_components + j] - lpr);
+}
+
+
+static long max_length(const long* offsets, long n_sequences) {
+  long s, max = 0;
+  for (s = 0; s < n_sequences; s++)
+    if (offsets[s+1] - offsets[s] > max)
+      max = offsets[s+1] - offsets[s];
+  return max;
+}
+
+
+// Instantiate the decoders for float64 and float32 observations. In both
+// cases the emission log likelihoods and the lattices are in float64.
+#define DATA_T double
+#define VITERBI viterbi
+#define POSTERIORS posteriors
+#define COMPUTE_LOG_LIKELIHOOD compute_log_likelihood
+#include "decode_kernels.h"
+
+#define DATA_T float
+#define VITERBI viterbi_float
+#define POSTERIORS posteriors_float
+#define COMPUTE_LOG_LIKELIHOOD compute_log_likelihood_mixed
+#include "decode_kernels.h"
@@ -0,0 +1,32 @@
+#ifndef _DECODE_H_
+#define _DECODE_H_
+
+int viterbi(const double* cos_obs, const double* sin_obs,
+            const long* offsets, long n_sequences,
+            const double* means, const double* kappas,
+            const double* log_normalizer, const double* log_startprob,
+            const double* log_transmat, long n_components, long n_features,
+            int* labels, double* logprob);
+
+int posteriors(const double* cos_obs, const double* sin_obs,
+               const long* offsets, long n_sequences,
+               const double* means, const double* kappas,
+               const double* log_normalizer, const double* log_startprob,
+               const double* log_transmat, long n_components, long n_features,
+               float* out, double* logprob);
+
+int viterbi_float(const float* cos_obs, const float* sin_obs,
+                  const long* offsets, long n_sequences,
+                  const double* means, const double* kappas,
+                  const double* log_normalizer, const double* log_startprob,
+                  const double* log_transmat, long n_components, long n_features,
+                  int* labels, double* logprob);
+
+int posteriors_float(const float* cos_obs, const float* sin_obs,
+                     const long* offsets, long n_sequences,
+                     const double* means, const double* kappas,
+                     const double* log_normalizer, const double* log_startprob,
+                     const double* log_transmat, long n_components, long n_features,
+                     float* out, double* logprob);
+
+#endif
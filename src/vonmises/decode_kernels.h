@@ -0,0 +1,152 @@
+/*****************************************************************/
+/*    Copyright (c) 2013, Stanford University and the Authors    */
+/*    Author: Robert McGibbon <rmcgibbo@gmail.com>               */
+/*    Contributors:                                              */
+/*                                                               */
+/*****************************************************************/
+
+/* Decoders, written once for each storage precision of the observations.
+ * This file is included several times by decode.c, and each time the
+ * following macros must be defined:
+ *
+ *   DATA_T                    type of the cosine and sine of the observations
+ *   VITERBI                   name of the Viterbi decoder
+ *   POSTERIORS                name of the posterior decoder
+ *   COMPUTE_LOG_LIKELIHOOD    log likelihood kernel for DATA_T, which returns
+ *                             double
+ *
+ * They are undefined at the end of the file.
+ */
+
+int VITERBI(const DATA_T* cos_obs, const DATA_T* sin_obs,
+            const long* offsets, long n_sequences,
+            const double* means, const double* kappas,
+            const double* log_normalizer, const double* log_startprob,
+            const double* log_transmat, long n_components, long n_features,
+            int* labels, double* logprob) {
+  /* Most likely hidden state sequence of each sequence (Viterbi)
+
+     Parameters
+     ----------
+     cos_obs, sin_obs : array, shape=[n_samples, n_features]
+     offsets : array, shape=[n_sequences+1]
+     means, kappas : array, shape=[n_components, n_features]
+     log_normalizer : array, shape=[n_components]
+     log_startprob : array, shape=[n_components]
+     log_transmat : array, shape=[n_components, n_components]
+
+     Output
+     ------
+     labels : array, shape=[n_samples]
+     logprob : array, shape=[n_sequences]
+         Log probability of the Viterbi path through each sequence
+  */
+  long s;
+  long T_max = max_length(offsets, n_sequences);
+
+  #ifdef _OPENMP
+  #pragma omp parallel default(none) private(s)                            \
+      shared(T_max, cos_obs, sin_obs, offsets, n_sequences, means, kappas, \
+             log_normalizer, log_startprob, log_transmat, n_components,    \
+             n_features, labels, logprob)
+  #endif
+  {
+  double* framelogprob = checked_malloc(T_max * n_components * sizeof(double));
+  double* lattice = checked_malloc(T_max * n_components * sizeof(double));
+  int* backpointers = checked_malloc(T_max * n_components * sizeof(int));
+
+  #ifdef _OPENMP
+  #pragma omp for schedule(dynamic)
+  #endif
+  for (s = 0; s < n_sequences; s++) {
+    const long start = offsets[s];
+    const long length = offsets[s+1] - offsets[s];
+    if (length == 0) {
+      logprob[s] = 0;
+      continue;
+    }
+    COMPUTE_LOG_LIKELIHOOD(&cos_obs[start*n_features], &sin_obs[start*n_features],
+                           means, kappas, log_normalizer, length, n_components,
+                           n_features, framelogprob);
+    viterbi_sequence(framelogprob, log_startprob, log_transmat, length,
+                     n_components, lattice, backpointers, &labels[start],
+                     &logprob[s]);
+  }
+
+  free(framelogprob);
+  free(lattice);
+  free(backpointers);
+  }
+
+  return 1;
+}
+
+
+int POSTERIORS(const DATA_T* cos_obs, const DATA_T* sin_obs,
+               const long* offsets, long n_sequences,
+               const double* means, const double* kappas,
+               const double* log_normalizer, const double* log_startprob,
+               const double* log_transmat, long n_components, long n_features,
+               float* out, double* logprob) {
+  /* Posterior state probabilities of each observation (forward-backward)
+
+     Parameters are the same as for VITERBI().
+
+     Output
+     ------
+     out : array, shape=[n_samples, n_components]
+     logprob : array, shape=[n_sequences]
+         Log likelihood of each sequence
+  */
+  long s, i, j;
+  long T_max = max_length(offsets, n_sequences);
+  double* log_transmat_T = checked_malloc(n_components * n_components * sizeof(double));
+
+  for (i = 0; i < n_components; i++)
+    for (j = 0; j < n_components; j++)
+      log_transmat_T[j*n_components + i] = log_transmat[i*n_components + j];
+
+  #ifdef _OPENMP
+  #pragma omp parallel default(none) private(s)                            \
+      shared(T_max, cos_obs, sin_obs, offsets, n_sequences, means, kappas, \
+             log_normalizer, log_startprob, log_transmat, log_transmat_T,  \
+             n_components, n_features, out, logprob)
+  #endif
+  {
+  double* framelogprob = checked_malloc(T_max * n_components * sizeof(double));
+  double* fwdlattice = checked_malloc(T_max * n_components * sizeof(double));
+  double* bwdlattice = checked_malloc(T_max * n_components * sizeof(double));
+  double* work = checked_malloc(n_components * sizeof(double));
+
+  #ifdef _OPENMP
+  #pragma omp for schedule(dynamic)
+  #endif
+  for (s = 0; s < n_sequences; s++) {
+    const long start = offsets[s];
+    const long length = offsets[s+1] - offsets[s];
+    if (length == 0) {
+      logprob[s] = 0;
+      continue;
+    }
+    COMPUTE_LOG_LIKELIHOOD(&cos_obs[start*n_features], &sin_obs[start*n_features],
+                           means, kappas, log_normalizer, length, n_components,
+                           n_features, framelogprob);
+    posteriors_sequence(framelogprob, log_startprob, log_transmat,
+                        log_transmat_T, length, n_components, fwdlattice,
+                        bwdlattice, work, &out[start*n_components], &logprob[s]);
+  }
+
+  free(framelogprob);
+  free(fwdlattice);
+  free(bwdlattice);
+  free(work);
+  }
+
+  free(log_transmat_T);
+  return 1;
+}
+
+#undef DATA_T
+#undef VITERBI
+#undef POSTERIORS
+#undef COMPUTE_LOG_LIKELIHOOD
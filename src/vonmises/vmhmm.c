@@ -6,139 +6,80 @@
 #include "cephes.h"
 #include "spleval.h"
 
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
 //#define DEBUG
 #ifdef DEBUG
 #define ASSERT_CLOSE(x, y)    if (abs((x)-(y)) > 1e-6) { printf("Assert Failed\nx: %f\ny %f\n", x, y); exit(1); }
 #endif
 
+// Ask the compiler to vectorize the following loop, when it understands
+// OpenMP 4.0. Otherwise we rely on the auto-vectorizer.
+#if defined(_OPENMP) && _OPENMP >= 201307
+#define PRAGMA_OMP_SIMD _Pragma("omp simd")
+#else
+#define PRAGMA_OMP_SIMD
+#endif
 
-int fitinvkappa(long n_samples, long n_features, long n_components,
-                const double* posteriors, const double* obs, const double* means,
-                double* out) {
-  /*  Implements the following python code in C. There are a few loop
-   *  reorderings to try to speed up the cache locality.
-   *
-   *  for i in range(self.n_features):
-   *    for j in range(self.n_components):
-   *      numerator = np.sum(posteriors[:, j] * np.cos(obs[:, i] - means_[j, i]))
-   *      denominator = np.sum(posteriors[:, j])
-   *      inv_kappas[j, i] = numerator / denominator
-   *
-   */
-  int err;
-  long i, j, k;
-  double meanshifted, posterior_kj;
-  double *num, *denom;
-
-  err = posix_memalign((void**) &num, 16, n_components * n_features * sizeof(double));
-  err = posix_memalign((void**) &denom, 16, n_components * n_features * sizeof(double));
-  if (NULL == num || NULL == denom) {
-    fprintf(stderr, "fitinvkappa: Memory allocation failure");
-    exit(EXIT_FAILURE);
-
-  }
-  memset(num, 0, n_components*n_features*sizeof(double));
-  memset(denom, 0, n_components*n_features*sizeof(double));
-
-  for (k = 0; k < n_samples; k++) {
-    for (j = 0; j < n_components; j++) {
-      posterior_kj = posteriors[k*n_components + j];
-      for (i = 0; i < n_features; i++) {
-        meanshifted = obs[k*n_features + i] - means[j*n_features + i];
-        num[j*n_features + i] += posterior_kj * cos(meanshifted);
-        denom[j*n_features + i] += posterior_kj;
-      }
-    }
-  }
-
-  // do the division at the end
-  for (i = 0; i < n_features*n_components; i++)
-    out[i] = num[i] / denom[i];
 
-  free(num);
-  free(denom);
-  return 1;
-}
+void compute_log_normalizer(const double* kappas, long n_components,
+                            long n_features, double* out) {
+  /* Log of the normalization constant of each state's emission distribution,
+     which is a product of univariate von Mises distributions.
 
-int compute_log_likelihood(const double* obs, const double* means,
-                           const double* kappas, long n_samples,
-                           long n_components, long n_features,
-                           double* out) {
-  /* Log likelihood of each observation in each state (von Mises distribution)
+     This only depends on the parameters, so it should be computed once per
+     parameter update, not every time the likelihood is evaluated.
 
      Parameters
      ----------
-     obs : array, shape=[n_samples, n_components]
-     means : array, shape=[n_components, n_features]
      kappas : array, shape=[n_components, n_features]
 
      Output
      ------
-     out : array, shape=[n_samples, n_components]
+     out : array, shape=[n_components]
 
      Equivalent Python Code
      ----------------------
-     >>> from scipy.stats.distributions import vonmises
-     >>> n_components = kappas.shape[0]
-     >>> value = np.array([np.sum(vonmises.logpdf(obs, kappas[i], means[i]), axis=1) for i in range(n_components)]).T
+     >>> out = np.sum(np.log(2*np.pi) + np.log(scipy.special.i0(kappas)), axis=1)
   */
-  int err;
-  unsigned int i, j, k;
-  double *kappa_cos_means, *kappa_sin_means;
-  double val, log_numerator, cos_obs_kj, sin_obs_kj;
+  long i, j;
+  double kappa;
   const double LOG_2PI = log(2*M_PI);
 
-  // clear the output
-  memset(out, 0, n_samples*n_components*sizeof(double));
-  // allocate two workspaces
-  err = posix_memalign((void**) &kappa_cos_means, 16, n_components * n_features * sizeof(double));
-  err = posix_memalign((void**) &kappa_sin_means, 16, n_components * n_features * sizeof(double));
-  if (NULL == kappa_cos_means || NULL == kappa_sin_means) {
-    fprintf(stderr, "compute_log_likelihood: Memory allocation failure");
-    exit(EXIT_FAILURE);
-  }
-
-  // this sets the likelihood's denominator
   for (i = 0; i < n_components; i++) {
+    out[i] = 0;
     for (j = 0; j < n_features; j++) {
-      val = LOG_2PI + log(i0(kappas[i*n_features + j]));
-      for (k = 0; k < n_samples; k++)
-        out[k*n_components+i] -= val;
+      // log(i0(kappa)) = log(i0e(kappa)) + |kappa|, which doesn't overflow
+      // for large kappa.
+      kappa = kappas[i*n_features + j];
+      out[i] += LOG_2PI + log(i0e(kappa)) + fabs(kappa);
     }
   }
+}
 
-  // We need to calculate cos(obs[k*n_features + j] - means[i*n_features + j])
-  // But we want to avoid having a trig function in the inner tripple loop,
-  // so we use the double angle formula to split up the computation into cos(x)cos(y) + sin(x)*sin(y)
-  // where each of the terms can be computed in a double loop.
-  for (i = 0; i < n_components; i++) {
-    for (j = 0; j < n_features; j++) {
-      kappa_cos_means[j*n_components + i] = kappas[i*n_features + j] * cos(means[i*n_features + j]);
-      kappa_sin_means[j*n_components + i] = kappas[i*n_features + j] * sin(means[i*n_features + j]);
-    }
-  }
 
-  for (k = 0; k < n_samples; k++) {
-    for (j = 0; j < n_features; j++) {
-      cos_obs_kj = cos(obs[k*n_features + j]);
-      sin_obs_kj = sin(obs[k*n_features + j]);
-      for (i = 0; i < n_components; i++) {
-        log_numerator = (cos_obs_kj*kappa_cos_means[j*n_components + i] + 
-        sin_obs_kj*kappa_sin_means[j*n_components + i]);
-        out[k*n_components + i] += log_numerator;
-
-        #ifdef DEBUG
-          double log_numerator2 = kappas[i*n_features+j]*cos(obs[k*n_features + j] - means[i*n_features + j]);
-          ASSERT_CLOSE(log_numerator, log_numerator2);
-        #endif
-      }
-    }
-  }
+// Instantiate the kernels that read the observations, for float64 storage,
+// and for float32 storage with the likelihood computed in either float64
+// ("mixed" precision) or float32 ("single" precision).
+#define DATA_T double
+#define LL_T double
+#define FITINVKAPPA fitinvkappa
+#define COMPUTE_LOG_LIKELIHOOD compute_log_likelihood
+#include "vmhmm_kernels.h"
+
+#define DATA_T float
+#define LL_T double
+#define FITINVKAPPA fitinvkappa_float
+#define COMPUTE_LOG_LIKELIHOOD compute_log_likelihood_mixed
+#include "vmhmm_kernels.h"
+
+#define DATA_T float
+#define LL_T float
+#define COMPUTE_LOG_LIKELIHOOD compute_log_likelihood_single
+#include "vmhmm_kernels.h"
 
-  free(kappa_cos_means);
-  free(kappa_sin_means);
-  return 1;
-}
 
 
 void inv_mbessel_ratio(double* x, size_t n) {
@@ -162,10 +103,17 @@ void inv_mbessel_ratio(double* x, size_t n) {
     #include "data/inv_mbessel_deriv.dat"
   };
 
-  const size_t n_splinepoints = sizeof(SPLINE_x) / sizeof(SPLINE_x[0]);
-  size_t i;
+  const long n_splinepoints = sizeof(SPLINE_x) / sizeof(SPLINE_x[0]);
+  long i;
   double t;
-  for (i = 0; i < n; i++) {
+
+  // Each point is independent. Only spin up the threads when there's enough
+  // work to amortize it -- during the M-step, n is just n_components *
+  // n_features.
+  #ifdef _OPENMP
+  #pragma omp parallel for schedule(static) private(t) if (n >= 4096)
+  #endif
+  for (i = 0; i < (long) n; i++) {
     t = x[i];
 
     if (t < SPLINE_x[0])
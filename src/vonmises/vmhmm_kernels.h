@@ -0,0 +1,217 @@
+/*****************************************************************/
+/*    Copyright (c) 2013, Stanford University and the Authors    */
+/*    Author: Robert McGibbon <rmcgibbo@gmail.com>               */
+/*    Contributors:                                              */
+/*                                                               */
+/*****************************************************************/
+
+/* Kernels which read the observations, written once for each storage
+ * precision. This file is included several times by vmhmm.c, and each time
+ * the following macros must be defined:
+ *
+ *   DATA_T                    type of the cosine and sine of the observations
+ *   LL_T                      type in which the log likelihood is accumulated
+ *                             and returned
+ *   COMPUTE_LOG_LIKELIHOOD    name of the log likelihood kernel
+ *   FITINVKAPPA               (optional) name of the kappa kernel. It always
+ *                             accumulates in double, so it doesn't depend on
+ *                             LL_T
+ *
+ * They are undefined at the end of the file.
+ */
+
+#ifdef FITINVKAPPA
+int FITINVKAPPA(long n_samples, long n_features, long n_components,
+                const double* posteriors, const DATA_T* cos_obs,
+                const DATA_T* sin_obs, const double* means, double* out) {
+  /*  Implements the following python code in C. There are a few loop
+   *  reorderings to try to speed up the cache locality.
+   *
+   *  for i in range(self.n_features):
+   *    for j in range(self.n_components):
+   *      numerator = np.sum(posteriors[:, j] * np.cos(obs[:, i] - means_[j, i]))
+   *      denominator = np.sum(posteriors[:, j])
+   *      inv_kappas[j, i] = numerator / denominator
+   *
+   *  The cosine and sine of the observations are precomputed by the caller
+   *  (they don't change during the fit), and cos(obs - mean) is expanded with
+   *  the angle difference formula, so there are no trig calls in the loop
+   *  over samples.
+   *
+   *  The loop over samples is split between the OpenMP threads, which each
+   *  accumulate into their own partial sums. These are reduced at the end.
+   */
+  long i, j;
+  double *cos_sum, *sin_sum, *denom;
+
+  cos_sum = (double*) calloc(n_components * n_features, sizeof(double));
+  sin_sum = (double*) calloc(n_components * n_features, sizeof(double));
+  denom = (double*) calloc(n_components, sizeof(double));
+  if (NULL == cos_sum || NULL == sin_sum || NULL == denom) {
+    fprintf(stderr, "fitinvkappa: Memory allocation failure");
+    exit(EXIT_FAILURE);
+  }
+
+  #ifdef _OPENMP
+  #pragma omp parallel default(none) private(i, j)                         \
+      shared(n_samples, n_features, n_components, posteriors, cos_obs,     \
+             sin_obs, cos_sum, sin_sum, denom, stderr)
+  #endif
+  {
+  long k;
+  int err;
+  double posterior_kj;
+  const DATA_T *cos_obs_k, *sin_obs_k;
+  double *local_cos_sum, *local_sin_sum, *local_denom;
+
+  err = posix_memalign((void**) &local_cos_sum, 32, n_components * n_features * sizeof(double));
+  err |= posix_memalign((void**) &local_sin_sum, 32, n_components * n_features * sizeof(double));
+  err |= posix_memalign((void**) &local_denom, 32, n_components * sizeof(double));
+  if (err != 0) {
+    fprintf(stderr, "fitinvkappa: Memory allocation failure");
+    exit(EXIT_FAILURE);
+  }
+  memset(local_cos_sum, 0, n_components*n_features*sizeof(double));
+  memset(local_sin_sum, 0, n_components*n_features*sizeof(double));
+  memset(local_denom, 0, n_components*sizeof(double));
+
+  #ifdef _OPENMP
+  #pragma omp for schedule(static)
+  #endif
+  for (k = 0; k < n_samples; k++) {
+    cos_obs_k = &cos_obs[k*n_features];
+    sin_obs_k = &sin_obs[k*n_features];
+    for (j = 0; j < n_components; j++) {
+      posterior_kj = posteriors[k*n_components + j];
+      local_denom[j] += posterior_kj;
+      PRAGMA_OMP_SIMD
+      for (i = 0; i < n_features; i++) {
+        local_cos_sum[j*n_features + i] += posterior_kj * cos_obs_k[i];
+        local_sin_sum[j*n_features + i] += posterior_kj * sin_obs_k[i];
+      }
+    }
+  }
+
+  #ifdef _OPENMP
+  #pragma omp critical
+  #endif
+  {
+  for (j = 0; j < n_components; j++) {
+    denom[j] += local_denom[j];
+    for (i = 0; i < n_features; i++) {
+      cos_sum[j*n_features + i] += local_cos_sum[j*n_features + i];
+      sin_sum[j*n_features + i] += local_sin_sum[j*n_features + i];
+    }
+  }
+  }
+
+  free(local_cos_sum);
+  free(local_sin_sum);
+  free(local_denom);
+  }
+
+  // cos(x - m) = cos(x)cos(m) + sin(x)sin(m), and do the division at the end
+  for (j = 0; j < n_components; j++) {
+    for (i = 0; i < n_features; i++) {
+      out[j*n_features + i] = (cos(means[j*n_features + i]) * cos_sum[j*n_features + i] +
+                               sin(means[j*n_features + i]) * sin_sum[j*n_features + i]) / denom[j];
+    }
+  }
+
+  free(cos_sum);
+  free(sin_sum);
+  free(denom);
+  return 1;
+}
+#endif
+
+
+int COMPUTE_LOG_LIKELIHOOD(const DATA_T* cos_obs, const DATA_T* sin_obs,
+                           const double* means, const double* kappas,
+                           const double* log_normalizer,
+                           long n_samples, long n_components, long n_features,
+                           LL_T* out) {
+  /* Log likelihood of each observation in each state (von Mises distribution)
+
+     Parameters
+     ----------
+     cos_obs : array, shape=[n_samples, n_features]
+         Cosine of the observations
+     sin_obs : array, shape=[n_samples, n_features]
+         Sine of the observations
+     means : array, shape=[n_components, n_features]
+     kappas : array, shape=[n_components, n_features]
+     log_normalizer : array, shape=[n_components]
+         Log normalization constant for each state, from
+         compute_log_normalizer()
+
+     Output
+     ------
+     out : array, shape=[n_samples, n_components]
+
+     Equivalent Python Code
+     ----------------------
+     >>> from scipy.stats.distributions import vonmises
+     >>> n_components = kappas.shape[0]
+     >>> value = np.array([np.sum(vonmises.logpdf(obs, kappas[i], means[i]), axis=1) for i in range(n_components)]).T
+  */
+  int err;
+  long i, j, k;
+  LL_T *kappa_cos_means, *kappa_sin_means;
+
+  // allocate two workspaces
+  err = posix_memalign((void**) &kappa_cos_means, 32, n_components * n_features * sizeof(LL_T));
+  err |= posix_memalign((void**) &kappa_sin_means, 32, n_components * n_features * sizeof(LL_T));
+  if (err != 0) {
+    fprintf(stderr, "compute_log_likelihood: Memory allocation failure");
+    exit(EXIT_FAILURE);
+  }
+
+  // We need to calculate cos(obs[k*n_features + j] - means[i*n_features + j])
+  // But we want to avoid having a trig function in the inner tripple loop,
+  // so we use the double angle formula to split up the computation into cos(x)cos(y) + sin(x)*sin(y)
+  // where each of the terms can be computed in a double loop. The cos(x) and
+  // sin(x) terms for the observations are precomputed once per fit.
+  for (i = 0; i < n_components; i++) {
+    for (j = 0; j < n_features; j++) {
+      kappa_cos_means[j*n_components + i] = (LL_T) (kappas[i*n_features + j] * cos(means[i*n_features + j]));
+      kappa_sin_means[j*n_components + i] = (LL_T) (kappas[i*n_features + j] * sin(means[i*n_features + j]));
+    }
+  }
+
+  // The samples are independent, so they're split between the threads. The
+  // innermost loop, over the states, is contiguous in both the workspaces
+  // and the output, and gets vectorized.
+  #ifdef _OPENMP
+  #pragma omp parallel for schedule(static) default(none) private(i, j)    \
+      shared(n_samples, n_components, n_features, cos_obs, sin_obs,        \
+             kappa_cos_means, kappa_sin_means, log_normalizer, out)
+  #endif
+  for (k = 0; k < n_samples; k++) {
+    LL_T cos_obs_kj, sin_obs_kj;
+    LL_T* out_k = &out[k*n_components];
+
+    PRAGMA_OMP_SIMD
+    for (i = 0; i < n_components; i++)
+      out_k[i] = (LL_T) -log_normalizer[i];
+
+    for (j = 0; j < n_features; j++) {
+      cos_obs_kj = cos_obs[k*n_features + j];
+      sin_obs_kj = sin_obs[k*n_features + j];
+      PRAGMA_OMP_SIMD
+      for (i = 0; i < n_components; i++) {
+        out_k[i] += (cos_obs_kj*kappa_cos_means[j*n_components + i] +
+                     sin_obs_kj*kappa_sin_means[j*n_components + i]);
+      }
+    }
+  }
+
+  free(kappa_cos_means);
+  free(kappa_sin_means);
+  return 1;
+}
+
+#undef DATA_T
+#undef LL_T
+#undef COMPUTE_LOG_LIKELIHOOD
+#undef FITINVKAPPA
@@ -4,56 +4,264 @@ cimport numpy as np
 np.import_array()
 
 cdef extern int fitinvkappa(long n_samples, long n_features, long n_components,
-                 double* posteriors, double* obs, double* means, double* out) nogil
+                 double* posteriors, double* cos_obs, double* sin_obs,
+                 double* means, double* out) nogil
+cdef extern int fitinvkappa_float(long n_samples, long n_features, long n_components,
+                 double* posteriors, float* cos_obs, float* sin_obs,
+                 double* means, double* out) nogil
 
-cdef extern int compute_log_likelihood(double* obs, double* means, double* kappas,
+cdef extern int compute_log_likelihood(double* cos_obs, double* sin_obs,
+                                        double* means, double* kappas,
+                                        double* log_normalizer,
                                         long n_samples, long n_components, long n_features,
                                         double* out) nogil
+cdef extern int compute_log_likelihood_mixed(float* cos_obs, float* sin_obs,
+                                        double* means, double* kappas,
+                                        double* log_normalizer,
+                                        long n_samples, long n_components, long n_features,
+                                        double* out) nogil
+cdef extern int compute_log_likelihood_single(float* cos_obs, float* sin_obs,
+                                        double* means, double* kappas,
+                                        double* log_normalizer,
+                                        long n_samples, long n_components, long n_features,
+                                        float* out) nogil
+cdef extern void compute_log_normalizer(double* kappas, long n_components,
+                                        long n_features, double* out) nogil
 cdef extern int inv_mbessel_ratio(double* x, size_t n) nogil
 
+cdef extern from "decode.h":
+    int viterbi(double* cos_obs, double* sin_obs, long* offsets, long n_sequences,
+                double* means, double* kappas, double* log_normalizer,
+                double* log_startprob, double* log_transmat, long n_components,
+                long n_features, int* labels, double* logprob) nogil
+    int posteriors(double* cos_obs, double* sin_obs, long* offsets, long n_sequences,
+                   double* means, double* kappas, double* log_normalizer,
+                   double* log_startprob, double* log_transmat, long n_components,
+                   long n_features, float* out, double* logprob) nogil
+    int viterbi_float(float* cos_obs, float* sin_obs, long* offsets, long n_sequences,
+                      double* means, double* kappas, double* log_normalizer,
+                      double* log_startprob, double* log_transmat, long n_components,
+                      long n_features, int* labels, double* logprob) nogil
+    int posteriors_float(float* cos_obs, float* sin_obs, long* offsets, long n_sequences,
+                         double* means, double* kappas, double* log_normalizer,
+                         double* log_startprob, double* log_transmat, long n_components,
+                         long n_features, float* out, double* logprob) nogil
+
+# The cosine and sine of the observations can be stored in either float32 or
+# float64. Everything else (the parameters, and the accumulators) is float64.
+ctypedef fused data_t:
+    float
+    double
+
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 def _fitinvkappa(np.ndarray[np.double_t, ndim=2, mode="c"] posteriors not None,
-                np.ndarray[np.double_t, ndim=2, mode="c"] obs not None,
+                np.ndarray[data_t, ndim=2, mode="c"] cos_obs not None,
+                np.ndarray[data_t, ndim=2, mode="c"] sin_obs not None,
                 np.ndarray[np.double_t, ndim=2, mode="c"] means not None,
                 np.ndarray[np.double_t, ndim=2, mode="c"] out not None):
     cdef long n_samples = posteriors.shape[0]
-    cdef long n_features = obs.shape[1]
+    cdef long n_features = cos_obs.shape[1]
     cdef long n_components = means.shape[0]
 
-    fitinvkappa(n_samples, n_features, n_components, &posteriors[0, 0],
-                &obs[0,0], &means[0, 0], &out[0, 0])
+    with nogil:
+        if data_t is float:
+            fitinvkappa_float(n_samples, n_features, n_components, &posteriors[0, 0],
+                              &cos_obs[0,0], &sin_obs[0,0], &means[0, 0], &out[0, 0])
+        else:
+            fitinvkappa(n_samples, n_features, n_components, &posteriors[0, 0],
+                        &cos_obs[0,0], &sin_obs[0,0], &means[0, 0], &out[0, 0])
     return 1;
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 def _fitkappa(np.ndarray[np.double_t, ndim=2, mode="c"] posteriors not None,
-                np.ndarray[np.double_t, ndim=2, mode="c"] obs not None,
+                np.ndarray[data_t, ndim=2, mode="c"] cos_obs not None,
+                np.ndarray[data_t, ndim=2, mode="c"] sin_obs not None,
                 np.ndarray[np.double_t, ndim=2, mode="c"] means not None,
                 np.ndarray[np.double_t, ndim=2, mode="c"] out not None):
     cdef long n_samples = posteriors.shape[0]
-    cdef long n_features = obs.shape[1]
+    cdef long n_features = cos_obs.shape[1]
     cdef long n_components = means.shape[0]
-    
-    fitinvkappa(n_samples, n_features, n_components, &posteriors[0, 0],
-                &obs[0,0], &means[0, 0], &out[0, 0])
-    inv_mbessel_ratio(&out[0, 0], out.size)
+
+    cdef size_t size = out.size
+
+    with nogil:
+        if data_t is float:
+            fitinvkappa_float(n_samples, n_features, n_components, &posteriors[0, 0],
+                              &cos_obs[0,0], &sin_obs[0,0], &means[0, 0], &out[0, 0])
+        else:
+            fitinvkappa(n_samples, n_features, n_components, &posteriors[0, 0],
+                        &cos_obs[0,0], &sin_obs[0,0], &means[0, 0], &out[0, 0])
+        inv_mbessel_ratio(&out[0, 0], size)
     return 1;
-    
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _inv_mbessel_ratio(y):
+    """Inverse of the ratio of the modified Bessel functions of the first kind
+    of order 1 and 0, A(x) = I_1(x) / I_0(x), evaluated from the spline
+    tables precomputed at build time. Values of y outside of the range of the
+    tables are clipped.
+
+    Parameters
+    ----------
+    y : array_like
+
+    Returns
+    -------
+    x : np.ndarray, dtype=float64, same shape as y
+    """
+    cdef np.ndarray[np.double_t, ndim=1, mode="c"] x
+    x = np.array(y, dtype=np.double, copy=True, order='C').reshape(-1)
+    cdef size_t size = x.shape[0]
+    if size > 0:
+        with nogil:
+            inv_mbessel_ratio(&x[0], size)
+    return x.reshape(np.shape(y))
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _log_normalizer(np.ndarray[dtype=np.double_t, ndim=2, mode='c'] kappas not None):
+    cdef long n_components = kappas.shape[0]
+    cdef long n_features = kappas.shape[1]
+    cdef np.ndarray[dtype=np.double_t, ndim=1, mode='c'] out
+    out = np.empty(n_components)
+
+    with nogil:
+        compute_log_normalizer(&kappas[0,0], n_components, n_features, &out[0])
+
+    return out
+
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def _compute_log_likelihood(np.ndarray[dtype=np.double_t, ndim=2, mode='c'] obs not None, 
-                           np.ndarray[dtype=np.double_t, ndim=2, mode='c'] means not None, 
-                           np.ndarray[dtype=np.double_t, ndim=2, mode='c'] kappas not None):
-    cdef int n_samples = obs.shape[0]        # large
-    cdef int n_components = means.shape[0]   # moderate
-    cdef int n_features = means.shape[1]     # small
+def _compute_log_likelihood(np.ndarray[data_t, ndim=2, mode='c'] cos_obs not None,
+                           np.ndarray[data_t, ndim=2, mode='c'] sin_obs not None,
+                           np.ndarray[dtype=np.double_t, ndim=2, mode='c'] means not None,
+                           np.ndarray[dtype=np.double_t, ndim=2, mode='c'] kappas not None,
+                           np.ndarray[dtype=np.double_t, ndim=1, mode='c'] log_normalizer=None,
+                           str precision='mixed'):
+    """Log likelihood of each observation in each state.
+
+    With float32 observations, the likelihood is accumulated and returned in
+    float64 if precision='mixed', and in float32 if precision='single'. With
+    float64 observations, the precision is ignored.
+    """
+    cdef long n_samples = cos_obs.shape[0]    # large
+    cdef long n_components = means.shape[0]   # moderate
+    cdef long n_features = means.shape[1]     # small
     cdef np.ndarray[dtype=np.double_t, ndim=2, mode='c'] out
-    out = np.empty((n_samples, n_components))
+    cdef np.ndarray[dtype=np.float32_t, ndim=2, mode='c'] out_single
+    if precision not in ['single', 'mixed']:
+        raise ValueError('precision must be one of "single" or "mixed"')
+    if log_normalizer is None:
+        log_normalizer = _log_normalizer(kappas)
 
-    compute_log_likelihood(&obs[0,0], &means[0,0], &kappas[0,0], n_samples,
-                           n_components, n_features, &out[0,0])
+    if data_t is float and precision == 'single':
+        out_single = np.empty((n_samples, n_components), dtype=np.float32)
+        with nogil:
+            compute_log_likelihood_single(&cos_obs[0,0], &sin_obs[0,0], &means[0,0], &kappas[0,0],
+                                          &log_normalizer[0], n_samples, n_components, n_features,
+                                          &out_single[0,0])
+        return out_single
+
+    out = np.empty((n_samples, n_components))
+    with nogil:
+        if data_t is float:
+            compute_log_likelihood_mixed(&cos_obs[0,0], &sin_obs[0,0], &means[0,0], &kappas[0,0],
+                                         &log_normalizer[0], n_samples, n_components, n_features,
+                                         &out[0,0])
+        else:
+            compute_log_likelihood(&cos_obs[0,0], &sin_obs[0,0], &means[0,0], &kappas[0,0],
+                                   &log_normalizer[0], n_samples, n_components, n_features,
+                                   &out[0,0])
 
     return out
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _viterbi(np.ndarray[data_t, ndim=2, mode='c'] cos_obs not None,
+             np.ndarray[data_t, ndim=2, mode='c'] sin_obs not None,
+             np.ndarray[dtype=np.intp_t, ndim=1, mode='c'] offsets not None,
+             np.ndarray[dtype=np.double_t, ndim=2, mode='c'] means not None,
+             np.ndarray[dtype=np.double_t, ndim=2, mode='c'] kappas not None,
+             np.ndarray[dtype=np.double_t, ndim=1, mode='c'] log_startprob not None,
+             np.ndarray[dtype=np.double_t, ndim=2, mode='c'] log_transmat not None):
+    """Viterbi decoding of a ragged buffer of sequences
+
+    Returns
+    -------
+    logprob : np.ndarray, shape=[n_sequences], dtype=float64
+    labels : np.ndarray, shape=[n_samples], dtype=int32
+    """
+    cdef long n_sequences = offsets.shape[0] - 1
+    cdef long n_components = means.shape[0]
+    cdef long n_features = means.shape[1]
+    cdef np.ndarray[dtype=np.double_t, ndim=1, mode='c'] log_normalizer = _log_normalizer(kappas)
+    cdef np.ndarray[dtype=np.int32_t, ndim=1, mode='c'] labels
+    cdef np.ndarray[dtype=np.double_t, ndim=1, mode='c'] logprob
+    labels = np.zeros(cos_obs.shape[0], dtype=np.int32)
+    logprob = np.zeros(n_sequences)
+    if n_sequences == 0 or cos_obs.shape[0] == 0:
+        return logprob, labels
+
+    with nogil:
+        if data_t is float:
+            viterbi_float(&cos_obs[0,0], &sin_obs[0,0], <long*> &offsets[0], n_sequences,
+                          &means[0,0], &kappas[0,0], &log_normalizer[0], &log_startprob[0],
+                          &log_transmat[0,0], n_components, n_features,
+                          <int*> &labels[0], &logprob[0])
+        else:
+            viterbi(&cos_obs[0,0], &sin_obs[0,0], <long*> &offsets[0], n_sequences,
+                    &means[0,0], &kappas[0,0], &log_normalizer[0], &log_startprob[0],
+                    &log_transmat[0,0], n_components, n_features,
+                    <int*> &labels[0], &logprob[0])
+
+    return logprob, labels
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _posteriors(np.ndarray[data_t, ndim=2, mode='c'] cos_obs not None,
+                np.ndarray[data_t, ndim=2, mode='c'] sin_obs not None,
+                np.ndarray[dtype=np.intp_t, ndim=1, mode='c'] offsets not None,
+                np.ndarray[dtype=np.double_t, ndim=2, mode='c'] means not None,
+                np.ndarray[dtype=np.double_t, ndim=2, mode='c'] kappas not None,
+                np.ndarray[dtype=np.double_t, ndim=1, mode='c'] log_startprob not None,
+                np.ndarray[dtype=np.double_t, ndim=2, mode='c'] log_transmat not None):
+    """Posterior state probabilities of a ragged buffer of sequences
+
+    Returns
+    -------
+    logprob : np.ndarray, shape=[n_sequences], dtype=float64
+    posteriors : np.ndarray, shape=[n_samples, n_components], dtype=float32
+    """
+    cdef long n_sequences = offsets.shape[0] - 1
+    cdef long n_components = means.shape[0]
+    cdef long n_features = means.shape[1]
+    cdef np.ndarray[dtype=np.double_t, ndim=1, mode='c'] log_normalizer = _log_normalizer(kappas)
+    cdef np.ndarray[dtype=np.float32_t, ndim=2, mode='c'] out
+    cdef np.ndarray[dtype=np.double_t, ndim=1, mode='c'] logprob
+    out = np.zeros((cos_obs.shape[0], n_components), dtype=np.float32)
+    logprob = np.zeros(n_sequences)
+    if n_sequences == 0 or cos_obs.shape[0] == 0:
+        return logprob, out
+
+    with nogil:
+        if data_t is float:
+            posteriors_float(&cos_obs[0,0], &sin_obs[0,0], <long*> &offsets[0], n_sequences,
+                             &means[0,0], &kappas[0,0], &log_normalizer[0], &log_startprob[0],
+                             &log_transmat[0,0], n_components, n_features,
+                             &out[0,0], &logprob[0])
+        else:
+            posteriors(&cos_obs[0,0], &sin_obs[0,0], <long*> &offsets[0], n_sequences,
+                       &means[0,0], &kappas[0,0], &log_normalizer[0], &log_startprob[0],
+                       &log_transmat[0,0], n_components, n_features,
+                       &out[0,0], &logprob[0])
+
+    return logprob, out
@@ -10,8 +10,10 @@ import pandas as pd
 from mdtraj.testing import eq
 from mdtraj.testing import get_fn as get_mdtraj_fn
 import sklearn.hmm
-from mixtape.utils import iterobjects
-from mixtape.featurizer import RawPositionsFeaturizer
+from mixtape.utils import iterobjects, load_indices
+from mixtape.featurizer import (RawPositionsFeaturizer, ContactFeaturizer,
+                                DihedralFeaturizer)
+import mixtape.featurizer
 DATADIR = HMM = None
 
 ################################################################################
@@ -76,16 +78,16 @@ def test_atomindices():
     with tempdir():
         shell('hmsm atomindices -o all.dat --all -a -p %s' % fn)
         shell('hmsm atomindices -o all-pairs.dat --all -d -p %s' % fn)
-        atoms = np.loadtxt('all.dat', int)
-        pairs =  np.loadtxt('all-pairs.dat', int)
+        atoms = load_indices('all.dat')[:, 0]
+        pairs =  load_indices('all-pairs.dat')
         eq(t.n_atoms, len(atoms))
         eq(t.n_atoms * (t.n_atoms-1) / 2, len(pairs))
 
     with tempdir():
         shell('hmsm atomindices -o heavy.dat --heavy -a -p %s' % fn)
         shell('hmsm atomindices -o heavy-pairs.dat --heavy -d -p %s' % fn)
-        atoms = np.loadtxt('heavy.dat', int)
-        pairs = np.loadtxt('heavy-pairs.dat', int)
+        atoms = load_indices('heavy.dat')[:, 0]
+        pairs = load_indices('heavy-pairs.dat')
         assert all(t.topology.atom(i).element.symbol != 'H' for i in atoms)
         assert sum(1 for a in t.topology.atoms if a.element.symbol != 'H') == len(atoms)
         eq(np.array(list(itertools.combinations(atoms, 2))), pairs)
@@ -93,8 +95,8 @@ def test_atomindices():
     with tempdir():
         shell('hmsm atomindices -o alpha.dat --alpha -a -p %s' % fn)
         shell('hmsm atomindices -o alpha-pairs.dat --alpha -d -p %s' % fn)
-        atoms = np.loadtxt('alpha.dat', int)
-        pairs = np.loadtxt('alpha-pairs.dat', int)
+        atoms = load_indices('alpha.dat')[:, 0]
+        pairs = load_indices('alpha-pairs.dat')
         assert all(t.topology.atom(i).name == 'CA' for i in atoms)
         assert sum(1 for a in t.topology.atoms if a.name == 'CA') == len(atoms)
         eq(np.array(list(itertools.combinations(atoms, 2))), pairs)
@@ -102,8 +104,8 @@ def test_atomindices():
     with tempdir():
         shell('hmsm atomindices -o minimal.dat --minimal -a -p %s' % fn)
         shell('hmsm atomindices -o minimal-pairs.dat --minimal -d -p %s' % fn)
-        atoms = np.loadtxt('minimal.dat', int)
-        pairs = np.loadtxt('minimal-pairs.dat', int)
+        atoms = load_indices('minimal.dat')[:, 0]
+        pairs = load_indices('minimal-pairs.dat')
         assert all(t.topology.atom(i).name in ['CA', 'CB', 'C', 'N' , 'O'] for i in atoms)
         eq(np.array(list(itertools.combinations(atoms, 2))), pairs)
 
@@ -114,10 +116,10 @@ def test_dihedralindices():
     with tempdir():
         shell('hmsm dihedralindices -o phi.dat --phi -p %s' % fn)
         shell('hmsm dihedralindices -o psi.dat --psi -p %s' % fn)
-        eq(len(np.loadtxt('phi.dat', int)), len(np.loadtxt('psi.dat', int)))
+        eq(len(load_indices('phi.dat')), len(load_indices('psi.dat')))
         shell('hmsm dihedralindices -o chi1.dat --chi1 -p %s' % fn)
         shell('hmsm dihedralindices -o chi2.dat --chi2 -p %s' % fn)
-        assert len(np.loadtxt('chi2.dat')) < len(np.loadtxt('chi1.dat'))
+        assert len(load_indices('chi2.dat')) < len(load_indices('chi1.dat'))
         shell('hmsm dihedralindices -o chi3.dat --chi3 -p %s' % fn)
         shell('hmsm dihedralindices -o chi4.dat --chi4 -p %s' % fn)
         shell('hmsm dihedralindices -o omega.dat --omega -p %s' % fn)
@@ -129,14 +131,75 @@ def test_featurizer():
     with tempdir():
         shell('hmsm atomindices -o alpha.dat --alpha -a -p %s' % fn)
         shell('hmsm featurizer --top %s -o alpha.pickl -a alpha.dat' % fn)
-        f = np.load('alpha.pickl')
-        eq(f.atom_indices, np.loadtxt('alpha.dat', int))
+        f = mixtape.featurizer.load('alpha.pickl')
+        eq(f.atom_indices, load_indices('alpha.dat')[:, 0])
 
     with tempdir():
         shell('hmsm atomindices -o alphapairs.dat --alpha -d -p %s' % fn)
         shell('hmsm featurizer --top %s -o alpha.pickl -d alphapairs.dat' % fn)
-        f = np.load('alpha.pickl')
-        eq(f.pair_indices, np.loadtxt('alphapairs.dat', int))
+        f = mixtape.featurizer.load('alpha.pickl')
+        eq(f.pair_indices, load_indices('alphapairs.dat'))
+
+
+def test_contact_pairs():
+    fn = get_mdtraj_fn('1bpi.pdb')
+    t = md.load(fn)
+    alpha = [a.index for a in t.topology.atoms if a.name == 'CA']
+    with tempdir():
+        shell('hmsm atomindices -o contacts.npy --alpha --contact-pairs --cutoff 0.6 -p %s' % fn)
+        pairs = load_indices('contacts.npy')
+        eq(pairs.shape[1], 2)
+        assert set(pairs.ravel()) <= set(alpha)
+        assert 0 < len(pairs) < len(alpha) * (len(alpha) - 1) / 2
+
+        # the pairs within the cutoff, and only them, are selected
+        all_pairs = np.array(list(itertools.combinations(alpha, 2)))
+        close = all_pairs[md.compute_distances(t, all_pairs)[0] <= 0.6]
+        eq(set(map(tuple, close)), set(map(tuple, pairs)))
+
+        shell('hmsm atomindices -o variable.npy --alpha --contact-pairs --cutoff 0.6 '
+              '--n-pairs 10 -p %s' % fn)
+        variable = load_indices('variable.npy')
+        eq(len(variable), 10)
+        assert set(map(tuple, variable)) <= set(map(tuple, pairs))
+
+        shell('hmsm featurizer --top %s -o contacts.pickl --contact-pairs contacts.npy' % fn)
+        f = mixtape.featurizer.load('contacts.pickl')
+        assert isinstance(f, ContactFeaturizer)
+        contacts = np.load('contacts.npy')
+        eq(contacts.dtype, np.dtype(np.int32))
+        eq(f.pair_indices, contacts)
+
+
+def test_fitvmhmm_featurizer():
+    fn = get_mdtraj_fn('native.pdb')
+    native = md.load(fn)
+    random = np.random.RandomState(0)
+    with tempdir():
+        for i in range(3):
+            xyz = native.xyz + 0.02 * random.randn(50, native.n_atoms, 3)
+            md.Trajectory(xyz=xyz, topology=native.topology).save('Trajectory%d.h5' % i)
+
+        shell('hmsm dihedralindices -o phipsi.dat --phi --psi -p %s' % fn)
+        shell('hmsm featurizer --top %s -o angles.pickl --dihedral-indices phipsi.dat' % fn)
+        f = mixtape.featurizer.load('angles.pickl')
+        assert isinstance(f, DihedralFeaturizer)
+        assert not f.sincos
+        eq(f.dihedral_indices, load_indices('phipsi.dat'))
+
+        shell('hmsm fit-vmhmm --featurizer angles.pickl --n-states 2 --n-em-iter 5 '
+              '--dir . --ext h5 --top %s' % fn)
+        model = next(iterobjects('hmms.jsonlines'))
+        eq(model['n_states'], 2)
+        eq(np.array(model['means']).shape, (2, len(f.dihedral_indices)))
+
+        # the sin/cos embedding is for Gaussian HMMs
+        shell('hmsm featurizer --top %s -o sincos.pickl --dihedral-indices phipsi.dat '
+              '--dihedral-embedding sincos' % fn)
+        assert mixtape.featurizer.load('sincos.pickl').sincos
+        assert os.system('hmsm fit-vmhmm --featurizer sincos.pickl --n-states 2 '
+                         '--dir . --ext h5 --top %s -o sincos.jsonlines' % fn) != 0
+        assert not os.path.exists('sincos.jsonlines')
 
 
 def test_help():
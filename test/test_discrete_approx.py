@@ -0,0 +1,67 @@
+import numpy as np
+import scipy.linalg
+import scipy.optimize
+try:
+    from scipy.special import logsumexp
+except ImportError:
+    from scipy.misc import logsumexp
+from mixtape.discrete_approx import discrete_approx_mvn
+
+random = np.random.RandomState(0)
+
+
+def _dense_discrete_approx_mvn(X, means, covars):
+    # the implementation before the streaming rewrite, with all of the
+    # points in memory at once (its gradient takes the log of the moment
+    # sums, so it needs positive points)
+    X = np.asarray(X, dtype=np.float32)
+    if covars.ndim == 1:
+        prob = np.exp(-0.5 * np.sum(1./np.sqrt(covars) * (X - means)**2, axis=1))
+        moments = np.concatenate((means, covars))
+    else:
+        cv_chol = scipy.linalg.cholesky(covars, lower=True)
+        cv_sol = scipy.linalg.solve_triangular(cv_chol, (X - means).T, lower=True).T
+        prob = np.exp(-0.5 * (np.sum(cv_sol ** 2, axis=1)))
+        moments = np.concatenate((means, np.diag(covars)))
+    moment_contributions = np.hstack((X, (X-means)**2))
+
+    def objective_and_grad(l):
+        dot = np.dot(moment_contributions, l)
+        lse = logsumexp(dot, b=prob)
+        obj_value = lse - np.dot(l, moments)
+        dot_max = dot.max(axis=0)
+        log_numerator = np.log(np.sum(moment_contributions * (prob * np.exp(dot -
+                            dot_max)).reshape(-1,1), axis=0)) + dot_max
+        grad_value = np.exp(log_numerator - lse) - moments
+        return obj_value, grad_value
+
+    result = scipy.optimize.minimize(objective_and_grad, jac=True, x0=np.ones_like(moments), method='BFGS')
+    dot = np.dot(moment_contributions, result['x'])
+    weights = prob * np.exp(dot - logsumexp(dot, b=prob))
+    return weights / np.sum(weights)
+
+
+def test_discrete_approx_mvn_matches_dense():
+    X = random.uniform(1, 5, size=(500, 2))
+    means = np.array([3.0, 2.5])
+    for covars in [np.array([0.5, 0.8]), np.array([[0.5, 0.1], [0.1, 0.8]])]:
+        expected = _dense_discrete_approx_mvn(X, means, covars)
+        weights = discrete_approx_mvn(X, means, covars, chunk_size=64)
+        np.testing.assert_array_almost_equal(weights, expected, decimal=5)
+
+        # the same weights from a stream of chunks
+        stream = [X[:100], X[100:101], X[101:]]
+        np.testing.assert_array_almost_equal(
+            discrete_approx_mvn(stream, means, covars), weights, decimal=6)
+
+        # and the moments are matched
+        np.testing.assert_array_almost_equal(np.dot(weights, X), means, decimal=4)
+
+
+def test_discrete_approx_mvn_negative_points():
+    # the moments of points with negative coordinates (where the dense
+    # version took the log of a negative sum)
+    X = random.uniform(-5, 5, size=(200, 1))
+    weights = discrete_approx_mvn(X, [0.5], [2.0])
+    np.testing.assert_almost_equal(np.dot(weights, X[:, 0]), 0.5, decimal=4)
+    np.testing.assert_almost_equal(np.dot(weights, (X[:, 0] - 0.5)**2), 2.0, decimal=4)
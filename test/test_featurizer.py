@@ -0,0 +1,429 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import mdtraj as md
+from mdtraj.testing import get_fn as get_mdtraj_fn
+from mixtape import featurizer as featurizer_module
+from mixtape.featurizer import (Featurizer, FeatureUnion, RawPositionsFeaturizer,
+                                 DihedralFeaturizer, ContactFeaturizer,
+                                 SuperposeFeaturizer, AtomPairsFeaturizer,
+                                 FeaturizationCache, FeatureStream, FrameIndex,
+                                 featurize_files, featurize_chunks,
+                                 contact_pairs, variable_pairs,
+                                 _cell_list_pairs, _superposed_deviations, load)
+
+random = np.random.RandomState(0)
+
+
+def _random_rotations(n):
+    # orthogonalize random matrices, and flip to exclude reflections
+    Q, _ = np.linalg.qr(random.randn(n, 3, 3))
+    Q[np.linalg.det(Q) < 0, :, 0] *= -1
+    return Q
+
+
+def test_superposed_deviations():
+    Y = random.randn(20, 3)
+    noise = 0.01 * random.randn(100, 20, 3)
+    X = np.einsum('naj,nij->nai', Y + noise, _random_rotations(100))
+    X += 5 * random.randn(100, 1, 3)
+
+    deviations = _superposed_deviations(X, Y)
+    assert deviations.dtype == np.float32
+    assert deviations.shape == (100, 20)
+    # the rigid motion is removed, leaving (about) the noise
+    noise -= noise.mean(axis=1)[:, np.newaxis]
+    np.testing.assert_array_almost_equal(
+        deviations, np.sqrt(np.sum(noise**2, axis=2)), decimal=2)
+
+
+def test_superposed_deviations_no_reflection():
+    # a mirror image can't be superposed by a rotation
+    Y = random.randn(10, 3)
+    X = Y * np.array([1, 1, -1])
+    assert _superposed_deviations(X[np.newaxis], Y).max() > 0.1
+
+
+class _ColumnsFeaturizer(Featurizer):
+    # the coordinates of some atoms, from a (n_frames, n_atoms) array
+    def __init__(self, atoms):
+        self.atoms = np.asarray(atoms)
+        self.n_features = len(atoms)
+
+    def featurize(self, traj):
+        return traj[:, self.atoms]
+
+    def required_atoms(self):
+        return self.atoms
+
+    def featurize_atoms(self, traj, positions):
+        return traj[:, positions[self.atoms]]
+
+
+def test_feature_union():
+    traj = random.randn(10, 8)
+    union = FeatureUnion([_ColumnsFeaturizer([5, 1]), _ColumnsFeaturizer([1, 6, 2])])
+    assert union.n_features == 5
+    np.testing.assert_array_equal(union.required_atoms(), [1, 2, 5, 6])
+
+    X = union.featurize(traj)
+    assert X.dtype == np.float32
+    np.testing.assert_array_almost_equal(X, traj[:, [5, 1, 1, 6, 2]])
+
+    # the same features from only the required atoms
+    positions = -np.ones(7, dtype=int)
+    positions[[1, 2, 5, 6]] = np.arange(4)
+    np.testing.assert_array_equal(
+        union.featurize_atoms(traj[:, [1, 2, 5, 6]], positions), X)
+
+    # a featurizer that needs all of the atoms
+    assert FeatureUnion([union, RawPositionsFeaturizer(24)]).required_atoms() is None
+
+
+class _Trajectory(object):
+    def __init__(self, xyz):
+        self.xyz = xyz
+        self.n_atoms = xyz.shape[1]
+
+
+def test_dihedral_featurizer():
+    # rotate the last atom of a quartet about the z axis
+    angles = np.linspace(-3, 3, 7)
+    xyz = np.zeros((len(angles), 5, 3))
+    xyz[:, 0] = [1, 0, 0]
+    xyz[:, 2] = [0, 0, 1]
+    xyz[:, 4, 0] = np.cos(angles)
+    xyz[:, 4, 1] = np.sin(angles)
+    xyz[:, 4, 2] = 1
+    traj = _Trajectory(xyz)
+
+    featurizer = DihedralFeaturizer([[0, 1, 2, 4]])
+    assert featurizer.n_features == 1
+    np.testing.assert_array_equal(featurizer.required_atoms(), [0, 1, 2, 4])
+    X = featurizer.featurize(traj)
+    assert X.dtype == np.float32
+    np.testing.assert_array_almost_equal(X[:, 0], angles, decimal=5)
+
+    featurizer = DihedralFeaturizer([[0, 1, 2, 4]], sincos=True)
+    assert featurizer.n_features == 2
+    np.testing.assert_array_almost_equal(
+        featurizer.featurize(traj), np.c_[np.sin(angles), np.cos(angles)],
+        decimal=5)
+
+
+def test_cell_list_pairs():
+    X = 5 * random.rand(500, 3)
+    pairs = _cell_list_pairs(X, 0.7)
+    distances = np.sqrt(np.sum((X[:, np.newaxis] - X[np.newaxis])**2, axis=2))
+    expected = np.transpose(np.nonzero(np.triu(distances <= 0.7, 1)))
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    np.testing.assert_array_equal(pairs, expected)
+
+
+def test_contact_featurizer():
+    xyz = 3 * random.rand(5, 40, 3)
+    atoms = np.arange(0, 40, 3)
+    pairs = contact_pairs(xyz, atoms, 1.0)
+    assert pairs.dtype == np.int32
+    # every pair that is within the cutoff in some frame
+    expected = [[i, j] for i in atoms for j in atoms if i < j and
+                np.any(np.sqrt(np.sum((xyz[:, i] - xyz[:, j])**2, axis=1)) <= 1.0)]
+    np.testing.assert_array_equal(pairs, expected)
+
+    featurizer = ContactFeaturizer(pairs)
+    X = featurizer.featurize(_Trajectory(xyz))
+    assert X.dtype == np.float32
+    np.testing.assert_array_almost_equal(
+        X, np.sqrt(np.sum((xyz[:, pairs[:, 0]] - xyz[:, pairs[:, 1]])**2, axis=2)),
+        decimal=5)
+
+    variable = variable_pairs(xyz, pairs, 3)
+    top = np.argsort(X.var(axis=0))[::-1][:3]
+    np.testing.assert_array_equal(variable, pairs[np.sort(top)])
+
+
+def test_save_load():
+    featurizer = FeatureUnion([DihedralFeaturizer([[0, 1, 2, 4]], sincos=True),
+                               RawPositionsFeaturizer(15),
+                               ContactFeaturizer([[0, 3], [1, 4]])])
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        featurizer.save(filename)
+        loaded = load(filename)
+
+        # a featurizer class that doesn't support the npz format is pickled
+        _ColumnsFeaturizer([1, 2]).save(filename)
+        assert isinstance(load(filename), _ColumnsFeaturizer)
+    finally:
+        os.unlink(filename)
+
+    assert isinstance(loaded, FeatureUnion)
+    assert loaded.n_features == featurizer.n_features
+    dihedrals, raw, contacts = loaded.featurizers
+    np.testing.assert_array_equal(dihedrals.dihedral_indices, [[0, 1, 2, 4]])
+    assert dihedrals.sincos
+    assert raw.n_features == 15
+    assert isinstance(contacts, ContactFeaturizer)
+    np.testing.assert_array_equal(contacts.pair_indices, [[0, 3], [1, 4]])
+
+
+def test_save_load_reference():
+    # the reference coordinates and topology of the selected atoms are
+    # stored, and rebuilt when reference_traj is accessed
+    native = md.load(get_mdtraj_fn('native.pdb'))
+    xyz = native.xyz + 0.1 * random.randn(5, native.n_atoms, 3).astype(np.float32)
+    traj = md.Trajectory(xyz, native.topology)
+    atoms = np.array([1, 4, 8, 10, 14, 16])
+    pairs = np.array([[4, 14], [1, 8], [8, 16]])
+
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        for featurizer, selected in [(SuperposeFeaturizer(atoms, native), atoms),
+                                     (AtomPairsFeaturizer(pairs, native), np.unique(pairs))]:
+            featurizer.save(filename)
+            loaded = load(filename)
+            assert type(loaded) is type(featurizer)
+            np.testing.assert_array_almost_equal(
+                loaded.featurize(traj), featurizer.featurize(traj))
+
+            reference = loaded.reference_traj
+            assert reference.n_atoms == len(selected)
+            np.testing.assert_array_almost_equal(reference.xyz[0], native.xyz[0, selected])
+            assert ([str(a) for a in reference.topology.atoms] ==
+                    [str(native.topology.atom(i)) for i in selected])
+    finally:
+        os.unlink(filename)
+
+
+class _BrokenFeaturizer(RawPositionsFeaturizer):
+    def _get_state(self, prefix, arrays):
+        raise NotImplementedError('not yet')
+
+
+def test_save_errors_propagate():
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    featurizer_module._SAVEABLE['_BrokenFeaturizer'] = _BrokenFeaturizer
+    try:
+        # an error while saving a registered featurizer isn't turned into a
+        # pickle
+        for f in [_BrokenFeaturizer(3), FeatureUnion([_BrokenFeaturizer(3)])]:
+            try:
+                f.save(filename)
+            except NotImplementedError:
+                pass
+            else:
+                raise AssertionError('save() should have raised')
+
+        # a union with an unregistered featurizer is pickled as a whole
+        FeatureUnion([RawPositionsFeaturizer(3), _ColumnsFeaturizer([1])]).save(filename)
+        loaded = load(filename)
+        assert isinstance(loaded.featurizers[1], _ColumnsFeaturizer)
+    finally:
+        del featurizer_module._SAVEABLE['_BrokenFeaturizer']
+        os.unlink(filename)
+
+
+def test_cache_fingerprint():
+    # the fingerprint only depends on the parameters of the featurizer, not
+    # on where it was loaded from
+    featurizer = FeatureUnion([DihedralFeaturizer([[0, 1, 2, 4]]),
+                               ContactFeaturizer([[0, 3], [1, 4]]),
+                               RawPositionsFeaturizer(15)])
+    tempdir = tempfile.mkdtemp()
+    try:
+        cache = FeaturizationCache(os.path.join(tempdir, 'cache'))
+        fingerprints = [cache.fingerprint(featurizer)]
+        for name in ['a', 'b']:
+            filename = os.path.join(tempdir, name)
+            featurizer.save(filename)
+            fingerprints.append(cache.fingerprint(load(filename)))
+        assert len(set(fingerprints)) == 1
+
+        # index arrays from .npy (int32) and text (int64) index files
+        pairs = np.array([[0, 3], [1, 4]])
+        assert (cache.fingerprint(AtomPairsFeaturizer(pairs.astype(np.int32), None)) ==
+                cache.fingerprint(AtomPairsFeaturizer(pairs.astype(np.int64), None)))
+
+        other = FeatureUnion([DihedralFeaturizer([[0, 1, 2, 5]]),
+                              ContactFeaturizer([[0, 3], [1, 4]]),
+                              RawPositionsFeaturizer(15)])
+        assert cache.fingerprint(other) != fingerprints[0]
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def _write_trajectories(dirname, lengths):
+    # trajectories of 2 atoms, saved with their topology
+    topology = md.load(get_mdtraj_fn('native.pdb')).restrict_atoms([0, 1]).topology
+    filenames = []
+    for i, n_frames in enumerate(lengths):
+        filename = os.path.join(dirname, 'trajectory%d.h5' % i)
+        xyz = random.randn(n_frames, 2, 3).astype(np.float32)
+        md.Trajectory(xyz=xyz, topology=topology).save(filename)
+        filenames.append(filename)
+    return filenames
+
+
+def test_featurize_files_parallel():
+    tempdir = tempfile.mkdtemp()
+    try:
+        filenames = _write_trajectories(tempdir, [10, 3, 25, 7, 1, 12])
+        featurizer = RawPositionsFeaturizer(6)
+        for chunk in [0, 4]:
+            serial = list(featurize_files(filenames, featurizer, None,
+                                          chunk=chunk))
+            parallel = list(featurize_files(filenames, featurizer, None,
+                                            chunk=chunk, n_jobs=2))
+            assert [f for f, _ in serial] == filenames
+            assert [f for f, _ in parallel] == filenames
+            for (_, expected), (_, features) in zip(serial, parallel):
+                assert len(features) == len(expected)
+                for x, y in zip(expected, features):
+                    np.testing.assert_array_equal(x, y)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+class _CountingFeaturizer(RawPositionsFeaturizer):
+    # counts the frames it featurizes (in a private attribute, which isn't
+    # part of the cache fingerprint)
+    _n_frames = 0
+
+    def featurize(self, traj):
+        _CountingFeaturizer._n_frames += len(traj)
+        return super(_CountingFeaturizer, self).featurize(traj)
+
+
+def test_featurization_cache():
+    tempdir = tempfile.mkdtemp()
+    try:
+        filenames = _write_trajectories(tempdir, [10, 20])
+        cache = FeaturizationCache(os.path.join(tempdir, 'cache'))
+        featurizer = _CountingFeaturizer(6)
+
+        def featurize():
+            start = _CountingFeaturizer._n_frames
+            X = [x for _, (x,) in featurize_files(filenames, featurizer, None,
+                                                   cache=cache)]
+            return X, _CountingFeaturizer._n_frames - start
+
+        X, n_featurized = featurize()
+        assert n_featurized == 30
+        # both files are hits
+        Y, n_featurized = featurize()
+        assert n_featurized == 0
+        for x, y in zip(X, Y):
+            assert y.dtype == np.float32
+            np.testing.assert_array_almost_equal(x, y)
+
+        # a new modification time invalidates the entry of a file
+        st = os.stat(filenames[0])
+        os.utime(filenames[0], (st.st_atime, st.st_mtime + 10))
+        _, n_featurized = featurize()
+        assert n_featurized == 10
+
+        # and so does a new size
+        _write_trajectories(tempdir, [15])
+        Y, n_featurized = featurize()
+        assert n_featurized == 15
+        assert len(Y[0]) == 15
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def test_featurization_cache_eviction():
+    tempdir = tempfile.mkdtemp()
+    try:
+        features = [random.randn(10, 6).astype(np.float32) for _ in range(4)]
+        cache = FeaturizationCache(tempdir)
+        cache.put('a', [features[0]])
+        entry_size = os.path.getsize(os.path.join(tempdir, 'a.npy'))
+        cache.max_size = 3 * entry_size
+        cache.put('b', [features[1]])
+        cache.put('c', [features[2]])
+        # b is the least recently used entry, after a is read
+        for i, key in enumerate('abc'):
+            path = os.path.join(tempdir, key + '.npy')
+            os.utime(path, (1000 + i, 1000 + i))
+        np.testing.assert_array_equal(cache.get('a', 0)[0], features[0])
+
+        cache.put('d', [features[3]])
+        assert 'b' not in cache
+        for key in 'acd':
+            assert key in cache
+        np.testing.assert_array_equal(cache.get('d', 4)[1], features[3][4:8])
+
+        # the directory is only scanned again when the size of the entries
+        # put since the last scan takes the cache past max_size
+        scans = []
+        evict = cache.evict
+        cache.evict = lambda: scans.append(evict())
+        cache.max_size = 5 * entry_size
+        cache.put('e', [features[0]])
+        cache.put('f', [features[1]])
+        assert len(scans) == 0
+        cache.put('g', [features[2]])
+        assert len(scans) == 1
+        assert 'c' not in cache
+        for key in 'adefg':
+            assert key in cache
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def test_feature_stream():
+    tempdir = tempfile.mkdtemp()
+    try:
+        lengths = [10, 3, 25, 7, 1, 12, 9, 4]
+        filenames = _write_trajectories(tempdir, lengths)
+        featurizer = RawPositionsFeaturizer(6)
+        expected = [x for _, (x,) in featurize_files(filenames, featurizer, None)]
+
+        # chunks never span two files
+        starts = [(file_id, start, len(X)) for file_id, start, X in
+                  featurize_chunks(filenames, featurizer, None, chunk=4)]
+        assert starts[:4] == [(0, 0, 4), (0, 4, 4), (0, 8, 2), (1, 0, 3)]
+        assert sum(n for _, _, n in starts) == sum(lengths)
+
+        stream = FeatureStream(filenames, featurizer, None, chunk=4, n_jobs=2)
+        first = list(stream)
+        assert all(X.dtype == np.float32 and len(X) <= 4 for X in first)
+        np.testing.assert_array_almost_equal(np.concatenate(first),
+                                             np.concatenate(expected))
+        np.testing.assert_array_equal(stream.index.lengths, lengths)
+        assert stream.n_frames == sum(lengths)
+
+        # later passes read the spilled features back
+        spill = stream._spill
+        second = list(stream)
+        np.testing.assert_array_equal(np.concatenate(second),
+                                      np.concatenate(first))
+        stream.close()
+        assert not os.path.exists(spill)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def test_frame_index():
+    index = FrameIndex(['a', 'b', 'c', 'd'], [3, 0, 2, 4])
+    assert len(index) == 9
+    file_ids, frames = index.locate([0, 2, 3, 4, 5, 8])
+    assert file_ids.dtype == np.int32 and frames.dtype == np.int32
+    np.testing.assert_array_equal(file_ids, [0, 0, 2, 2, 3, 3])
+    np.testing.assert_array_equal(frames, [0, 2, 0, 1, 0, 3])
+
+    # locate agrees with the per-row arrays
+    np.testing.assert_array_equal(index.locate(np.arange(9))[0], index.file_ids())
+    np.testing.assert_array_equal(index.locate(np.arange(9))[1], index.frames())
+
+    for bad in [[-1], [9]]:
+        try:
+            index.locate(bad)
+        except IndexError:
+            pass
+        else:
+            raise AssertionError('locate(%s) should have raised' % bad)
@@ -0,0 +1,71 @@
+import numpy as np
+from mixtape import hotstart
+
+random = np.random.RandomState(0)
+
+
+def test_reservoir_sample_pairs():
+    # frame values are unique, so the sampled pairs can be identified
+    lengths = [5, 300, 40, 1000]
+    sequences = [np.arange(n, dtype=float)[:, np.newaxis] + 10000 * k
+                 for k, n in enumerate(lengths)]
+    n_pairs = sum(n - 1 for n in lengths)
+
+    hits = np.zeros(10000 * len(lengths))
+    for _ in range(1000):
+        first, second = hotstart.reservoir_sample_pairs(sequences, 50, random)
+        assert first.shape == (50, 1)
+        np.testing.assert_array_equal(second, first + 1)
+        assert len(np.unique(first)) == 50
+        np.add.at(hits, first[:, 0].astype(int), 1)
+
+    # every pair is sampled, with probability 50 / n_pairs
+    hits = hits[hits > 0]
+    assert len(hits) == n_pairs
+    expected = 1000 * 50.0 / n_pairs
+    assert abs(hits.mean() - expected) < 1e-8
+    assert hits.std() < 2 * np.sqrt(expected)
+
+
+def test_reservoir_sample_pairs_small():
+    sequences = [random.randn(10, 2), random.randn(1, 2), random.randn(4, 2)]
+    first, second = hotstart.reservoir_sample_pairs(sequences, 100, random)
+    assert first.shape == (12, 2)
+    assert second.shape == (12, 2)
+
+
+def test_kmeans_hotstart():
+    centers = np.array([[-10.0, 0.0], [10.0, 0.0]])
+    # long dwells in each state, with rare switches
+    states = np.repeat(np.arange(100) % 2, 50)
+    sequences = [centers[states] + random.randn(len(states), 2)
+                 for _ in range(3)]
+
+    means, covars, counts = hotstart.kmeans_hotstart(
+        sequences, 2, n_samples=2000, covariance_type='full', random_state=0)
+    order = np.argsort(means[:, 0])
+    np.testing.assert_array_almost_equal(means[order], centers, decimal=0)
+    for k in range(2):
+        np.testing.assert_array_almost_equal(covars[k], np.eye(2), decimal=0)
+    assert counts.sum() == 2000
+    assert np.trace(counts) > 0.9 * counts.sum()
+
+    _, variances, _ = hotstart.kmeans_hotstart(sequences, 2, n_samples=2000,
+                                               random_state=0)
+    assert variances.shape == (2, 2)
+
+
+def test_vonmises_hotstart():
+    # two states straddling the branch cut at +/- pi
+    centers = np.array([[np.pi - 0.1], [0.5]])
+    states = np.repeat(np.arange(100) % 2, 50)
+    X = centers[states] + 0.1 * random.randn(len(states), 1)
+    X = np.arctan2(np.sin(X), np.cos(X))
+
+    means, kappas, counts = hotstart.vonmises_hotstart(
+        [X], 2, n_samples=2000, random_state=0)
+    order = np.argsort(np.cos(means[:, 0]))
+    np.testing.assert_array_almost_equal(
+        np.cos(means[order] - centers[[0, 1]]), np.ones((2, 1)), decimal=2)
+    # the concentration of N(0, 0.1**2) wrapped is about 1 / 0.1**2
+    assert np.all(kappas > 50)
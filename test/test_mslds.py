@@ -5,11 +5,19 @@ currently, the means and covariances are estimated exactly as with a Gaussian HM
 Then, afterwards, the A, b and Q are estimated. So, we can do a lot of testing
 by comparing to a reference gaussian HMM implementation
 '''
+import sys
 import string
 import numpy as np
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 from sklearn.hmm import GaussianHMM
 from sklearn.utils.extmath import logsumexp
-from mixtape.mslds import MetastableSwitchingLDS
+from cvxopt import solvers
+from mixtape.mslds import MetastableSwitchingLDS, _A_update_state, _Q_update_state
+from mixtape.mslds_solvers.mslds_A_sdp import solve_A
+from mixtape.mslds_solvers.mslds_Q_sdp import solve_Q
 from mixtape import _switching_var1
 
 N_STATES = 2
@@ -88,5 +96,255 @@ def test_sufficient_statistics():
     yield lambda: np.testing.assert_array_almost_equal(stats['obs[:-1]*obs[:-1].T'], rstats['obs[:-1]*obs[:-1].T'], decimal=3)
     yield lambda: np.testing.assert_array_almost_equal(stats['trans'], rstats['trans'], decimal=3)
 
+def _random_sdp_inputs(random, n_features):
+    # a stable A, and the statistics of a VAR(1) process
+    X = random.randn(200, n_features)
+    A = random.randn(n_features, n_features)
+    A *= 0.5 / np.linalg.norm(A, 2)
+    Y = np.dot(X, A.T) + 0.3 * random.randn(200, n_features)
+    M = random.randn(n_features, n_features)
+    Sigma = 0.1 * np.dot(M, M.T) + np.eye(n_features)
+    return X, Y, A, Sigma
+
+
+def test_A_update_closed_form():
+    # when the least squares A satisfies the constraints, it is the optimum
+    # of the A SDP
+    solvers.options['show_progress'] = False
+    random = np.random.RandomState(0)
+    n_features = 2
+    for _ in range(3):
+        X, Y, _, Sigma = _random_sdp_inputs(random, n_features)
+        B, C, E = np.dot(Y.T, X), np.zeros((n_features, n_features)), np.dot(X.T, X)
+        Q = 0.1 * np.eye(n_features)
+        A, _ = _A_update_state((n_features, B, C, E, Sigma, Q, None))
+        sol = solve_A(n_features, B, C, E, Sigma, Q)[0]
+        avec = np.array(sol['x'])[1 + n_features * (n_features + 1) // 2:]
+        np.testing.assert_array_almost_equal(
+            A, np.reshape(avec, (n_features, n_features), order='F'), decimal=5)
+
+
+def test_Q_update_closed_form():
+    # the Q SDP is minimized by the largest feasible Q, Sigma - A Sigma A.T
+    solvers.options['show_progress'] = False
+    random = np.random.RandomState(1)
+    n_features = 2
+    for _ in range(3):
+        X, Y, A, Sigma = _random_sdp_inputs(random, n_features)
+        residuals = Y - np.dot(X, A.T)
+        B = np.dot(residuals.T, residuals)
+        Q, _ = _Q_update_state((n_features, A, B, Sigma, None))
+        sol = solve_Q(n_features, A, B, Sigma)[0]
+        qvec = np.ravel(sol['x'])[1 + n_features * (n_features + 1) // 2:]
+        Q_sdp = np.zeros((n_features, n_features))
+        for j in range(n_features):
+            for k in range(j + 1):
+                Q_sdp[j, k] = Q_sdp[k, j] = qvec[j * (j + 1) // 2 + k]
+        np.testing.assert_array_almost_equal(Q, Q_sdp, decimal=5)
+
+
 def test_gaussian_loglikelihood_full():
     _switching_var1.test_gaussian_loglikelihood_full()
+
+def test_switching_var1_loglikelihood():
+    _switching_var1.test_switching_var1_loglikelihood()
+
+def _switching_model(**kwargs):
+    # a two state model in two dimensions, with well separated wells at
+    # (10, 0) and (0, 2)
+    n_features = 2
+    model = MetastableSwitchingLDS(n_states=N_STATES, n_features=n_features, **kwargs)
+    model.transmat_ = np.array([[0.9, 0.1], [0.2, 0.8]])
+    model.populations_ = np.array([2.0/3, 1.0/3])
+    model.means_ = np.zeros((N_STATES, n_features))
+    model.covars_ = np.array([np.eye(n_features)] * N_STATES)
+    model.As_ = np.array([0.9 * np.eye(n_features), 0.5 * np.eye(n_features)])
+    model.bs_ = np.array([[1.0, 0.0], [0.0, 1.0]])
+    model.Qs_ = np.array([0.01 * np.eye(n_features), 0.04 * np.eye(n_features)])
+    return model
+
+
+def test_sample():
+    # the sampled trajectories follow the switching VAR(1) recursion, and
+    # are reproducible given a seed
+    n_features = 2
+    model = _switching_model()
+
+    obs, states = model.sample(100000, random_state=0)
+    assert obs.shape == (100000, n_features)
+    assert states.shape == (100000,)
+
+    counts = np.zeros((N_STATES, N_STATES))
+    np.add.at(counts, (states[:-1], states[1:]), 1)
+    np.testing.assert_array_almost_equal(
+        counts / counts.sum(axis=1)[:, np.newaxis], model.transmat_, decimal=2)
+    for k in range(N_STATES):
+        mask = states[:-1] == k
+        residuals = obs[1:][mask] - np.dot(obs[:-1][mask], model.As_[k].T) - model.bs_[k]
+        np.testing.assert_array_almost_equal(np.cov(residuals.T), model.Qs_[k], decimal=3)
+
+    obs1, states1 = model.sample(100, n_chains=4, random_state=1)
+    obs2, states2 = model.sample(100, n_chains=4, random_state=1)
+    assert obs1.shape == (4, 100, n_features)
+    np.testing.assert_array_equal(obs1, obs2)
+    np.testing.assert_array_equal(states1, states2)
+
+
+def _fit_sequences():
+    model = _switching_model()
+    return [model.sample(500, random_state=i)[0] for i in range(2)]
+
+
+def test_fit_logprob_increases():
+    # the E-step log likelihood is that of a gaussian HMM, whose M-step is
+    # exact without the covariance prior (up to the reversible transition
+    # matrix and its stationary start probabilities)
+    solvers.options['show_progress'] = False
+    sequences = _fit_sequences()
+    model = MetastableSwitchingLDS(n_states=N_STATES, n_features=2, n_iter=8,
+        covars_prior=0, thresh=0, random_state=0)
+    model.fit(sequences)
+    logprob = np.array(model.fit_logprob_)
+    assert len(logprob) == 8
+    assert np.all(np.diff(logprob) >= -1e-4 * np.abs(logprob[:-1]))
+
+
+def test_fit_thresh():
+    # the fit stops at the first iteration whose relative gain in log
+    # likelihood is below thresh, before n_iter
+    solvers.options['show_progress'] = False
+    sequences = _fit_sequences()
+    thresh = 1e-2
+    model = MetastableSwitchingLDS(n_states=N_STATES, n_features=2, n_iter=50,
+        thresh=thresh, random_state=0)
+    model.fit(sequences)
+    logprob = model.fit_logprob_
+    assert 1 < len(logprob) < 50
+    gains = np.abs(np.diff(logprob)) / np.abs(logprob[:-1])
+    assert gains[-1] < thresh
+    assert np.all(gains[:-1] >= thresh)
+
+
+def test_fit_callback():
+    # the callback is called once per iteration, after the E-step
+    solvers.options['show_progress'] = False
+    sequences = _fit_sequences()
+    calls = []
+    def callback(model, i, logprob):
+        calls.append((i, logprob))
+
+    model = MetastableSwitchingLDS(n_states=N_STATES, n_features=2, n_iter=4,
+        thresh=0, timing=True, random_state=0)
+    model.fit(sequences, callback=callback)
+    assert [i for i, _ in calls] == list(range(4))
+    np.testing.assert_array_equal([l for _, l in calls], model.fit_logprob_)
+    assert model.mean_fit_time_ > 0
+    assert model.std_fit_time_ >= 0
+
+
+def test_fit_verbose():
+    solvers.options['show_progress'] = False
+    sequences = _fit_sequences()
+    model = MetastableSwitchingLDS(n_states=N_STATES, n_features=2, n_iter=3,
+        thresh=0, verbose=True, random_state=0)
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        model.fit(sequences)
+        output = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    lines = [l for l in output.splitlines() if l.startswith('Iteration')]
+    assert len(lines) == 3
+    assert not hasattr(model, 'mean_fit_time_')
+
+
+def test_stats_thresh():
+    # the A and Q of states whose sufficient statistics moved by less than
+    # stats_thresh keep their values, the others are solved again
+    solvers.options['show_progress'] = False
+    sequences = _fit_sequences()
+    model = _switching_model(params='aqb', stats_thresh=1e-3)
+    model._impl._sequences = sequences
+    _, stats = model._impl.do_estep()
+    model._do_mstep(stats, set(model.params))
+
+    As, Qs, bs = model.As_.copy(), model.Qs_.copy(), model.bs_.copy()
+    moved = dict((key, np.array(value)) for key, value in stats.items())
+    moved['obs*obs[t-1].T'][0] *= 0.9
+    moved['obs*obs[t-1].T'][1] *= 1 + 1e-5
+    model._do_mstep(moved, set(model.params))
+
+    np.testing.assert_array_equal(model.As_[1], As[1])
+    np.testing.assert_array_equal(model.Qs_[1], Qs[1])
+    np.testing.assert_array_equal(model.bs_[1], bs[1])
+    assert np.abs(model.As_[0] - As[0]).max() > 1e-3
+    assert np.abs(model.Qs_[0] - Qs[0]).max() > 0
+
+
+def _log_multivariate_normal(X, mean, covar):
+    # log density of each row of X under N(mean, covar)
+    n_features = X.shape[1]
+    chol = np.linalg.cholesky(covar)
+    solved = np.linalg.solve(chol, (X - mean).T)
+    return -0.5 * (np.sum(solved**2, axis=0) + n_features * np.log(2 * np.pi)
+                   + 2 * np.sum(np.log(np.diag(chol))))
+
+
+def _reference_decode(model, seq):
+    # forward-backward and viterbi in log space, with the switching VAR(1)
+    # emissions
+    seq = np.asarray(seq, dtype=np.float64)
+    n_samples = len(seq)
+    framelogprob = np.zeros((n_samples, model.n_states))
+    for k in range(model.n_states):
+        framelogprob[0, k] = _log_multivariate_normal(
+            seq[:1], model.means_[k], model.covars_[k])[0]
+        framelogprob[1:, k] = _log_multivariate_normal(
+            seq[1:] - np.dot(seq[:-1], model.As_[k].T), model.bs_[k], model.Qs_[k])
+    log_transmat = np.log(model.transmat_)
+    log_startprob = np.log(model.populations_)
+
+    fwd = np.zeros_like(framelogprob)
+    bwd = np.zeros_like(framelogprob)
+    fwd[0] = log_startprob + framelogprob[0]
+    for t in range(1, n_samples):
+        fwd[t] = logsumexp(fwd[t-1][:, np.newaxis] + log_transmat, axis=0) + framelogprob[t]
+    for t in range(n_samples - 2, -1, -1):
+        bwd[t] = logsumexp(log_transmat + framelogprob[t+1] + bwd[t+1], axis=1)
+    logprob = logsumexp(fwd[-1])
+    posteriors = np.exp(fwd + bwd - logprob)
+
+    delta = log_startprob + framelogprob[0]
+    pointers = np.zeros((n_samples, model.n_states), dtype=int)
+    for t in range(1, n_samples):
+        scores = delta[:, np.newaxis] + log_transmat
+        pointers[t] = np.argmax(scores, axis=0)
+        delta = np.max(scores, axis=0) + framelogprob[t]
+    path = np.zeros(n_samples, dtype=int)
+    path[-1] = np.argmax(delta)
+    for t in range(n_samples - 1, 0, -1):
+        path[t-1] = pointers[t, path[t]]
+    return logprob, np.max(delta), path, posteriors
+
+
+def test_decode():
+    # score, predict and predict_proba against a reference forward-backward
+    # and viterbi with the switching VAR(1) emissions
+    model = _switching_model()
+    sequences = [model.sample(200, random_state=i)[0].astype(np.float32)
+                 for i in range(2)]
+    reference = [_reference_decode(model, seq) for seq in sequences]
+
+    np.testing.assert_allclose(model.score(sequences),
+        sum(r[0] for r in reference), rtol=1e-4)
+
+    viterbi_logprob, paths = model.predict(sequences)
+    np.testing.assert_allclose(viterbi_logprob,
+        sum(r[1] for r in reference), rtol=1e-4)
+    for path, r in zip(paths, reference):
+        np.testing.assert_array_equal(path, r[2])
+
+    posteriors = model.predict_proba(sequences)
+    for post, r in zip(posteriors, reference):
+        np.testing.assert_array_almost_equal(post, r[3], decimal=3)
@@ -0,0 +1,65 @@
+import warnings
+import numpy as np
+import scipy.linalg
+from mixtape import mslds_analysis
+from mixtape.utils import iter_vars
+
+random = np.random.RandomState(0)
+
+
+def _random_stable(n_states, n_features):
+    As = random.randn(n_states, n_features, n_features)
+    for k in range(n_states):
+        As[k] *= 0.9 / np.abs(np.linalg.eigvals(As[k])).max()
+    Qs = random.randn(n_states, n_features, n_features)
+    Qs = np.array([np.dot(Q, Q.T) + np.eye(n_features) for Q in Qs])
+    return As, Qs
+
+
+def test_solve_lyapunov():
+    As, Qs = _random_stable(4, 5)
+    Ds = mslds_analysis.solve_lyapunov(As, Qs)
+    for k in range(len(As)):
+        ref = scipy.linalg.solve_discrete_lyapunov(As[k], Qs[k])
+        np.testing.assert_array_almost_equal(Ds[k], ref)
+        np.testing.assert_array_almost_equal(
+            Qs[k] + np.dot(As[k], np.dot(Ds[k], As[k].T)), Ds[k])
+
+
+def test_solve_lyapunov_defective():
+    # a Jordan block isn't diagonalizable, so it goes through the fallback
+    As = np.array([[[0.5, 1.0], [0.0, 0.5]]])
+    Qs = np.array([np.eye(2)])
+    Ds = mslds_analysis.solve_lyapunov(As, Qs)
+    np.testing.assert_array_almost_equal(Ds[0], iter_vars(As[0], Qs[0], 1000))
+
+
+def test_solve_lyapunov_unstable():
+    As, Qs = _random_stable(3, 2)
+    As[1] = 1.5 * np.eye(2)
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter('always')
+        Ds = mslds_analysis.solve_lyapunov(As, Qs)
+    assert len(w) == 1
+    assert np.all(np.isnan(Ds[1]))
+    assert np.all(np.isfinite(Ds[[0, 2]]))
+
+
+def test_metastable_wells():
+    As, _ = _random_stable(3, 4)
+    bs = random.randn(3, 4)
+    wells = mslds_analysis.metastable_wells(As, bs)
+    for k in range(3):
+        np.testing.assert_array_almost_equal(
+            np.dot(As[k], wells[k]) + bs[k], wells[k])
+
+
+def test_eigenspectra():
+    As, _ = _random_stable(3, 4)
+    spectra = mslds_analysis.eigenspectra(As)
+    for k in range(3):
+        np.testing.assert_array_almost_equal(
+            np.sort_complex(np.diag(spectra[k])),
+            np.sort_complex(np.linalg.eigvals(As[k])))
+    np.testing.assert_array_almost_equal(
+        mslds_analysis.spectral_radius(As), 0.9 * np.ones(3))
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import numpy as np
+from mixtape.utils import (assignment_to_weights, empirical_wells, means_match,
+                           save_indices, load_indices)
+
+random = np.random.RandomState(0)
+
+
+def test_empirical_wells():
+    K = 3
+    assignments = random.randint(K, size=1000)
+    Ys = random.randn(1000, 2) + 100 + assignments[:, np.newaxis]
+    W = assignment_to_weights(assignments, K)
+    np.testing.assert_array_equal(W.sum(axis=1), np.ones(1000))
+    np.testing.assert_array_equal(W.argmax(axis=1), assignments)
+
+    means, covars = empirical_wells(Ys, W, chunk_size=128)
+    for k in range(K):
+        Yk = Ys[assignments == k]
+        np.testing.assert_array_almost_equal(means[k], Yk.mean(axis=0))
+        np.testing.assert_array_almost_equal(covars[k],
+                                             np.cov(Yk.T, bias=True))
+
+
+def test_means_match():
+    base_means = np.array([[0.0, 0.0], [1.0, 0.0], [2.0, 0.0]])
+    # state 0 is the closest to both of the first two base states, so a
+    # greedy matching isn't one-to-one
+    means = np.array([[0.6, 0.0], [2.1, 0.0], [-0.5, 0.0]])
+    assignments = np.array([0, 1, 2, 2, 0])
+
+    matching, new_assignments = means_match(base_means, means, assignments)
+    np.testing.assert_array_equal(matching, [2, 0, 1])
+    np.testing.assert_array_equal(new_assignments, [1, 2, 0, 0, 1])
+
+
+def test_load_indices():
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        pairs = np.array([[0, 5], [1, 2], [3, 4]])
+        save_indices(filename, pairs)
+        loaded = load_indices(filename)
+        assert loaded.dtype == np.int32
+        np.testing.assert_array_equal(loaded, pairs)
+
+        # a 1-dimensional array of atoms is loaded as a column
+        save_indices(filename, [4, 2, 7])
+        np.testing.assert_array_equal(load_indices(filename), [[4], [2], [7]])
+
+        # text index files, from older versions
+        np.savetxt(filename, pairs, '%d')
+        np.testing.assert_array_equal(load_indices(filename), pairs)
+        np.savetxt(filename, [[0, 1, 2, 3]], '%d')
+        assert load_indices(filename).shape == (1, 4)
+    finally:
+        os.unlink(filename)
@@ -3,9 +3,10 @@ import sys
 import time
 
 import numpy as np
-from mixtape.vmhmm import VonMisesHMM, inverse_mbessel_ratio, circwrap
+import scipy.special
+from mixtape.vmhmm import VonMisesHMM, inverse_mbessel_ratio, circwrap, _trig_planes
 from mixtape import _vmhmm
-from sklearn.hmm import GaussianHMM
+from sklearn.hmm import GaussianHMM, _BaseHMM
 
 try:
     from munkres import Munkres
@@ -30,6 +31,17 @@ def test_3():
     np.testing.assert_array_almost_equal(y, y2, decimal=4)
 
 
+def test_inverse_mbessel_ratio_throughput():
+    y = np.random.uniform(1e-3, 0.999, size=10**6)
+    t0 = time.time()
+    x = inverse_mbessel_ratio(y)
+    t1 = time.time()
+
+    print('inverse_mbessel_ratio: %.3g evaluations/s' % (len(y) / (t1 - t0)))
+    assert x.shape == y.shape
+    np.testing.assert_array_almost_equal(inverse_mbessel_ratio.bessel_ratio(x), y, decimal=6)
+
+
 def test_6():
     """"Test that _c_fitkappa is consistent with the two-step python
     implementation"""
@@ -41,10 +53,10 @@ def test_6():
     means = np.random.randn(13, 7)
     
     vm.kappas_ = kappas
-    vm._c_fitkappas(posteriors, obs, means)
+    vm._c_fitkappas(posteriors, np.cos(obs), np.sin(obs), means)
     c_kappas = np.copy(vm._kappas_)
     
-    vm._py_fitkappas(posteriors, obs, means)
+    vm._py_fitkappas(posteriors, np.cos(obs), np.sin(obs), means)
     py_kappas = np.copy(vm._kappas_)
     np.testing.assert_array_almost_equal(py_kappas, c_kappas)
 
@@ -94,10 +106,103 @@ def test_log_likelihood():
     from scipy.stats.distributions import vonmises
     reference = np.array([np.sum(vonmises.logpdf(obs, vm.kappas_[i], vm.means_[i]), axis=1) for i in range(n_states)]).T
     t1 = time.time()
-    value = _vmhmm._compute_log_likelihood(obs, vm.means_, vm.kappas_)
+    value = _vmhmm._compute_log_likelihood(np.cos(obs), np.sin(obs), vm.means_, vm.kappas_)
     t2 = time.time()
 
     print("Log likeihood timings")
     print('reference time ', t1-t0)
     print('c time         ', t2-t1)
     np.testing.assert_array_almost_equal(reference, value)
+
+    log_normalizer = _vmhmm._log_normalizer(vm.kappas_)
+    np.testing.assert_array_almost_equal(
+        log_normalizer, np.sum(np.log(2*np.pi*scipy.special.i0(vm.kappas_)), axis=1))
+    value2 = _vmhmm._compute_log_likelihood(np.cos(obs), np.sin(obs), vm.means_, vm.kappas_, log_normalizer)
+    np.testing.assert_array_almost_equal(reference, value2)
+
+
+def test_log_likelihood_precision():
+    n_samples, n_states, n_features = 1000, 5, 4
+    obs = np.random.uniform(-np.pi, np.pi, size=(n_samples, n_features))
+    means = np.random.uniform(-np.pi, np.pi, size=(n_states, n_features))
+    kappas = np.random.uniform(0.5, 5, size=(n_states, n_features))
+    reference = _vmhmm._compute_log_likelihood(np.cos(obs), np.sin(obs), means, kappas)
+
+    cos_obs, sin_obs = _trig_planes([obs], dtype=np.float32)
+    mixed = _vmhmm._compute_log_likelihood(cos_obs, sin_obs, means, kappas, None, 'mixed')
+    single = _vmhmm._compute_log_likelihood(cos_obs, sin_obs, means, kappas, None, 'single')
+    assert mixed.dtype == np.float64
+    assert single.dtype == np.float32
+    np.testing.assert_allclose(mixed, reference, rtol=1e-5)
+    np.testing.assert_allclose(single, reference, rtol=1e-4)
+
+    posteriors = np.random.rand(n_samples, n_states)
+    out64 = np.empty((n_states, n_features))
+    out32 = np.empty((n_states, n_features))
+    _vmhmm._fitinvkappa(posteriors, np.cos(obs), np.sin(obs), means, out64)
+    _vmhmm._fitinvkappa(posteriors, cos_obs, sin_obs, means, out32)
+    np.testing.assert_allclose(out32, out64, rtol=1e-5)
+
+
+def test_fit_precision():
+    np.random.seed(42)
+    sequences = [np.random.uniform(-np.pi, np.pi, size=(200, 3)) for i in range(3)]
+    models = {}
+    for precision in ['single', 'mixed']:
+        np.random.seed(0)
+        models[precision] = VonMisesHMM(n_states=2, n_iter=5, precision=precision).fit(sequences)
+    np.testing.assert_allclose(models['single'].fit_logprob_, models['mixed'].fit_logprob_, rtol=1e-3)
+
+
+def test_trig_planes():
+    sequences = [np.random.randn(10, 3), np.random.randn(5, 3)]
+    cos_obs, sin_obs = _trig_planes(sequences)
+    np.testing.assert_array_almost_equal(cos_obs, np.cos(np.vstack(sequences)))
+    np.testing.assert_array_almost_equal(sin_obs, np.sin(np.vstack(sequences)))
+    assert cos_obs.flags.c_contiguous and sin_obs.flags.c_contiguous
+    assert cos_obs.ctypes.data % 32 == 0 and sin_obs.ctypes.data % 32 == 0
+
+
+def test_decode():
+    # integer parameters are cast to double by the setters
+    yield _check_decode, np.array([[0, 0], [2, -2], [-2, 2]]), \
+        np.array([[1, 2], [3, 4], [2, 1]])
+    yield _check_decode, np.array([[0.5, 0.0], [2.5, -1.5], [-2.0, 2.5]]), \
+        np.array([[1.5, 2.0], [3.0, 4.5], [2.0, 1.0]])
+
+
+def _check_decode(means, kappas):
+    np.random.seed(42)
+    vm = VonMisesHMM(n_states=3)
+    vm.means_ = means
+    vm.kappas_ = kappas
+    assert vm.means_.dtype == np.float64 and vm.kappas_.dtype == np.float64
+    vm.transmat_ = np.array([[0.8, 0.1, 0.1], [0.1, 0.8, 0.1], [0.1, 0.1, 0.8]])
+    sequences = [vm.sample(n)[0] for n in [100, 1, 50]]
+
+    t0 = time.time()
+    reference = [_BaseHMM.decode(vm, seq) for seq in sequences]
+    ref_posteriors = [_BaseHMM.predict_proba(vm, seq) for seq in sequences]
+    t1 = time.time()
+    logprob, labels = vm.decode(sequences)
+    posteriors = vm.predict_proba(sequences)
+    t2 = time.time()
+
+    print("Decoding timings")
+    print('reference time ', t1-t0)
+    print('c time         ', t2-t1)
+    np.testing.assert_almost_equal(logprob, sum(r[0] for r in reference))
+    for i in range(len(sequences)):
+        assert labels[i].dtype == np.int32
+        assert posteriors[i].dtype == np.float32
+        np.testing.assert_array_equal(labels[i], reference[i][1])
+        np.testing.assert_array_almost_equal(posteriors[i], ref_posteriors[i], decimal=5)
+
+    # a single array, and a ragged buffer
+    np.testing.assert_array_equal(vm.predict(sequences[0]), reference[0][1])
+    np.testing.assert_array_equal(
+        vm.predict(np.vstack(sequences), lengths=[100, 1, 50]),
+        np.concatenate([r[1] for r in reference]))
+    np.testing.assert_array_almost_equal(
+        vm.predict_proba(np.vstack(sequences), lengths=[100, 1, 50]),
+        np.vstack(ref_posteriors), decimal=5)